@@ -1,20 +1,74 @@
 from __future__ import annotations
 
 import hashlib
+import json
 import os
 import tempfile
+import traceback
+import uuid
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote, unquote
 
 from flask import Flask, jsonify, render_template, request
-from google.cloud import storage, bigquery
+from google.api_core.exceptions import PreconditionFailed
+from google.cloud import bigquery
 
 from src.config import get_settings
-from src.gcp.run_jobs import CloudRunJobsRunner
+from src.gcp.dedup_index import DedupIndex, get_dedup_index
+from src.gcp.run_jobs import CloudRunJobsRunner, RunJobResult
+from src.gcp.storage_client import GCSObject, StorageClient
+from src.pipelines.archives import (
+    ARCHIVE_EXT,
+    ARCHIVE_MIME,
+    ARCHIVE_ZIP,
+    archive_kind,
+    readable_archive_kind,
+    zstd_available,
+)
+from src.uploads.batcher import ManifestItem, VideoJobBatcher
+from src.uploads.chunked import UploadSessionError, UploadSessionStore
+from src.uploads.tickets import (
+    STAGE_CHECKING,
+    STAGE_DISPATCHING,
+    STAGE_UPLOADING,
+    IngestTicketRegistry,
+    IngestWork,
+    StageCallback,
+)
+
+SOURCE_TYPES = {"public", "captured", "simulated"}
+UPLOAD_KINDS = {"video", "images_zip"}
+DIRECT_UPLOAD_DIR = "direct"
+FINALIZED_META_KEY = "hud-finalized"
+SHA256_HEX_LEN = 64
+MAX_CHECK_IMAGES = 5000
+# .tar.zst solo si está instalado zstandard (si no, el Job no podría leerlo)
+ARCHIVE_FORMAT_ERROR = (
+    "Formato no soportado. Usa .zip, .tar, .tar.gz o .tar.zst."
+    if zstd_available()
+    else "Formato no soportado. Usa .zip, .tar o .tar.gz."
+)
+
+# (cuerpo JSON, código HTTP) de un staging; se serializa en la vista
+IngestResult = Tuple[Dict[str, Any], int]
+
+
+def _no_stage(stage: str) -> None:
+    pass
 
 
 def _bq_video_exists(
-    bq: bigquery.Client, dataset: str, table: str, video_uid: str
+    bq: bigquery.Client,
+    dataset: str,
+    table: str,
+    video_uid: str,
+    dedup: Optional[DedupIndex] = None,
 ) -> bool:
+    # Negativo definitivo del índice (a su última lectura): no se consulta BQ
+    if dedup is not None and dedup.videos.might_contain(video_uid) is False:
+        return False
+
     q = f"""
     SELECT 1
     FROM `{bq.project}.{dataset}.{table}`
@@ -30,28 +84,578 @@ def _bq_video_exists(
     return any(True for _ in job.result())
 
 
+def _bq_images_existing(
+    bq: bigquery.Client,
+    dataset: str,
+    table: str,
+    image_uids: List[str],
+    dedup: Optional[DedupIndex] = None,
+) -> Set[str]:
+    if dedup is not None:
+        image_uids = [
+            u for u in image_uids if dedup.images.might_contain(u) is not False
+        ]
+    if not image_uids:
+        return set()
+
+    q = f"""
+    SELECT image_uid
+    FROM `{bq.project}.{dataset}.{table}`
+    WHERE image_uid IN UNNEST(@uids)
+    """
+    job = bq.query(
+        q,
+        job_config=bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("uids", "STRING", image_uids)
+            ]
+        ),
+    )
+    return {row["image_uid"] for row in job.result()}
+
+
+def _is_sha256_hex(value: str) -> bool:
+    return len(value) == SHA256_HEX_LEN and all(c in "0123456789abcdef" for c in value)
+
+
 def create_app() -> Flask:
     app = Flask(__name__)
     settings = get_settings()
 
     jobs = CloudRunJobsRunner(
-        project_id=settings.gcp_project, region=settings.run_region
+        project_id=settings.gcp_project,
+        region=settings.run_region,
+        api_base_url=settings.run_api_base_url,
+        anonymous=settings.run_api_anonymous,
+        max_concurrent_dispatch=settings.run_dispatch_max_concurrent,
+        max_retries=settings.run_dispatch_max_retries,
+        timeout_s=settings.run_dispatch_timeout_s,
     )
-    storage_client = storage.Client(project=settings.gcp_project)
+    gcs = StorageClient(project_id=settings.gcp_project)
+    storage_client = gcs.client
     bq_client = bigquery.Client(project=settings.gcp_project)
+    dedup = get_dedup_index(bq_client, settings, storage_client)
+    if dedup is not None:
+        dedup.warm()
+    upload_sessions = UploadSessionStore(
+        spool_dir=settings.upload_spool_dir,
+        chunk_size=settings.upload_chunk_size,
+        ttl_s=settings.upload_session_ttl_s,
+        max_size=settings.upload_max_size,
+        max_sessions=settings.upload_max_sessions,
+    )
+    ingest_tickets = IngestTicketRegistry(
+        max_workers=settings.ingest_workers,
+        max_pending=settings.ingest_max_pending,
+        ttl_s=settings.ingest_ticket_ttl_s,
+    )
+
+    def _launch_video_batch(items: List[ManifestItem]) -> RunJobResult:
+        """Escribe el manifest del lote en GCS y lanza una ejecución."""
+        manifest_name = (
+            f"{settings.gcs_tmp_manifests_prefix}/videos/{uuid.uuid4().hex}.json"
+        )
+        manifest = gcs.upload_bytes(
+            settings.gcs_bucket,
+            manifest_name,
+            json.dumps({"version": 1, "items": items}).encode("utf-8"),
+            content_type="application/json",
+        )
+        print(f"[INFO] Launching Cloud Run Job for manifest {manifest.uri}")
+        return jobs.run_job(
+            job_name=settings.run_job_name,
+            env_overrides={"INPUT_MANIFEST_URI": manifest.uri},
+        )
+
+    video_batcher = (
+        VideoJobBatcher(
+            window_s=settings.video_batch_window_s,
+            max_items=settings.video_batch_max_items,
+            flush_fn=_launch_video_batch,
+        )
+        if settings.video_batch_enabled
+        else None
+    )
+
+    def _launch_video_job(
+        gcs_uri: str,
+        *,
+        source_type: str,
+        provider: str,
+        original_filename: str,
+        video_uid: Optional[str],
+    ) -> RunJobResult:
+        if video_batcher is not None:
+            # Espera al cierre del lote (como mucho VIDEO_BATCH_WINDOW_S)
+            return video_batcher.submit(
+                {
+                    "gcs_uri": gcs_uri,
+                    "source_type": source_type,
+                    "provider": provider,
+                    "original_filename": original_filename,
+                    "video_uid": video_uid or "",
+                }
+            ).result()
+
+        env = {
+            "INPUT_GCS_URI": gcs_uri,
+            "INPUT_SOURCE_TYPE": source_type,
+            "INPUT_PROVIDER": provider,
+            "INPUT_ORIGINAL_FILENAME": original_filename,
+        }
+        if video_uid:
+            env["INPUT_VIDEO_UID"] = video_uid
+        return jobs.run_job(job_name=settings.run_job_name, env_overrides=env)
+
+    def _launch_images_zip_job(
+        gcs_uri: str,
+        *,
+        source_type: str,
+        dataset_name: str,
+        provider: str,
+        original_filename: str,
+        zip_sha: Optional[str],
+    ) -> RunJobResult:
+        env = {
+            "INPUT_GCS_URI": gcs_uri,
+            "INPUT_SOURCE_TYPE": source_type,
+            "INPUT_DATASET_NAME": dataset_name,
+            "INPUT_PROVIDER": provider,
+            "INPUT_ORIGINAL_FILENAME": original_filename,
+        }
+        if zip_sha:
+            env["INPUT_ZIP_SHA"] = zip_sha
+        return jobs.run_job(
+            job_name=settings.run_images_zip_job_name, env_overrides=env
+        )
+
+    def _integrity_error(
+        expected_sha256: Optional[str], actual_sha256: str
+    ) -> Optional[IngestResult]:
+        """
+        El cliente puede enviar el SHA-256 que calculó en el navegador (para
+        el pre-check de duplicados); el servidor siempre recalcula y rechaza
+        si no coincide.
+        """
+        expected = (expected_sha256 or "").strip().lower()
+        if not expected or expected == actual_sha256:
+            return None
+        print(f"[WARN] SHA256 mismatch: client={expected} server={actual_sha256}")
+        return (
+            {
+                "ok": False,
+                "message": "El hash del archivo recibido no coincide (subida corrupta).",
+            },
+            400,
+        )
+
+    def _video_duplicate_error(video_uid: str) -> Optional[IngestResult]:
+        """
+        None si el vídeo es nuevo; si no, el error (409 duplicado o 500 si
+        BigQuery falla: mejor no subir para evitar duplicados accidentales).
+        """
+        print(f"[INFO] Checking if video {video_uid} already exists in BigQuery")
+        try:
+            exists = _bq_video_exists(
+                bq_client,
+                settings.bq_dataset,
+                settings.bq_table_videos,
+                video_uid,
+                dedup,
+            )
+        except Exception as e:
+            print("[ERROR] Checking video existence in BigQuery failed:", repr(e))
+            traceback.print_exc()
+            return (
+                {
+                    "ok": False,
+                    "message": "No se pudo verificar duplicados (BigQuery).",
+                },
+                500,
+            )
+
+        if exists:
+            print(f"[INFO] Video {video_uid} is a duplicate. Aborting upload.")
+            return (
+                {
+                    "ok": False,
+                    "duplicate": True,
+                    "message": "Duplicado: el vídeo ya existe.",
+                },
+                409,
+            )
+        return None
+
+    def _process_error(e: Exception, what: str) -> IngestResult:
+        print(f"[ERROR] {what} failed:", repr(e))
+        traceback.print_exc()
+        return {"ok": False, "message": "Ha ocurrido un error durante el proceso."}, 500
+
+    def _stage_video(
+        tmp_path: Path,
+        *,
+        video_uid: str,
+        ext: str,
+        original_filename: str,
+        content_type: Optional[str],
+        source_type: str,
+        provider: str,
+        expected_sha256: Optional[str] = None,
+        on_stage: StageCallback = _no_stage,
+    ) -> IngestResult:
+        """
+        Dedupe + subida a tmp/videos + lanzamiento del Job a partir de un
+        fichero local ya hasheado. Borra siempre el fichero local.
+        """
+        try:
+            # 2) Integridad + dedupe en BQ (NO subimos si existe)
+            on_stage(STAGE_CHECKING)
+            rejected = _integrity_error(
+                expected_sha256, video_uid
+            ) or _video_duplicate_error(video_uid)
+            if rejected is not None:
+                return rejected
+
+            # 3) Subir a GCS tmp/videos/<sha>.<ext>
+            on_stage(STAGE_UPLOADING)
+            print(f"[INFO] Uploading video {video_uid} to GCS")
+            object_name = f"{settings.gcs_tmp_videos_prefix}/{video_uid}{ext}"
+            gcs_uri = f"gs://{settings.gcs_bucket}/{object_name}"
+
+            bucket = storage_client.bucket(settings.gcs_bucket)
+            blob = bucket.blob(object_name)
+
+            with tmp_path.open("rb") as rf:
+                blob.upload_from_file(
+                    rf,
+                    content_type=content_type or "application/octet-stream",
+                    rewind=True,
+                )
+
+            # 4) Lanzar job (el worker borrará el tmp al final)
+            on_stage(STAGE_DISPATCHING)
+            print(f"[INFO] Launching Cloud Run Job to process video {video_uid}")
+            run = _launch_video_job(
+                gcs_uri,
+                source_type=source_type,
+                provider=provider,
+                original_filename=original_filename,
+                video_uid=video_uid,
+            )
+
+            return {
+                "ok": True,
+                "video_uid": video_uid,
+                "execution_name": run.execution_name,
+                "message": "Subido. Procesamiento iniciado.",
+            }, 200
+
+        except Exception as e:
+            return _process_error(e, "upload-video")
+
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _stage_images_zip(
+        tmp_path: Path,
+        *,
+        zip_sha: str,
+        original_filename: str,
+        source_type: str,
+        dataset_name: str,
+        provider: str,
+        on_stage: StageCallback = _no_stage,
+    ) -> IngestResult:
+        """
+        Sube el ZIP (o tar) ya hasheado a tmp/zips y lanza el Job de imágenes.
+        Borra siempre el fichero local.
+        """
+        kind = archive_kind(original_filename) or ARCHIVE_ZIP
+        object_name = f"{settings.gcs_tmp_zips_prefix}/{zip_sha}{ARCHIVE_EXT[kind]}"
+        gcs_uri = f"gs://{settings.gcs_bucket}/{object_name}"
+
+        try:
+            on_stage(STAGE_UPLOADING)
+            print(f"[INFO] Uploading ZIP {zip_sha} to GCS")
+            bucket = storage_client.bucket(settings.gcs_bucket)
+            blob = bucket.blob(object_name)
+
+            with tmp_path.open("rb") as rf:
+                blob.upload_from_file(
+                    rf,
+                    content_type=ARCHIVE_MIME[kind],
+                    rewind=True,
+                )
+
+            # Lanzar job específico de zip de imágenes
+            on_stage(STAGE_DISPATCHING)
+            print(f"[INFO] Launching Cloud Run Job to process images ZIP {zip_sha}")
+            run = _launch_images_zip_job(
+                gcs_uri,
+                source_type=source_type,
+                dataset_name=dataset_name,
+                provider=provider,
+                original_filename=original_filename,
+                zip_sha=zip_sha,
+            )
+
+            return {
+                "ok": True,
+                "execution_name": run.execution_name,
+                "message": "Subido. Descompresión e ingesta iniciadas.",
+            }, 200
+
+        except Exception as e:
+            return _process_error(e, "upload-images-zip")
+
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _receive_stream(stream, object_name: str, content_type: str):
+        """
+        Modo streaming: el cuerpo de la petición se hashea y se sube a la vez a
+        un objeto provisional (sin spool en /tmp). Devuelve (objeto, sha, tamaño).
+        """
+        print(f"[INFO] Streaming upload to provisional object {object_name}")
+        return gcs.upload_stream_hashed(
+            settings.gcs_bucket,
+            object_name,
+            stream,
+            content_type=content_type,
+            chunk_size=settings.upload_stream_chunk_size,
+        )
+
+    def _promote_streamed_video(
+        provisional: GCSObject,
+        *,
+        video_uid: str,
+        ext: str,
+        original_filename: str,
+        source_type: str,
+        provider: str,
+        expected_sha256: Optional[str] = None,
+        on_stage: StageCallback = _no_stage,
+    ) -> IngestResult:
+        """
+        Con el hash ya calculado: dedupe, renombrado (rewrite) a
+        tmp/videos/<sha>.<ext> y Job. Borra siempre el objeto provisional.
+        """
+        try:
+            on_stage(STAGE_CHECKING)
+            rejected = _integrity_error(
+                expected_sha256, video_uid
+            ) or _video_duplicate_error(video_uid)
+            if rejected is not None:
+                return rejected
+
+            on_stage(STAGE_UPLOADING)
+            object_name = f"{settings.gcs_tmp_videos_prefix}/{video_uid}{ext}"
+            staged = gcs.rewrite_object(provisional, settings.gcs_bucket, object_name)
+
+            on_stage(STAGE_DISPATCHING)
+            print(f"[INFO] Launching Cloud Run Job to process video {video_uid}")
+            run = _launch_video_job(
+                staged.uri,
+                source_type=source_type,
+                provider=provider,
+                original_filename=original_filename,
+                video_uid=video_uid,
+            )
+            return {
+                "ok": True,
+                "video_uid": video_uid,
+                "execution_name": run.execution_name,
+                "message": "Subido. Procesamiento iniciado.",
+            }, 200
+
+        except Exception as e:
+            return _process_error(e, "streaming upload-video")
+
+        finally:
+            # Tanto si era duplicado como si se ha renombrado, sobra
+            gcs.delete_object(provisional)
+
+    def _promote_streamed_images_zip(
+        provisional: GCSObject,
+        *,
+        zip_sha: str,
+        original_filename: str,
+        source_type: str,
+        dataset_name: str,
+        provider: str,
+        on_stage: StageCallback = _no_stage,
+    ) -> IngestResult:
+        """Equivalente de _promote_streamed_video para ZIPs y tar (sin dedupe)."""
+        try:
+            on_stage(STAGE_UPLOADING)
+            kind = archive_kind(original_filename) or ARCHIVE_ZIP
+            object_name = f"{settings.gcs_tmp_zips_prefix}/{zip_sha}{ARCHIVE_EXT[kind]}"
+            staged = gcs.rewrite_object(provisional, settings.gcs_bucket, object_name)
+
+            on_stage(STAGE_DISPATCHING)
+            print(f"[INFO] Launching Cloud Run Job to process images ZIP {zip_sha}")
+            run = _launch_images_zip_job(
+                staged.uri,
+                source_type=source_type,
+                dataset_name=dataset_name,
+                provider=provider,
+                original_filename=original_filename,
+                zip_sha=zip_sha,
+            )
+            return {
+                "ok": True,
+                "execution_name": run.execution_name,
+                "message": "Subido. Descompresión e ingesta iniciadas.",
+            }, 200
+
+        except Exception as e:
+            return _process_error(e, "streaming upload-images-zip")
+
+        finally:
+            gcs.delete_object(provisional)
+
+    def _wants_async() -> bool:
+        flag = request.args.get("async")
+        if flag is None:
+            return settings.async_ingest
+        return flag.strip().lower() in {"1", "true", "yes", "y", "on"}
+
+    def _respond(kind: str, work: IngestWork):
+        """
+        Ejecuta el staging en línea o, en modo asíncrono, en el pool de
+        ingesta devolviendo 202 + ticket. Si el pool está saturado se
+        procesa en línea.
+        """
+        if _wants_async():
+            ticket = ingest_tickets.submit(kind, work)
+            if ticket is not None:
+                print(f"[INFO] Accepted {kind} upload as ticket {ticket.ticket_id}")
+                return (
+                    jsonify(
+                        {
+                            "ok": True,
+                            "accepted": True,
+                            "ticket": ticket.ticket_id,
+                            "status_url": f"/api/ingest/{ticket.ticket_id}",
+                            "message": "Recibido. Preparando el procesamiento…",
+                        }
+                    ),
+                    202,
+                )
+            print("[WARN] Ingest pool saturated, processing synchronously")
+
+        body, status = work(_no_stage)
+        return jsonify(body), status
 
     @app.get("/")
     def index():
-        return render_template("upload.html")
+        return render_template("upload.html", upload_mode=settings.upload_mode)
 
     @app.get("/healthz")
     def healthz():
         return "ok", 200
 
+    @app.get("/api/jobs/stats")
+    def api_jobs_stats():
+        return jsonify({"ok": True, **jobs.stats()})
+
+    # PRE-CHECK DE DUPLICADOS (hash calculado en el navegador)
+    @app.post("/api/check-duplicate")
+    def api_check_duplicate():
+        """
+        Body JSON:
+            {"kind": "video", "sha256": "<hex>"} -> {"duplicate": bool}
+            {"kind": "images", "sha256": ["<hex>", ...]} -> {"existing": [...]}
+        Solo consulta BigQuery; las subidas reales se vuelven a verificar.
+        """
+        body = request.get_json(silent=True) or {}
+        kind = str(body.get("kind") or "").strip()
+
+        try:
+            if kind == "video":
+                sha = str(body.get("sha256") or "").strip().lower()
+                if not _is_sha256_hex(sha):
+                    return jsonify({"ok": False, "message": "SHA-256 inválido."}), 400
+                exists = _bq_video_exists(
+                    bq_client, settings.bq_dataset, settings.bq_table_videos, sha, dedup
+                )
+                return jsonify({"ok": True, "duplicate": exists})
+
+            if kind == "images":
+                raw = body.get("sha256") or []
+                if not isinstance(raw, list) or len(raw) > MAX_CHECK_IMAGES:
+                    return jsonify({"ok": False, "message": "Lista inválida."}), 400
+                uids = sorted({str(u).strip().lower() for u in raw})
+                if not all(_is_sha256_hex(u) for u in uids):
+                    return jsonify({"ok": False, "message": "SHA-256 inválido."}), 400
+                existing = _bq_images_existing(
+                    bq_client,
+                    settings.bq_dataset,
+                    settings.bq_table_images,
+                    uids,
+                    dedup,
+                )
+                return jsonify({"ok": True, "existing": sorted(existing)})
+        except Exception as e:
+            print("[ERROR] check-duplicate failed:", repr(e))
+            traceback.print_exc()
+            return (
+                jsonify(
+                    {
+                        "ok": False,
+                        "message": "No se pudo verificar duplicados (BigQuery).",
+                    }
+                ),
+                500,
+            )
+
+        return jsonify({"ok": False, "message": "Tipo inválido."}), 400
+
     # VIDEO UPLOAD
     @app.post("/api/upload-video")
     def api_upload_video():
         print("[INFO] Received /api/upload-video request")
+        if request.mimetype != "multipart/form-data":
+            # Modo streaming: cuerpo = bytes del vídeo, campos en la query string
+            filename = (request.args.get("filename") or "").strip()
+            source_type = (request.args.get("source_type") or "").strip()
+            provider = (request.args.get("provider") or "").strip() or "unknown"
+            if not filename:
+                return jsonify({"ok": False, "message": "Archivo inválido."}), 400
+            if source_type not in SOURCE_TYPES:
+                return (
+                    jsonify({"ok": False, "message": "Tipo de fuente inválido."}),
+                    400,
+                )
+            ext = Path(filename).suffix.lower() or ".mp4"
+            try:
+                provisional, video_uid, size = _receive_stream(
+                    request.stream,
+                    f"{settings.gcs_tmp_videos_prefix}/incoming/{uuid.uuid4().hex}{ext}",
+                    request.mimetype or "application/octet-stream",
+                )
+            except Exception as e:
+                body, status = _process_error(e, "streaming upload-video")
+                return jsonify(body), status
+            if size == 0:
+                gcs.delete_object(provisional)
+                return jsonify({"ok": False, "message": "Archivo inválido."}), 400
+
+            expected_sha256 = request.args.get("sha256")
+            return _respond(
+                "video",
+                lambda on_stage: _promote_streamed_video(
+                    provisional,
+                    video_uid=video_uid,
+                    ext=ext,
+                    original_filename=filename,
+                    source_type=source_type,
+                    provider=provider,
+                    expected_sha256=expected_sha256,
+                    on_stage=on_stage,
+                ),
+            )
+
         if "video" not in request.files:
             return (
                 jsonify({"ok": False, "message": "No se recibió ningún archivo."}),
@@ -65,7 +669,7 @@ def create_app() -> Flask:
         source_type = (request.form.get("source_type") or "").strip()
         provider = (request.form.get("provider") or "").strip() or "unknown"
 
-        if source_type not in {"public", "captured", "simulated"}:
+        if source_type not in SOURCE_TYPES:
             return jsonify({"ok": False, "message": "Tipo de fuente inválido."}), 400
 
         ext = Path(video.filename).suffix.lower() or ".mp4"
@@ -89,101 +693,97 @@ def create_app() -> Flask:
                 h.update(chunk)
 
         video_uid = h.hexdigest()
+        original_filename = video.filename
+        content_type = video.mimetype
+        expected_sha256 = request.form.get("sha256")
 
-        # 2) Dedupe en BQ (NO subimos si existe)
-        print(f"[INFO] Checking if video {video_uid} already exists in BigQuery")
-        try:
-            exists = _bq_video_exists(
-                bq_client, settings.bq_dataset, settings.bq_table_videos, video_uid
-            )
-        except Exception as e:
-            print("[ERROR] Checking video existence in BigQuery failed:", repr(e))
-            traceback.print_exc()
-            # Si BQ falla, mejor no subir para evitar duplicados accidentales
-            tmp_path.unlink(missing_ok=True)
-            return (
-                jsonify(
-                    {
-                        "ok": False,
-                        "message": "No se pudo verificar duplicados (BigQuery).",
-                    }
-                ),
-                500,
-            )
-
-        if exists:
-            print(f"[INFO] Video {video_uid} is a duplicate. Aborting upload.")
-            tmp_path.unlink(missing_ok=True)
-            return (
-                jsonify(
-                    {
-                        "ok": False,
-                        "duplicate": True,
-                        "message": "Duplicado: el vídeo ya existe.",
-                    }
-                ),
-                409,
-            )
-
-        # 3) Subir a GCS tmp/videos/<sha>.<ext>
-        print(f"[INFO] Uploading video {video_uid} to GCS")
-        object_name = f"{settings.gcs_tmp_videos_prefix}/{video_uid}{ext}"
-        gcs_uri = f"gs://{settings.gcs_bucket}/{object_name}"
-
-        try:
-            bucket = storage_client.bucket(settings.gcs_bucket)
-            blob = bucket.blob(object_name)
-
-            with tmp_path.open("rb") as rf:
-                blob.upload_from_file(
-                    rf,
-                    content_type=video.mimetype or "application/octet-stream",
-                    rewind=True,
-                )
-
-            # 4) Lanzar job (el worker borrará el tmp al final)
-            print(f"[INFO] Launching Cloud Run Job to process video {video_uid}")
-            jobs.run_job(
-                job_name=settings.run_job_name,
-                env_overrides={
-                    "INPUT_GCS_URI": gcs_uri,
-                    "INPUT_SOURCE_TYPE": source_type,
-                    "INPUT_PROVIDER": provider,
-                    "INPUT_ORIGINAL_FILENAME": video.filename,
-                    "INPUT_VIDEO_UID": video_uid,
-                },
-            )
-
-            return jsonify({"ok": True, "message": "Subido. Procesamiento iniciado."})
-
-        except Exception as e:
-            print("[ERROR] upload-video failed:", repr(e))
-            traceback.print_exc()
-            return (
-                jsonify(
-                    {"ok": False, "message": "Ha ocurrido un error durante el proceso."}
-                ),
-                500,
-            )
-
-        finally:
-            tmp_path.unlink(missing_ok=True)
+        return _respond(
+            "video",
+            lambda on_stage: _stage_video(
+                tmp_path,
+                video_uid=video_uid,
+                ext=ext,
+                original_filename=original_filename,
+                content_type=content_type,
+                source_type=source_type,
+                provider=provider,
+                expected_sha256=expected_sha256,
+                on_stage=on_stage,
+            ),
+        )
 
     # IMAGES ZIP UPLOAD
     @app.post("/api/upload-images-zip")
     def api_upload_images_zip():
         print("[INFO] Received /api/upload-images-zip request")
         """
-        Recibe un ZIP con imágenes, lo sube a tmp/zips/<sha>.zip y lanza un Job
-        que lo descomprime y vuelca a raw/images/<source_type>/<dataset_name>/<job_ts>/<image_uid>.<ext>
-        además de insertar en raw__images.
+        Recibe un ZIP (o tar / tar.gz / tar.zst) con imágenes, lo sube a
+        tmp/zips/<sha>.<ext> y lanza un Job que lo descomprime y vuelca a
+        raw/images/<source_type>/<dataset_name>/<job_ts>/<image_uid>.<ext>
+        además de insertar en raw__images. Los tar los lee el Job en una sola
+        pasada.
         """
+        if request.mimetype != "multipart/form-data":
+            # Modo streaming: cuerpo = bytes del ZIP, campos en la query string
+            filename = (request.args.get("filename") or "").strip()
+            source_type = (request.args.get("source_type") or "").strip()
+            dataset_name = (request.args.get("dataset_name") or "").strip()
+            provider = (
+                (request.args.get("provider") or "").strip()
+                or dataset_name
+                or "unknown"
+            )
+            if not filename:
+                return jsonify({"ok": False, "message": "ZIP inválido."}), 400
+            kind = readable_archive_kind(filename)
+            if kind is None:
+                return jsonify({"ok": False, "message": ARCHIVE_FORMAT_ERROR}), 400
+            if source_type not in SOURCE_TYPES:
+                return (
+                    jsonify({"ok": False, "message": "Tipo de fuente inválido."}),
+                    400,
+                )
+            if not dataset_name:
+                return (
+                    jsonify({"ok": False, "message": "dataset_name es obligatorio."}),
+                    400,
+                )
+            try:
+                provisional, zip_sha, size = _receive_stream(
+                    request.stream,
+                    f"{settings.gcs_tmp_zips_prefix}/incoming/"
+                    f"{uuid.uuid4().hex}{ARCHIVE_EXT[kind]}",
+                    ARCHIVE_MIME[kind],
+                )
+            except Exception as e:
+                body, status = _process_error(e, "streaming upload-images-zip")
+                return jsonify(body), status
+            if size == 0:
+                gcs.delete_object(provisional)
+                return jsonify({"ok": False, "message": "ZIP inválido."}), 400
+
+            return _respond(
+                "images_zip",
+                lambda on_stage: _promote_streamed_images_zip(
+                    provisional,
+                    zip_sha=zip_sha,
+                    original_filename=filename,
+                    source_type=source_type,
+                    dataset_name=dataset_name,
+                    provider=provider,
+                    on_stage=on_stage,
+                ),
+            )
+
         if "zipfile" not in request.files:
             return jsonify({"ok": False, "message": "No se recibió ningún ZIP."}), 400
 
         zf = request.files["zipfile"]
         if not zf or not zf.filename:
             return jsonify({"ok": False, "message": "ZIP inválido."}), 400
+        kind = readable_archive_kind(zf.filename)
+        if kind is None:
+            return jsonify({"ok": False, "message": ARCHIVE_FORMAT_ERROR}), 400
 
         source_type = (request.form.get("source_type") or "").strip()
         dataset_name = (request.form.get("dataset_name") or "").strip()
@@ -191,7 +791,7 @@ def create_app() -> Flask:
             (request.form.get("provider") or "").strip() or dataset_name or "unknown"
         )
 
-        if source_type not in {"public", "captured", "simulated"}:
+        if source_type not in SOURCE_TYPES:
             return jsonify({"ok": False, "message": "Tipo de fuente inválido."}), 400
         if not dataset_name:
             return (
@@ -206,7 +806,10 @@ def create_app() -> Flask:
 
         h = hashlib.sha256()
         with tempfile.NamedTemporaryFile(
-            prefix="upload_zip_", suffix=".zip", dir=tmp_dir, delete=False
+            prefix="upload_zip_",
+            suffix=ARCHIVE_EXT[kind],
+            dir=tmp_dir,
+            delete=False,
         ) as f:
             tmp_path = Path(f.name)
             while True:
@@ -217,42 +820,348 @@ def create_app() -> Flask:
                 h.update(chunk)
 
         zip_sha = h.hexdigest()
-        object_name = f"{settings.gcs_tmp_zips_prefix}/{zip_sha}.zip"
-        gcs_uri = f"gs://{settings.gcs_bucket}/{object_name}"
+        original_filename = zf.filename
+        return _respond(
+            "images_zip",
+            lambda on_stage: _stage_images_zip(
+                tmp_path,
+                zip_sha=zip_sha,
+                original_filename=original_filename,
+                source_type=source_type,
+                dataset_name=dataset_name,
+                provider=provider,
+                on_stage=on_stage,
+            ),
+        )
+
+    # CHUNKED / RESUMABLE UPLOAD
+    @app.post("/api/uploads")
+    def api_upload_init():
+        """
+        Inicia una subida por chunks. Body JSON:
+            kind, filename, size, source_type, provider, dataset_name
+        """
+        body = request.get_json(silent=True) or {}
+        kind = str(body.get("kind") or "").strip()
+        filename = str(body.get("filename") or "").strip()
+        source_type = str(body.get("source_type") or "").strip()
+        dataset_name = str(body.get("dataset_name") or "").strip()
+        provider = str(body.get("provider") or "").strip()
+
+        if kind not in UPLOAD_KINDS:
+            return jsonify({"ok": False, "message": "Tipo de subida inválido."}), 400
+        if not filename:
+            return jsonify({"ok": False, "message": "Archivo inválido."}), 400
+        if source_type not in SOURCE_TYPES:
+            return jsonify({"ok": False, "message": "Tipo de fuente inválido."}), 400
+        if kind == "images_zip" and not dataset_name:
+            return (
+                jsonify({"ok": False, "message": "dataset_name es obligatorio."}),
+                400,
+            )
+        if kind == "images_zip" and readable_archive_kind(filename) is None:
+            return jsonify({"ok": False, "message": ARCHIVE_FORMAT_ERROR}), 400
 
         try:
-            print(f"[INFO] Uploading ZIP {zip_sha} to GCS")
-            bucket = storage_client.bucket(settings.gcs_bucket)
-            blob = bucket.blob(object_name)
+            size = int(body.get("size") or 0)
+            session = upload_sessions.create(
+                kind=kind,
+                filename=filename,
+                total_size=size,
+                fields={
+                    "source_type": source_type,
+                    "dataset_name": dataset_name,
+                    "provider": provider,
+                    "content_type": str(body.get("content_type") or ""),
+                    "sha256": str(body.get("sha256") or ""),
+                },
+            )
+        except (UploadSessionError, ValueError) as e:
+            return jsonify({"ok": False, "message": str(e)}), 400
 
-            with tmp_path.open("rb") as rf:
-                blob.upload_from_file(
-                    rf,
-                    content_type="application/zip",
-                    rewind=True,
-                )
+        print(f"[INFO] Started chunked upload {session.upload_id} ({kind})")
+        return jsonify({"ok": True, **session.status()}), 201
 
-            # Lanzar job específico de zip de imágenes
-            print(f"[INFO] Launching Cloud Run Job to process images ZIP {zip_sha}")
-            jobs.run_job(
-                job_name=settings.run_images_zip_job_name,
-                env_overrides={
-                    "INPUT_GCS_URI": gcs_uri,
-                    "INPUT_SOURCE_TYPE": source_type,
-                    "INPUT_DATASET_NAME": dataset_name,
-                    "INPUT_PROVIDER": provider,
-                    "INPUT_ORIGINAL_FILENAME": zf.filename,
-                    "INPUT_ZIP_SHA": zip_sha,
+    @app.get("/api/uploads/<upload_id>")
+    def api_upload_status(upload_id: str):
+        session = upload_sessions.get(upload_id)
+        if session is None:
+            return jsonify({"ok": False, "message": "Subida no encontrada."}), 404
+        return jsonify({"ok": True, **session.status()})
+
+    @app.put("/api/uploads/<upload_id>/chunks/<int:index>")
+    def api_upload_chunk(upload_id: str, index: int):
+        session = upload_sessions.get(upload_id)
+        if session is None:
+            return jsonify({"ok": False, "message": "Subida no encontrada."}), 404
+
+        try:
+            session.write_chunk(index, request.get_data(cache=False))
+        except UploadSessionError as e:
+            return jsonify({"ok": False, "message": str(e)}), 400
+
+        return jsonify(
+            {
+                "ok": True,
+                "index": index,
+                "hashed_offset": session.hashed_offset,
+                "complete": session.complete,
+            }
+        )
+
+    @app.post("/api/uploads/<upload_id>/finalize")
+    def api_upload_finalize(upload_id: str):
+        session = upload_sessions.get(upload_id)
+        if session is None:
+            return jsonify({"ok": False, "message": "Subida no encontrada."}), 404
+        if not session.complete:
+            return (
+                jsonify(
+                    {
+                        "ok": False,
+                        "message": "Faltan chunks por subir.",
+                        "missing": session.missing_chunks(),
+                    }
+                ),
+                409,
+            )
+
+        # take() es atómico: un finalize repetido no procesa dos veces
+        session = upload_sessions.take(upload_id)
+        if session is None:
+            return jsonify({"ok": False, "message": "Subida no encontrada."}), 404
+
+        sha = session.digest()
+        fields = session.fields
+        # El spool pasa a ser responsabilidad del staging (lo borra al acabar)
+        tmp_path = session.spool_path
+
+        print(f"[INFO] Finalized chunked upload {upload_id} -> {sha}")
+        if session.kind == "video":
+            return _respond(
+                "video",
+                lambda on_stage: _stage_video(
+                    tmp_path,
+                    video_uid=sha,
+                    ext=Path(session.filename).suffix.lower() or ".mp4",
+                    original_filename=session.filename,
+                    content_type=fields.get("content_type"),
+                    source_type=fields["source_type"],
+                    provider=fields.get("provider") or "unknown",
+                    expected_sha256=fields.get("sha256"),
+                    on_stage=on_stage,
+                ),
+            )
+
+        dataset_name = fields["dataset_name"]
+        return _respond(
+            "images_zip",
+            lambda on_stage: _stage_images_zip(
+                tmp_path,
+                zip_sha=sha,
+                original_filename=session.filename,
+                source_type=fields["source_type"],
+                dataset_name=dataset_name,
+                provider=fields.get("provider") or dataset_name or "unknown",
+                on_stage=on_stage,
+            ),
+        )
+
+    # ESTADO DE INGESTA ASÍNCRONA
+    @app.get("/api/ingest/<ticket_id>")
+    def api_ingest_status(ticket_id: str):
+        ticket = ingest_tickets.get(ticket_id)
+        if ticket is None:
+            return jsonify({"ok": False, "message": "Ticket no encontrado."}), 404
+        return jsonify({"ok": True, **ticket})
+
+    # DIRECT-TO-GCS UPLOAD (URL firmada)
+    def _direct_upload_prefix(kind: str) -> str:
+        base = (
+            settings.gcs_tmp_videos_prefix
+            if kind == "video"
+            else settings.gcs_tmp_zips_prefix
+        )
+        return f"{base}/{DIRECT_UPLOAD_DIR}"
+
+    @app.post("/api/direct-uploads")
+    def api_direct_upload_init():
+        """
+        Devuelve una URL firmada V4 para que el navegador suba directamente a
+        tmp/videos/direct/ o tmp/zips/direct/. El hash lo calcula el worker.
+        Los campos del formulario viajan como metadatos del objeto.
+        """
+        body = request.get_json(silent=True) or {}
+        kind = str(body.get("kind") or "").strip()
+        filename = str(body.get("filename") or "").strip()
+        source_type = str(body.get("source_type") or "").strip()
+        dataset_name = str(body.get("dataset_name") or "").strip()
+        provider = str(body.get("provider") or "").strip()
+
+        if kind not in UPLOAD_KINDS:
+            return jsonify({"ok": False, "message": "Tipo de subida inválido."}), 400
+        if not filename:
+            return jsonify({"ok": False, "message": "Archivo inválido."}), 400
+        if source_type not in SOURCE_TYPES:
+            return jsonify({"ok": False, "message": "Tipo de fuente inválido."}), 400
+        if kind == "images_zip" and not dataset_name:
+            return (
+                jsonify({"ok": False, "message": "dataset_name es obligatorio."}),
+                400,
+            )
+        if kind == "images_zip" and readable_archive_kind(filename) is None:
+            return jsonify({"ok": False, "message": ARCHIVE_FORMAT_ERROR}), 400
+
+        if kind == "video":
+            ext = Path(filename).suffix.lower() or ".mp4"
+            content_type = (
+                str(body.get("content_type") or "") or "application/octet-stream"
+            )
+        else:
+            archive = archive_kind(filename) or ARCHIVE_ZIP
+            ext = ARCHIVE_EXT[archive]
+            content_type = ARCHIVE_MIME[archive]
+
+        object_name = f"{_direct_upload_prefix(kind)}/{uuid.uuid4().hex}{ext}"
+        # Cabeceras x-goog-meta-*: solo ASCII, así que se codifican
+        metadata: Dict[str, str] = {
+            "kind": kind,
+            "source_type": source_type,
+            "dataset_name": quote(dataset_name),
+            "provider": quote(provider),
+            "original_filename": quote(filename),
+        }
+
+        try:
+            target = gcs.create_resumable_upload_target(
+                settings.gcs_bucket,
+                object_name,
+                content_type=content_type,
+                metadata=metadata,
+                expiration_s=settings.signed_url_expiration_s,
+                service_account_email=settings.gcs_signing_service_account,
+            )
+        except Exception as e:
+            print("[ERROR] Signing direct upload URL failed:", repr(e))
+            traceback.print_exc()
+            return (
+                jsonify({"ok": False, "message": "No se pudo preparar la subida."}),
+                500,
+            )
+
+        print(f"[INFO] Issued direct upload URL for {object_name}")
+        return jsonify(
+            {
+                "ok": True,
+                "object_name": object_name,
+                "upload": {
+                    "url": target.url,
+                    "method": target.method,
+                    "headers": target.headers,
+                    "body": target.body,
                 },
+            }
+        )
+
+    @app.post("/api/direct-uploads/finalize")
+    def api_direct_upload_finalize():
+        """
+        Comprueba que el objeto subido existe y lanza el Job. Es idempotente:
+        el objeto se marca como finalizado con precondición de metageneration.
+        """
+        body = request.get_json(silent=True) or {}
+        object_name = str(body.get("object_name") or "").strip()
+
+        kind = next(
+            (
+                k
+                for k in UPLOAD_KINDS
+                if object_name.startswith(_direct_upload_prefix(k) + "/")
+            ),
+            None,
+        )
+        if kind is None or ".." in object_name:
+            return jsonify({"ok": False, "message": "Objeto inválido."}), 400
+
+        try:
+            blob = gcs.get_object(settings.gcs_bucket, object_name)
+            if blob is None or not blob.size:
+                return (
+                    jsonify({"ok": False, "message": "La subida no está completa."}),
+                    409,
+                )
+
+            meta = dict(blob.metadata or {})
+            if meta.get(FINALIZED_META_KEY):
+                return jsonify(
+                    {"ok": True, "message": "Subido. Procesamiento ya iniciado."}
+                )
+
+            # Se valida antes de marcarlo: un objeto rechazado no se procesa
+            # nunca, así que se borra en vez de dejarlo huérfano en tmp/
+            source_type = meta.get("source_type", "")
+            if meta.get("kind") != kind or source_type not in SOURCE_TYPES:
+                print(f"[WARN] Rejecting direct upload {object_name}: bad metadata")
+                gcs.delete_object(GCSObject(settings.gcs_bucket, object_name))
+                return jsonify({"ok": False, "message": "Metadatos inválidos."}), 400
+
+            blob.metadata = {**meta, FINALIZED_META_KEY: "1"}
+            blob.patch(if_metageneration_match=blob.metageneration)
+        except PreconditionFailed:
+            return jsonify(
+                {"ok": True, "message": "Subido. Procesamiento ya iniciado."}
+            )
+        except Exception as e:
+            print("[ERROR] direct upload finalize failed:", repr(e))
+            traceback.print_exc()
+            return (
+                jsonify(
+                    {"ok": False, "message": "Ha ocurrido un error durante el proceso."}
+                ),
+                500,
             )
 
+        original_filename = (
+            unquote(meta.get("original_filename", "")) or Path(object_name).name
+        )
+        provider = unquote(meta.get("provider", ""))
+        dataset_name = unquote(meta.get("dataset_name", ""))
+        gcs_uri = f"gs://{settings.gcs_bucket}/{object_name}"
+
+        try:
+            print(f"[INFO] Launching Cloud Run Job for direct upload {object_name}")
+            if kind == "video":
+                _launch_video_job(
+                    gcs_uri,
+                    source_type=source_type,
+                    provider=provider or "unknown",
+                    original_filename=original_filename,
+                    video_uid=None,
+                )
+                return jsonify(
+                    {"ok": True, "message": "Subido. Procesamiento iniciado."}
+                )
+
+            _launch_images_zip_job(
+                gcs_uri,
+                source_type=source_type,
+                dataset_name=dataset_name,
+                provider=provider or dataset_name or "unknown",
+                original_filename=original_filename,
+                zip_sha=None,
+            )
             return jsonify(
                 {"ok": True, "message": "Subido. Descompresión e ingesta iniciadas."}
             )
-
         except Exception as e:
-            print("[ERROR] upload-images-zip failed:", repr(e))
+            print("[ERROR] direct upload job launch failed:", repr(e))
             traceback.print_exc()
+            # Permite reintentar el finalize
+            blob.metadata = {**meta, FINALIZED_META_KEY: None}
+            try:
+                blob.patch()
+            except Exception:
+                pass
             return (
                 jsonify(
                     {"ok": False, "message": "Ha ocurrido un error durante el proceso."}
@@ -260,9 +1169,6 @@ def create_app() -> Flask:
                 500,
             )
 
-        finally:
-            tmp_path.unlink(missing_ok=True)
-
     return app
 
 
@@ -0,0 +1,92 @@
+"""
+Compara los backends de decodificación sobre un vídeo local.
+
+    python -m src.benchmarks.decoders VIDEO [--backends opencv,ffmpeg] [--runs 3]
+
+Mide el paso de selección (decode + scoring) y la carga a resolución
+completa de los frames seleccionados (también por separado), sin
+codificar ni subir nada.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import Dict, List
+
+from src.config import get_settings
+from src.pipelines.decoders import DECODERS, open_decoder
+from src.pipelines.video_ingest import AdaptiveSampler
+
+
+def run_once(video_path: Path, backend: str, settings) -> Dict:
+    decoder = open_decoder(backend, video_path, settings.downscale_width)
+    if decoder is None:
+        raise RuntimeError(f"No se puede abrir el vídeo: {video_path}")
+
+    sampler = AdaptiveSampler(settings)
+    decoded = 0
+    selected: List[int] = []
+    full_res_s = 0.0
+    t0 = time.perf_counter()
+    try:
+        for df in decoder.frames():
+            decoded += 1
+            if sampler.offer(df.timestamp_ms, df.gray_small):
+                t_full = time.perf_counter()
+                frame = df.load_full()
+                full_res_s += time.perf_counter() - t_full
+                if frame is not None:
+                    selected.append(df.timestamp_ms)
+    finally:
+        decoder.close()
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "backend": decoder.name,
+        "decoded": decoded,
+        "selected": selected,
+        "elapsed_s": elapsed,
+        "full_res_s": full_res_s,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("video", type=Path)
+    parser.add_argument("--backends", default=",".join(sorted(DECODERS)))
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    settings = get_settings()
+    results: Dict[str, Dict] = {}
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        runs = [
+            run_once(args.video, backend, replace(settings, frame_decoder=backend))
+            for _ in range(max(1, args.runs))
+        ]
+        best = min(runs, key=lambda r: r["elapsed_s"])
+        results[backend] = best
+        print(
+            f"{backend:>8} ({best['backend']}): {best['decoded']} decoded, "
+            f"{len(best['selected'])} selected, best {best['elapsed_s']:.2f}s "
+            f"({best['decoded'] / best['elapsed_s']:.1f} frames/s), "
+            f"full-res load {best['full_res_s']:.2f}s"
+        )
+
+    if len(results) > 1:
+        names = list(results)
+        base = set(results[names[0]]["selected"])
+        for other in names[1:]:
+            ts = set(results[other]["selected"])
+            common = len(base & ts)
+            print(
+                f"selected timestamps {names[0]} vs {other}: {common} common, "
+                f"{len(base - ts)} only {names[0]}, {len(ts - base)} only {other}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Compara los backends de codificación sobre frames de un vídeo local.
+
+    python -m src.benchmarks.encoders VIDEO [--backends opencv,pillow,turbojpeg]
+        [--formats jpg,webp] [--subsampling ,420,444] [--optimize]
+        [--quality 92] [--frames 20] [--runs 3]
+
+Toma --frames frames repartidos por el vídeo a resolución completa y mide,
+para cada combinación, ms por frame (mejor pasada) y bytes por frame.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from src.config import get_settings
+from src.pipelines.encoders import (
+    ENCODERS,
+    FORMAT_JPEG,
+    FORMAT_WEBP,
+    EncoderOptions,
+    open_encoder,
+)
+
+
+def sample_frames(video_path: Path, count: int) -> List:
+    """count frames BGR repartidos uniformemente por el vídeo."""
+    import cv2  # type: ignore
+
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise RuntimeError(f"No se puede abrir el vídeo: {video_path}")
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        step = max(1, total // max(1, count)) if total > 0 else 1
+        frames: List = []
+        idx = 0
+        while len(frames) < count:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+            idx += step
+        return frames
+    finally:
+        cap.release()
+
+
+def run_once(encoder, frames: List) -> Dict:
+    sizes = 0
+    t0 = time.perf_counter()
+    for frame in frames:
+        data = encoder.encode(frame)
+        sizes += len(data or b"")
+    elapsed = time.perf_counter() - t0
+    return {"elapsed_s": elapsed, "bytes": sizes}
+
+
+def _csv(value: str) -> List[str]:
+    return [v.strip().lower() for v in value.split(",")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("video", type=Path)
+    parser.add_argument("--backends", default=",".join(sorted(ENCODERS)))
+    parser.add_argument("--formats", default=f"{FORMAT_JPEG},{FORMAT_WEBP}")
+    # "" = por defecto del backend
+    parser.add_argument("--subsampling", default="")
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--quality", type=int, default=None)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    settings = get_settings()
+    quality = args.quality if args.quality is not None else settings.frame_jpeg_quality
+    frames = sample_frames(args.video, args.frames)
+    if not frames:
+        raise RuntimeError("El vídeo no tiene frames")
+    h, w = frames[0].shape[:2]
+    print(f"{len(frames)} frames {w}x{h}, quality {quality}")
+
+    seen = set()
+    for image_format in [f for f in _csv(args.formats) if f]:
+        for subsampling in _csv(args.subsampling):
+            if image_format != FORMAT_JPEG and subsampling:
+                continue  # el submuestreo solo aplica a JPEG
+            options = EncoderOptions(
+                image_format=image_format,
+                quality=quality,
+                subsampling=subsampling,
+                optimize=args.optimize,
+            )
+            for backend in [b for b in _csv(args.backends) if b]:
+                encoder = open_encoder(backend, options)
+                # Con fallback (p. ej. turbojpeg sin librería) no repite OpenCV
+                key = (encoder.name, options)
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                runs = [run_once(encoder, frames) for _ in range(max(1, args.runs))]
+                best = min(runs, key=lambda r: r["elapsed_s"])
+                print(
+                    f"{encoder.name:>9} {image_format:>4} "
+                    f"subsampling={subsampling or 'default':<7} "
+                    f"optimize={'yes' if args.optimize else 'no':<3}: "
+                    f"{best['elapsed_s'] * 1000.0 / len(frames):.2f} ms/frame, "
+                    f"{best['bytes'] / len(frames) / 1024.0:.1f} KiB/frame"
+                )
+
+
+if __name__ == "__main__":
+    main()
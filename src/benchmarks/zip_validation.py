@@ -0,0 +1,77 @@
+"""
+Compara la validación por cabecera con la decodificación completa sobre un
+ZIP local.
+
+    python -m src.benchmarks.zip_validation ZIP [--limit 500] [--runs 3]
+
+Lee las entradas de imagen una vez a memoria y mide solo la validación
+(sin hash ni subida). Informa de ms por imagen, imágenes/s y de las
+entradas que pasan por cabecera pero fallan al decodificarlas enteras.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from src.pipelines.images_zip_ingest import ALLOWED_EXTS, normalize_ext, validate_image
+
+
+def load_entries(zip_path: Path, limit: int) -> List[Tuple[str, bytes, str]]:
+    out: List[Tuple[str, bytes, str]] = []
+    with zipfile.ZipFile(zip_path, "r") as z:
+        for info in z.infolist():
+            ext = normalize_ext(info.filename)
+            if info.is_dir() or ext not in ALLOWED_EXTS:
+                continue
+            out.append((info.filename, z.read(info), ext))
+            if limit and len(out) >= limit:
+                break
+    return out
+
+
+def run_once(entries: List[Tuple[str, bytes, str]], strict: bool) -> Dict:
+    failed: List[str] = []
+    t0 = time.perf_counter()
+    for name, data, ext in entries:
+        if validate_image(data, ext, strict=strict) is None:
+            failed.append(name)
+    return {"elapsed_s": time.perf_counter() - t0, "failed": failed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("zip", type=Path)
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    entries = load_entries(args.zip, args.limit)
+    if not entries:
+        raise RuntimeError("El ZIP no tiene imágenes")
+    total_mb = sum(len(d) for _, d, _ in entries) / 1e6
+    print(f"{len(entries)} images, {total_mb:.1f} MB")
+
+    results: Dict[str, Dict] = {}
+    for mode, strict in (("header", False), ("full", True)):
+        runs = [run_once(entries, strict) for _ in range(max(1, args.runs))]
+        best = min(runs, key=lambda r: r["elapsed_s"])
+        results[mode] = best
+        print(
+            f"{mode:>6}: {best['elapsed_s'] * 1000.0 / len(entries):.3f} ms/image, "
+            f"{len(entries) / best['elapsed_s']:.0f} images/s, "
+            f"{len(best['failed'])} invalid"
+        )
+
+    header, full = results["header"], results["full"]
+    print(f"speedup: {full['elapsed_s'] / header['elapsed_s']:.1f}x")
+    missed = sorted(set(full["failed"]) - set(header["failed"]))
+    if missed:
+        print(f"{len(missed)} only caught by full decode: {', '.join(missed[:10])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ class Settings:
     bq_table_videos: str
     bq_table_images: str
     bq_table_lineage: str
+    bq_table_derivatives: str
 
     # Video sampling
     extract_frames: bool
@@ -23,6 +24,43 @@ class Settings:
     motion_threshold: float
     downscale_width: int
     frame_jpeg_quality: int
+    # Codificación de frames: backend, formato (jpg/webp) y flags JPEG
+    frame_encoder: str
+    frame_image_format: str
+    frame_jpeg_subsampling: str
+    frame_jpeg_optimize: bool
+    # Versiones reducidas "nombre:lado_max,..." (frames y ZIP); vacío = no
+    image_derivatives: str
+    frame_queue_size: int
+    frame_upload_workers: int
+    frame_encode_workers: int
+    frame_decoder: str
+    frame_sampling_mode: str
+    frame_keyframe_thinning: bool
+    # Filtro de casi-duplicados por dHash (distancia de Hamming, 64 bits)
+    frame_phash_enabled: bool
+    frame_phash_max_distance: int
+    frame_phash_window: int
+    frame_phash_provider_index: bool
+    frame_phash_index_capacity: int
+    video_shards: int
+    video_shard_min_duration_s: float
+    video_shard_warmup_s: float
+    zip_upload_workers: int
+    # Imágenes leídas del ZIP y pendientes de subir (ventana de memoria)
+    zip_max_in_flight: int
+    # Procesos de hash/validación de ZIP; 0 = uno por CPU
+    zip_process_workers: int
+    # Fracción de imágenes de ZIP decodificadas enteras (resto: cabecera)
+    zip_strict_sample_rate: float
+    # Lectura del ZIP de staging por rangos desde GCS (sin descargarlo)
+    zip_range_reads: bool
+    zip_range_block_size: int
+    zip_range_cache_blocks: int
+    zip_range_read_ahead: int
+    # Imágenes por micro-lote de dedupe al leer un tar en streaming
+    tar_batch_size: int
+    gcs_upload_max_retries: int
 
     # BQ batching
     lineage_chunk_size: int
@@ -37,11 +75,72 @@ class Settings:
     run_region: str
     run_job_name: str
     run_images_zip_job_name: str
+    run_api_base_url: str
+    run_api_anonymous: bool
+    run_dispatch_max_concurrent: int
+    run_dispatch_max_retries: int
+    run_dispatch_timeout_s: float
 
     # GCS tmp staging
     gcs_tmp_videos_prefix: str
     gcs_tmp_zips_prefix: str
 
+    gcs_tmp_manifests_prefix: str
+    gcs_tmp_shards_prefix: str
+    gcs_tmp_claims_prefix: str
+    gcs_tmp_dedup_log_prefix: str
+
+    # Claim de un vídeo en proceso (evita procesar dos veces subidas
+    # concurrentes del mismo fichero); pasado el TTL se da por abandonado
+    video_claim_ttl_s: float
+
+    # Checkpoints de extracción en GCS (reanudar un task reintentado)
+    video_checkpoints_enabled: bool
+    # --max-retries del Job de vídeo: en el último intento un fallo ya no
+    # conserva staging ni claim (no habrá reintento que los use)
+    video_job_max_retries: int
+    gcs_tmp_checkpoints_prefix: str
+
+    # Lotes de vídeos (un manifest -> una ejecución del Job)
+    video_batch_enabled: bool
+    video_batch_window_s: float
+    video_batch_max_items: int
+    video_worker_concurrency: int
+
+    # Subida por chunks (reanudable)
+    upload_chunk_size: int
+    upload_spool_dir: str
+    upload_session_ttl_s: float
+    # Tope de tamaño por subida y de sesiones abiertas (el spool vive en /tmp)
+    upload_max_size: int
+    upload_max_sessions: int
+    upload_mode: str  # "multipart" | "chunked" | "direct" | "stream"
+    upload_stream_chunk_size: int
+
+    # Ingesta asíncrona (202 + ticket)
+    async_ingest: bool
+    ingest_workers: int
+    ingest_max_pending: int
+    ingest_ticket_ttl_s: float
+
+    # Índice de dedupe en memoria (Bloom filter delante de BigQuery)
+    dedup_index_enabled: bool
+    dedup_index_videos_capacity: int
+    dedup_index_images_capacity: int
+    dedup_index_fp_rate: float
+    dedup_index_ttl_s: float
+    # TTL de la carga completa cuando el UidLog ya mantiene el índice al día
+    # (solo recoge lo insertado fuera de los Jobs)
+    dedup_index_log_ttl_s: float
+    # Cada cuánto lee el servicio los uids publicados por los Jobs
+    dedup_index_refresh_s: float
+    # Los Jobs publican sus inserts en GCS_TMP_DEDUP_LOG_PREFIX
+    dedup_log_enabled: bool
+
+    # Subida directa a GCS (URL firmada V4)
+    signed_url_expiration_s: int
+    gcs_signing_service_account: str
+
 
 def _get_bool(name: str, default: bool) -> bool:
     v = os.environ.get(name)
@@ -58,6 +157,9 @@ def get_settings() -> Settings:
         bq_table_videos=os.environ.get("BQ_TABLE_VIDEOS", "raw__videos"),
         bq_table_images=os.environ.get("BQ_TABLE_IMAGES", "raw__images"),
         bq_table_lineage=os.environ.get("BQ_TABLE_LINEAGE", "frame__lineage"),
+        bq_table_derivatives=os.environ.get(
+            "BQ_TABLE_DERIVATIVES", "image__derivatives"
+        ),
         extract_frames=_get_bool("EXTRACT_FRAMES", True),
         min_fps=float(os.environ.get("MIN_FPS", "0.5")),
         max_fps=float(os.environ.get("MAX_FPS", "5.0")),
@@ -65,6 +167,45 @@ def get_settings() -> Settings:
         motion_threshold=float(os.environ.get("MOTION_THRESHOLD", "12.0")),
         downscale_width=int(os.environ.get("DOWNSCALE_WIDTH", "320")),
         frame_jpeg_quality=int(os.environ.get("FRAME_JPEG_QUALITY", "92")),
+        frame_encoder=os.environ.get("FRAME_ENCODER", "opencv").strip().lower(),
+        frame_image_format=os.environ.get("FRAME_IMAGE_FORMAT", "jpg").strip().lower(),
+        # "" = por defecto del backend; 444 | 422 | 420
+        frame_jpeg_subsampling=os.environ.get("FRAME_JPEG_SUBSAMPLING", "").strip(),
+        frame_jpeg_optimize=_get_bool("FRAME_JPEG_OPTIMIZE", False),
+        image_derivatives=os.environ.get("IMAGE_DERIVATIVES", "").strip(),
+        frame_queue_size=int(os.environ.get("FRAME_QUEUE_SIZE", "32")),
+        frame_upload_workers=int(os.environ.get("FRAME_UPLOAD_WORKERS", "8")),
+        # 0 = un worker por CPU
+        frame_encode_workers=int(os.environ.get("FRAME_ENCODE_WORKERS", "0")),
+        frame_decoder=os.environ.get("FRAME_DECODER", "opencv").strip().lower(),
+        frame_sampling_mode=os.environ.get("FRAME_SAMPLING_MODE", "adaptive")
+        .strip()
+        .lower(),
+        frame_keyframe_thinning=_get_bool("FRAME_KEYFRAME_THINNING", True),
+        frame_phash_enabled=_get_bool("FRAME_PHASH_ENABLED", False),
+        frame_phash_max_distance=int(os.environ.get("FRAME_PHASH_MAX_DISTANCE", "4")),
+        frame_phash_window=int(os.environ.get("FRAME_PHASH_WINDOW", "8")),
+        frame_phash_provider_index=_get_bool("FRAME_PHASH_PROVIDER_INDEX", False),
+        frame_phash_index_capacity=int(
+            os.environ.get("FRAME_PHASH_INDEX_CAPACITY", "200000")
+        ),
+        video_shards=int(os.environ.get("VIDEO_SHARDS", "1")),
+        video_shard_min_duration_s=float(
+            os.environ.get("VIDEO_SHARD_MIN_DURATION_S", "120")
+        ),
+        video_shard_warmup_s=float(os.environ.get("VIDEO_SHARD_WARMUP_S", "20")),
+        zip_upload_workers=int(os.environ.get("ZIP_UPLOAD_WORKERS", "16")),
+        zip_max_in_flight=int(os.environ.get("ZIP_MAX_IN_FLIGHT", "64")),
+        zip_process_workers=int(os.environ.get("ZIP_PROCESS_WORKERS", "0")),
+        zip_strict_sample_rate=float(os.environ.get("ZIP_STRICT_SAMPLE_RATE", "0.01")),
+        zip_range_reads=_get_bool("ZIP_RANGE_READS", True),
+        zip_range_block_size=int(
+            os.environ.get("ZIP_RANGE_BLOCK_SIZE", str(4 * 1024 * 1024))
+        ),
+        zip_range_cache_blocks=int(os.environ.get("ZIP_RANGE_CACHE_BLOCKS", "16")),
+        zip_range_read_ahead=int(os.environ.get("ZIP_RANGE_READ_AHEAD", "2")),
+        tar_batch_size=int(os.environ.get("TAR_BATCH_SIZE", "256")),
+        gcs_upload_max_retries=int(os.environ.get("GCS_UPLOAD_MAX_RETRIES", "5")),
         lineage_chunk_size=int(os.environ.get("LINEAGE_CHUNK_SIZE", "500")),
         images_chunk_size=int(os.environ.get("IMAGES_CHUNK_SIZE", "500")),
         host=os.environ.get("HOST", "127.0.0.1"),
@@ -75,6 +216,66 @@ def get_settings() -> Settings:
         run_images_zip_job_name=os.environ.get(
             "RUN_IMAGES_ZIP_JOB_NAME", "hud-images-zip-worker"
         ),
+        run_api_base_url=os.environ.get(
+            "RUN_API_BASE_URL", "https://run.googleapis.com"
+        ),
+        run_api_anonymous=_get_bool("RUN_API_ANONYMOUS", False),
+        run_dispatch_max_concurrent=int(
+            os.environ.get("RUN_DISPATCH_MAX_CONCURRENT", "8")
+        ),
+        run_dispatch_max_retries=int(os.environ.get("RUN_DISPATCH_MAX_RETRIES", "5")),
+        run_dispatch_timeout_s=float(os.environ.get("RUN_DISPATCH_TIMEOUT_S", "30")),
         gcs_tmp_videos_prefix=os.environ.get("GCS_TMP_VIDEOS_PREFIX", "tmp/videos"),
         gcs_tmp_zips_prefix=os.environ.get("GCS_TMP_ZIPS_PREFIX", "tmp/zips"),
+        gcs_tmp_manifests_prefix=os.environ.get(
+            "GCS_TMP_MANIFESTS_PREFIX", "tmp/manifests"
+        ),
+        gcs_tmp_shards_prefix=os.environ.get("GCS_TMP_SHARDS_PREFIX", "tmp/shards"),
+        gcs_tmp_claims_prefix=os.environ.get("GCS_TMP_CLAIMS_PREFIX", "tmp/claims"),
+        gcs_tmp_dedup_log_prefix=os.environ.get(
+            "GCS_TMP_DEDUP_LOG_PREFIX", "tmp/dedup-log"
+        ),
+        video_claim_ttl_s=float(os.environ.get("VIDEO_CLAIM_TTL_S", "7200")),
+        video_checkpoints_enabled=_get_bool("VIDEO_CHECKPOINTS_ENABLED", True),
+        video_job_max_retries=int(os.environ.get("VIDEO_JOB_MAX_RETRIES", "3")),
+        gcs_tmp_checkpoints_prefix=os.environ.get(
+            "GCS_TMP_CHECKPOINTS_PREFIX", "tmp/checkpoints"
+        ),
+        video_batch_enabled=_get_bool("VIDEO_BATCH_ENABLED", False),
+        video_batch_window_s=float(os.environ.get("VIDEO_BATCH_WINDOW_S", "10")),
+        video_batch_max_items=int(os.environ.get("VIDEO_BATCH_MAX_ITEMS", "20")),
+        video_worker_concurrency=int(os.environ.get("VIDEO_WORKER_CONCURRENCY", "2")),
+        upload_chunk_size=int(
+            os.environ.get("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024))
+        ),
+        upload_spool_dir=os.environ.get("UPLOAD_SPOOL_DIR", "/tmp/uploads"),
+        upload_session_ttl_s=float(os.environ.get("UPLOAD_SESSION_TTL_S", "86400")),
+        upload_max_size=int(
+            os.environ.get("UPLOAD_MAX_SIZE", str(5 * 1024 * 1024 * 1024))
+        ),
+        upload_max_sessions=int(os.environ.get("UPLOAD_MAX_SESSIONS", "16")),
+        upload_mode=os.environ.get("UPLOAD_MODE", "multipart").strip().lower(),
+        upload_stream_chunk_size=int(
+            os.environ.get("UPLOAD_STREAM_CHUNK_SIZE", str(8 * 1024 * 1024))
+        ),
+        async_ingest=_get_bool("ASYNC_INGEST", False),
+        ingest_workers=int(os.environ.get("INGEST_WORKERS", "4")),
+        ingest_max_pending=int(os.environ.get("INGEST_MAX_PENDING", "32")),
+        ingest_ticket_ttl_s=float(os.environ.get("INGEST_TICKET_TTL_S", "3600")),
+        dedup_index_enabled=_get_bool("DEDUP_INDEX_ENABLED", False),
+        dedup_index_videos_capacity=int(
+            os.environ.get("DEDUP_INDEX_VIDEOS_CAPACITY", "1000000")
+        ),
+        dedup_index_images_capacity=int(
+            os.environ.get("DEDUP_INDEX_IMAGES_CAPACITY", "10000000")
+        ),
+        dedup_index_fp_rate=float(os.environ.get("DEDUP_INDEX_FP_RATE", "0.01")),
+        dedup_index_ttl_s=float(os.environ.get("DEDUP_INDEX_TTL_S", "900")),
+        dedup_index_log_ttl_s=float(os.environ.get("DEDUP_INDEX_LOG_TTL_S", "43200")),
+        dedup_index_refresh_s=float(os.environ.get("DEDUP_INDEX_REFRESH_S", "15")),
+        dedup_log_enabled=_get_bool("DEDUP_LOG_ENABLED", False),
+        signed_url_expiration_s=int(os.environ.get("SIGNED_URL_EXPIRATION_S", "3600")),
+        gcs_signing_service_account=os.environ.get(
+            "GCS_SIGNING_SERVICE_ACCOUNT", ""
+        ).strip(),
     )
@@ -1,11 +1,12 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, List, Optional, Set, Tuple
 
-from google.cloud import bigquery
+from google.cloud import bigquery, storage
 
 from src.config import Settings
+from src.gcp.dedup_index import uid_log_from_settings
 
 
 def _chunked(items: List[Dict[str, Any]], size: int) -> List[List[Dict[str, Any]]]:
@@ -16,10 +17,25 @@ class BigQueryClient:
     def __init__(self, project_id: Optional[str], settings: Settings) -> None:
         self.client = bigquery.Client(project=project_id or None)
         self.settings = settings
+        # Los inserts se publican para el índice de dedupe del servicio
+        self.uid_log = (
+            uid_log_from_settings(storage.Client(project=project_id or None), settings)
+            if settings.dedup_log_enabled
+            else None
+        )
 
     def _table_id(self, table_name: str) -> str:
         return f"{self.client.project}.{self.settings.bq_dataset}.{table_name}"
 
+    def _publish_uids(self, kind: str, uids: List[str]) -> None:
+        if self.uid_log is None:
+            return
+        try:
+            self.uid_log.publish(kind, uids)
+        except Exception as e:
+            # El índice lo verá en su siguiente recarga completa
+            print(f"[WARN] Could not publish {len(uids)} {kind} uids: {e!r}")
+
     def video_exists(self, video_uid: str) -> bool:
         table = self._table_id(self.settings.bq_table_videos)
         q = f"SELECT 1 FROM `{table}` WHERE video_uid = @uid LIMIT 1"
@@ -42,6 +58,7 @@ class BigQueryClient:
             raise RuntimeError(
                 f"BigQuery insert {self.settings.bq_table_videos} error: {errors}"
             )
+        self._publish_uids("videos", [row["video_uid"] for row in rows])
 
     def insert_raw_images_chunked(
         self, rows: List[Dict[str, Any]], chunk_size: Optional[int] = None
@@ -56,6 +73,7 @@ class BigQueryClient:
                 raise RuntimeError(
                     f"BigQuery insert {self.settings.bq_table_images} error: {errors}"
                 )
+            self._publish_uids("images", [row["image_uid"] for row in batch])
 
     def insert_frame_lineage_chunked(
         self, rows: List[Dict[str, Any]], chunk_size: Optional[int] = None
@@ -71,6 +89,21 @@ class BigQueryClient:
                     f"BigQuery insert {self.settings.bq_table_lineage} error: {errors}"
                 )
 
+    def insert_image_derivatives_chunked(
+        self, rows: List[Dict[str, Any]], chunk_size: Optional[int] = None
+    ) -> None:
+        if not rows:
+            return
+        table_id = self._table_id(self.settings.bq_table_derivatives)
+        cs = chunk_size or self.settings.images_chunk_size
+        for batch in _chunked(rows, cs):
+            errors = self.client.insert_rows_json(table_id, batch)
+            if errors:
+                raise RuntimeError(
+                    f"BigQuery insert {self.settings.bq_table_derivatives} error: "
+                    f"{errors}"
+                )
+
     def images_exist(self, image_uids: List[str]) -> Set[str]:
         if not image_uids:
             return set()
@@ -91,3 +124,39 @@ class BigQueryClient:
             ),
         )
         return {row["image_uid"] for row in job.result()}
+
+    def frame_lineage_uids(self, video_uid: str) -> Set[str]:
+        """image_uid de las filas de frame__lineage ya insertadas del vídeo."""
+        table = self._table_id(self.settings.bq_table_lineage)
+        q = f"SELECT image_uid FROM `{table}` WHERE video_uid = @uid"
+        job = self.client.query(
+            q,
+            job_config=bigquery.QueryJobConfig(
+                query_parameters=[
+                    bigquery.ScalarQueryParameter("uid", "STRING", video_uid)
+                ]
+            ),
+        )
+        return {row["image_uid"] for row in job.result()}
+
+    def derivatives_exist(self, image_uids: List[str]) -> Set[Tuple[str, str]]:
+        """(image_uid, derivative) ya insertados en image__derivatives."""
+        if not image_uids:
+            return set()
+
+        table = self._table_id(self.settings.bq_table_derivatives)
+        q = f"""
+        SELECT image_uid, derivative
+        FROM `{table}`
+        WHERE image_uid IN UNNEST(@uids)
+        """
+
+        job = self.client.query(
+            q,
+            job_config=bigquery.QueryJobConfig(
+                query_parameters=[
+                    bigquery.ArrayQueryParameter("uids", "STRING", image_uids)
+                ]
+            ),
+        )
+        return {(row["image_uid"], row["derivative"]) for row in job.result()}
@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional
+
+from google.cloud import bigquery, storage
+
+from src.config import Settings
+
+
+class BloomFilter:
+    """
+    Bloom filter sobre un bytearray. Las posiciones salen de doble hashing
+    (h1 + i*h2) sobre un blake2b de 128 bits del uid.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float) -> None:
+        capacity = max(1, int(capacity))
+        fp_rate = min(max(float(fp_rate), 1e-9), 0.5)
+
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.nbits = max(
+            8, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        )
+        self.nhashes = max(1, int(round(self.nbits / capacity * math.log(2))))
+        self.bits = bytearray((self.nbits + 7) // 8)
+        self.count = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self.bits)
+
+    def _positions(self, key: str) -> Iterable[int]:
+        d = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        for i in range(self.nhashes):
+            yield (h1 + i * h2) % self.nbits
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key)
+        )
+
+
+# Margen al releer el registro de uids: un objeto puede aparecer en el
+# listado algo después de la marca de tiempo de su nombre (reloj del
+# worker, duración de la subida)
+UID_LOG_OVERLAP_S = 120.0
+UID_LOG_TS_DIGITS = 13  # epoch en ms
+
+
+class UidLog:
+    """
+    Registro compartido en GCS de los uids que insertan los workers: cada
+    lote de inserts escribe <prefix>/<kind>/<epoch_ms>-<id>.txt con un uid
+    por línea. Los nombres ordenan por tiempo, así que el servicio lista
+    solo desde su última lectura (menos UID_LOG_OVERLAP_S) y se salta los
+    objetos ya leídos. El prefijo se limpia con una regla de lifecycle.
+    """
+
+    def __init__(self, client: storage.Client, bucket: str, prefix: str) -> None:
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        # Objetos ya leídos -> epoch de su nombre (para podarlos)
+        self._read: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _kind_prefix(self, kind: str) -> str:
+        return f"{self.prefix}/{kind}/"
+
+    def publish(self, kind: str, uids: Iterable[str]) -> None:
+        body = "\n".join(u for u in uids if u)
+        if not body:
+            return
+        ts = int(time.time() * 1000)
+        name = f"{self._kind_prefix(kind)}{ts:0{UID_LOG_TS_DIGITS}d}-{uuid.uuid4().hex[:12]}.txt"
+        self.client.bucket(self.bucket).blob(name).upload_from_string(
+            body, content_type="text/plain"
+        )
+
+    def read_since(self, kind: str, since: float) -> List[str]:
+        """Uids publicados desde `since` (epoch en segundos), con margen."""
+        start = max(0.0, since - UID_LOG_OVERLAP_S)
+        prefix = self._kind_prefix(kind)
+        uids: List[str] = []
+        for blob in self.client.list_blobs(
+            self.bucket,
+            prefix=prefix,
+            start_offset=f"{prefix}{int(start * 1000):0{UID_LOG_TS_DIGITS}d}",
+        ):
+            with self._lock:
+                if blob.name in self._read:
+                    continue
+            uids.extend(blob.download_as_bytes().decode("utf-8").split())
+            ts = blob.name[len(prefix) : len(prefix) + UID_LOG_TS_DIGITS]
+            with self._lock:
+                self._read[blob.name] = int(ts) / 1000.0 if ts.isdigit() else start
+
+        with self._lock:
+            for name in [n for n, t in self._read.items() if t < start]:
+                del self._read[name]
+        return uids
+
+
+class UidIndex:
+    """
+    Índice de uids conocidos de una columna de BigQuery. Se carga en segundo
+    plano y se recarga al caducar el TTL; mientras no hay carga lista,
+    might_contain devuelve None y el llamante debe consultar BigQuery.
+    Entre cargas, cada refresh_s se añaden los uids que devuelva refresher
+    (los que han publicado los workers en su UidLog desde la última lectura).
+
+    False es un negativo definitivo respecto a la última lectura; lo que se
+    haya insertado después solo se ve en la siguiente, así que los workers
+    mantienen su propia comprobación. True solo es "posible".
+    """
+
+    def __init__(
+        self,
+        name: str,
+        loader: Callable[[], Iterable[str]],
+        *,
+        capacity: int,
+        fp_rate: float,
+        ttl_s: float,
+        refresher: Optional[Callable[[float], Iterable[str]]] = None,
+        refresh_s: float = 15.0,
+    ) -> None:
+        self.name = name
+        self.loader = loader
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.ttl_s = ttl_s
+        self.refresher = refresher
+        self.refresh_s = refresh_s
+
+        self._bloom: Optional[BloomFilter] = None
+        self._loaded_at = 0.0
+        self._refreshed_at = 0.0
+        # Reloj de pared al empezar la última lectura (carga o refresco)
+        self._synced_at = 0.0
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        t0 = time.monotonic()
+        started = time.time()
+        try:
+            bloom = BloomFilter(self.capacity, self.fp_rate)
+            for uid in self.loader():
+                bloom.add(uid)
+        except Exception as e:
+            print(f"[WARN] Dedup index '{self.name}' load failed: {e!r}")
+            with self._lock:
+                self._loading = False
+            return
+
+        with self._lock:
+            self._bloom = bloom
+            self._loaded_at = self._refreshed_at = time.monotonic()
+            self._synced_at = started
+            self._loading = False
+
+        if bloom.count > bloom.capacity:
+            print(
+                f"[WARN] Dedup index '{self.name}' over capacity "
+                f"({bloom.count} > {bloom.capacity}); false positives will rise"
+            )
+        print(
+            f"[INFO] Dedup index '{self.name}' loaded {bloom.count} uids "
+            f"({bloom.size_bytes / 1e6:.1f} MB) in {time.monotonic() - t0:.1f}s"
+        )
+
+    def _refresh(self) -> None:
+        started = time.time()
+        try:
+            uids = list(self.refresher(self._synced_at)) if self.refresher else []
+        except Exception as e:
+            print(f"[WARN] Dedup index '{self.name}' refresh failed: {e!r}")
+            with self._lock:
+                self._refreshed_at = time.monotonic()
+                self._loading = False
+            return
+
+        with self._lock:
+            if self._bloom is not None:
+                for uid in uids:
+                    self._bloom.add(uid)
+            self._refreshed_at = time.monotonic()
+            self._synced_at = started
+            self._loading = False
+
+    def ensure_fresh(self) -> None:
+        with self._lock:
+            if self._loading:
+                return
+            now = time.monotonic()
+            if self._bloom is None or now - self._loaded_at > self.ttl_s:
+                target = self._load
+            elif (
+                self.refresher is not None and now - self._refreshed_at > self.refresh_s
+            ):
+                target = self._refresh
+            else:
+                return
+            self._loading = True
+        threading.Thread(
+            target=target, name=f"dedup-index-{self.name}", daemon=True
+        ).start()
+
+    def might_contain(self, uid: str) -> Optional[bool]:
+        self.ensure_fresh()
+        with self._lock:
+            if self._bloom is None:
+                return None
+            return uid in self._bloom
+
+
+class DedupIndex:
+    """
+    Índices de video_uid (raw__videos) e image_uid (raw__images) del
+    servicio; con uid_log se mantienen al día con los inserts de los Jobs y
+    el SELECT DISTINCT completo solo se repite cada DEDUP_INDEX_LOG_TTL_S.
+    """
+
+    def __init__(
+        self,
+        client: bigquery.Client,
+        settings: Settings,
+        uid_log: Optional[UidLog] = None,
+    ) -> None:
+        self.client = client
+        self.settings = settings
+        self.uid_log = uid_log
+        ttl_s = (
+            settings.dedup_index_log_ttl_s
+            if uid_log is not None
+            else settings.dedup_index_ttl_s
+        )
+        self.videos = UidIndex(
+            "videos",
+            lambda: self._iter_column(settings.bq_table_videos, "video_uid"),
+            capacity=settings.dedup_index_videos_capacity,
+            fp_rate=settings.dedup_index_fp_rate,
+            ttl_s=ttl_s,
+            refresher=self._log_reader("videos"),
+            refresh_s=settings.dedup_index_refresh_s,
+        )
+        self.images = UidIndex(
+            "images",
+            lambda: self._iter_column(settings.bq_table_images, "image_uid"),
+            capacity=settings.dedup_index_images_capacity,
+            fp_rate=settings.dedup_index_fp_rate,
+            ttl_s=ttl_s,
+            refresher=self._log_reader("images"),
+            refresh_s=settings.dedup_index_refresh_s,
+        )
+
+    def _log_reader(self, kind: str) -> Optional[Callable[[float], Iterable[str]]]:
+        uid_log = self.uid_log
+        if uid_log is None:
+            return None
+        return lambda since: uid_log.read_since(kind, since)
+
+    def _iter_column(self, table_name: str, column: str) -> Iterable[str]:
+        table = f"{self.client.project}.{self.settings.bq_dataset}.{table_name}"
+        job = self.client.query(f"SELECT DISTINCT {column} FROM `{table}`")
+        for row in job.result(page_size=100_000):
+            uid = row[column]
+            if uid:
+                yield uid
+
+    def warm(self) -> None:
+        self.videos.ensure_fresh()
+        self.images.ensure_fresh()
+
+
+_INDEX: Optional[DedupIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def uid_log_from_settings(
+    client: storage.Client, settings: Settings
+) -> Optional[UidLog]:
+    """UidLog en GCS_TMP_DEDUP_LOG_PREFIX (None si DEDUP_LOG_ENABLED=false)."""
+    if not settings.dedup_log_enabled:
+        return None
+    return UidLog(client, settings.gcs_bucket, settings.gcs_tmp_dedup_log_prefix)
+
+
+def get_dedup_index(
+    client: bigquery.Client,
+    settings: Settings,
+    storage_client: Optional[storage.Client] = None,
+) -> Optional[DedupIndex]:
+    """
+    Índice del servicio (None si está desactivado). Los workers no lo
+    cargan: publican sus inserts en el UidLog que lee este índice.
+    """
+    global _INDEX
+    if not settings.dedup_index_enabled:
+        return None
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            uid_log = (
+                uid_log_from_settings(storage_client, settings)
+                if storage_client is not None
+                else None
+            )
+            if uid_log is None:
+                print(
+                    "[WARN] Dedup index without DEDUP_LOG_ENABLED: uids inserted "
+                    "by jobs are only seen after DEDUP_INDEX_TTL_S"
+                )
+            _INDEX = DedupIndex(client, settings, uid_log)
+        return _INDEX
@@ -1,12 +1,28 @@
 from __future__ import annotations
 
 import json
+import random
+import threading
+import time
+from collections import deque
 from dataclasses import dataclass
-from typing import Dict, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, Optional
 
 import google.auth
 import google.auth.transport.requests
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+DEFAULT_API_BASE_URL = "https://run.googleapis.com"
+
+# :run no es idempotente: solo se reintentan respuestas que garantizan que
+# no se creó la ejecución (cuota / servicio no disponible)
+RETRYABLE_STATUS = {429, 503}
+
+# Se refresca el token si le queda menos que esto
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
 
 
 @dataclass(frozen=True)
@@ -17,11 +33,85 @@ class RunJobResult:
 class CloudRunJobsRunner:
     """
     Lanza ejecuciones de Cloud Run Jobs vía REST API v2, con overrides de env vars.
+
+    Reutiliza credenciales (hasta poco antes de caducar) y un pool de
+    conexiones HTTP, reintenta 429/503 y fallos de conexión (la petición no
+    llegó a enviarse) con backoff exponencial con jitter y limita las
+    llamadas :run simultáneas (max_concurrent_dispatch). No limita las
+    ejecuciones en curso: el slot se libera al crearse la ejecución. Un
+    timeout de lectura o un 500/502/504 no se reintenta: la ejecución puede
+    haberse creado. api_base_url + anonymous permiten apuntar a un servidor
+    HTTP local de pruebas.
     """
 
-    def __init__(self, project_id: str, region: str) -> None:
+    def __init__(
+        self,
+        project_id: str,
+        region: str,
+        *,
+        api_base_url: str = DEFAULT_API_BASE_URL,
+        anonymous: bool = False,
+        max_concurrent_dispatch: int = 8,
+        max_retries: int = 5,
+        backoff_base_s: float = 0.5,
+        backoff_max_s: float = 20.0,
+        timeout_s: float = 30.0,
+    ) -> None:
         self.project_id = project_id
         self.region = region
+        self.api_base_url = api_base_url.rstrip("/")
+        self.anonymous = anonymous
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.timeout_s = timeout_s
+
+        pool_size = max(1, int(max_concurrent_dispatch))
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self._creds = None
+        self._creds_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+        self._stats_lock = threading.Lock()
+        self._latencies_ms: Deque[float] = deque(maxlen=1000)
+        self._count = 0
+        self._failures = 0
+        self._retries = 0
+        self._dispatching = 0
+
+    def _token(self, force_refresh: bool = False) -> Optional[str]:
+        if self.anonymous:
+            return None
+        with self._creds_lock:
+            if self._creds is None:
+                # Obtiene token ADC / service account
+                self._creds, _ = google.auth.default(
+                    scopes=["https://www.googleapis.com/auth/cloud-platform"]
+                )
+            creds = self._creds
+            expiry = getattr(creds, "expiry", None)
+            expiring = (
+                expiry is not None
+                and expiry.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)
+                < TOKEN_REFRESH_MARGIN
+            )
+            if force_refresh or not creds.valid or expiring:
+                creds.refresh(google.auth.transport.requests.Request())
+            return creds.token
+
+    def _backoff_s(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(self.backoff_max_s, float(retry_after))
+            except ValueError:
+                pass
+        # Full jitter
+        cap = min(self.backoff_max_s, self.backoff_base_s * (2**attempt))
+        return random.uniform(0, cap)
 
     def run_job(
         self,
@@ -29,15 +119,7 @@ class CloudRunJobsRunner:
         job_name: str,
         env_overrides: Dict[str, str],
     ) -> RunJobResult:
-        # Obtiene token ADC / service account
-        creds, _ = google.auth.default(
-            scopes=["https://www.googleapis.com/auth/cloud-platform"]
-        )
-        auth_req = google.auth.transport.requests.Request()
-        creds.refresh(auth_req)
-        token = creds.token
-
-        url = f"https://run.googleapis.com/v2/projects/{self.project_id}/locations/{self.region}/jobs/{job_name}:run"
+        url = f"{self.api_base_url}/v2/projects/{self.project_id}/locations/{self.region}/jobs/{job_name}:run"
 
         payload = {
             "overrides": {
@@ -46,17 +128,108 @@ class CloudRunJobsRunner:
                 ]
             }
         }
+        body = json.dumps(payload)
 
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        }
+        self._slots.acquire()
+        with self._stats_lock:
+            self._dispatching += 1
+        t0 = time.monotonic()
+        try:
+            r = self._post_with_retries(url, body)
+        except Exception:
+            with self._stats_lock:
+                self._failures += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self._dispatching -= 1
+            self._slots.release()
 
-        r = requests.post(url, headers=headers, data=json.dumps(payload), timeout=30)
-        if r.status_code >= 400:
-            raise RuntimeError(f"Cloud Run Job run failed ({r.status_code}): {r.text}")
+        with self._stats_lock:
+            self._count += 1
+            self._latencies_ms.append((time.monotonic() - t0) * 1000.0)
 
         data = r.json()
         # La respuesta trae execution.name
         execution_name = data.get("name", "")
         return RunJobResult(execution_name=execution_name)
+
+    def _post_with_retries(self, url: str, body: str) -> requests.Response:
+        force_refresh = False
+        attempt = 0
+        while True:
+            headers = {"Content-Type": "application/json"}
+            token = self._token(force_refresh=force_refresh)
+            if token:
+                headers["Authorization"] = f"Bearer {token}"
+            force_refresh = False
+
+            try:
+                r = self._session.post(
+                    url, headers=headers, data=body, timeout=self.timeout_s
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not _not_sent(e) or attempt >= self.max_retries:
+                    raise RuntimeError(f"Cloud Run Job run failed: {e!r}") from e
+                r = None
+
+            if r is not None:
+                if r.status_code < 400:
+                    return r
+                if r.status_code == 401 and attempt == 0 and not self.anonymous:
+                    # Token revocado / caducado antes de tiempo: reintento inmediato
+                    force_refresh = True
+                    attempt += 1
+                    continue
+                if r.status_code not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    raise RuntimeError(
+                        f"Cloud Run Job run failed ({r.status_code}): {r.text}"
+                    )
+
+            delay = self._backoff_s(
+                attempt, r.headers.get("Retry-After") if r is not None else None
+            )
+            status = r.status_code if r is not None else "connection error"
+            print(
+                f"[WARN] Cloud Run Job run retry {attempt + 1} ({status}) in {delay:.2f}s"
+            )
+            with self._stats_lock:
+                self._retries += 1
+            time.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Latencias de dispatch (últimas 1000 llamadas correctas) y contadores."""
+        with self._stats_lock:
+            lat = sorted(self._latencies_ms)
+            out: Dict[str, Any] = {
+                "dispatched": self._count,
+                "failures": self._failures,
+                "retries": self._retries,
+                "dispatching": self._dispatching,
+            }
+
+        if lat:
+            out.update(
+                {
+                    "latency_ms_mean": round(sum(lat) / len(lat), 1),
+                    "latency_ms_p50": round(lat[len(lat) // 2], 1),
+                    "latency_ms_p95": round(
+                        lat[min(len(lat) - 1, int(len(lat) * 0.95))], 1
+                    ),
+                    "latency_ms_max": round(lat[-1], 1),
+                }
+            )
+        return out
+
+
+def _not_sent(e: Exception) -> bool:
+    """True si la conexión no llegó a establecerse (el POST no salió)."""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    if not isinstance(e, requests.ConnectionError) or isinstance(e, requests.Timeout):
+        return False
+    reason = e.args[0] if e.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, NewConnectionError)
@@ -1,10 +1,45 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from urllib.parse import quote
 
+import google.auth
+import google.auth.transport.requests
+import requests
+from google.auth.credentials import Signing
+from google.api_core import exceptions as api_exceptions
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+# Los chunks de una subida resumable deben ser múltiplos de 256 KiB
+RESUMABLE_CHUNK_ALIGN = 256 * 1024
+
+# Tamaño del pool de conexiones por defecto de requests
+DEFAULT_HTTP_POOL_SIZE = 10
+
+# Errores transitorios en subidas (429/5xx y red)
+RETRYABLE_UPLOAD_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    requests.ConnectionError,
+    requests.Timeout,
+)
 
 
 @dataclass(frozen=True)
@@ -17,10 +52,104 @@ class GCSObject:
         return f"gs://{self.bucket}/{self.name}"
 
 
+@dataclass(frozen=True)
+class ResumableUploadTarget:
+    """
+    Petición que el navegador debe hacer para abrir una sesión resumable:
+    la respuesta trae la URL de sesión en la cabecera Location.
+    """
+
+    url: str
+    method: str
+    headers: Dict[str, str] = field(default_factory=dict)
+    body: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class BulkUploadStats:
+    objects: int
+    bytes: int
+    elapsed_s: float
+    retries: int
+    failures: int
+
+    @property
+    def objects_per_s(self) -> float:
+        return self.objects / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes / 1e6 / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.objects} objects, {self.bytes / 1e6:.1f} MB in "
+            f"{self.elapsed_s:.1f}s ({self.objects_per_s:.1f} obj/s, "
+            f"{self.mb_per_s:.1f} MB/s, {self.retries} retries, "
+            f"{self.failures} failures)"
+        )
+
+
+def _emulator_host() -> Optional[str]:
+    # Mismo env var que usa google-cloud-storage (p.ej. fake-gcs-server)
+    host = os.environ.get("STORAGE_EMULATOR_HOST", "").strip()
+    return host.rstrip("/") or None
+
+
 class StorageClient:
     def __init__(self, project_id: Optional[str] = None) -> None:
         self.client = storage.Client(project=project_id or None)
 
+        self._pool_lock = threading.Lock()
+        self._pool_size = DEFAULT_HTTP_POOL_SIZE
+        self._pool_reserved = 0
+
+    def _reserve_connections(self, n: int) -> None:
+        """Agranda el pool HTTP del cliente para n hilos más de subida."""
+        with self._pool_lock:
+            self._pool_reserved += n
+            if self._pool_reserved <= self._pool_size:
+                return
+            self._pool_size = self._pool_reserved
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+            self.client._http.mount("https://", adapter)
+            self.client._http.mount("http://", adapter)
+
+    def _release_connections(self, n: int) -> None:
+        with self._pool_lock:
+            self._pool_reserved = max(0, self._pool_reserved - n)
+
+    def bulk_uploader(
+        self,
+        *,
+        concurrency: int,
+        max_pending: Optional[int] = None,
+        max_retries: int = 5,
+    ) -> "BulkUploader":
+        return BulkUploader(
+            self,
+            concurrency=concurrency,
+            max_pending=max_pending,
+            max_retries=max_retries,
+        )
+
+    def open_ranged(
+        self,
+        obj: GCSObject,
+        *,
+        block_size: int = 4 * 1024 * 1024,
+        cache_blocks: int = 16,
+        read_ahead: int = 2,
+    ) -> "GCSRangeReader":
+        """Fichero con seek sobre el objeto, leído por rangos (sin descargarlo)."""
+        return GCSRangeReader(
+            self,
+            obj,
+            block_size=block_size,
+            cache_blocks=cache_blocks,
+            read_ahead=read_ahead,
+        )
+
     def upload_file(self, bucket: str, object_name: str, local_path: Path) -> GCSObject:
         b = self.client.bucket(bucket)
         blob = b.blob(object_name)
@@ -34,3 +163,606 @@ class StorageClient:
         blob = b.blob(object_name)
         blob.upload_from_string(data, content_type=content_type)
         return GCSObject(bucket=bucket, name=object_name)
+
+    def create_resumable_upload_target(
+        self,
+        bucket: str,
+        object_name: str,
+        *,
+        content_type: str,
+        metadata: Dict[str, str],
+        expiration_s: int,
+        service_account_email: str = "",
+    ) -> ResumableUploadTarget:
+        """
+        URL firmada V4 para iniciar una subida resumable (POST con
+        x-goog-resumable: start). Con STORAGE_EMULATOR_HOST devuelve el
+        endpoint JSON de subida resumable del emulador, que no firma.
+        """
+        emulator = _emulator_host()
+        if emulator:
+            # API JSON: los metadatos van en el cuerpo de la petición inicial
+            url = (
+                f"{emulator}/upload/storage/v1/b/{quote(bucket, safe='')}/o"
+                f"?uploadType=resumable&name={quote(object_name, safe='')}"
+            )
+            return ResumableUploadTarget(
+                url=url,
+                method="POST",
+                headers={
+                    "Content-Type": "application/json",
+                    "X-Upload-Content-Type": content_type,
+                },
+                body=json.dumps(
+                    {
+                        "name": object_name,
+                        "contentType": content_type,
+                        "metadata": metadata,
+                    }
+                ),
+            )
+
+        headers = {"Content-Type": content_type, "x-goog-resumable": "start"}
+        headers.update({f"x-goog-meta-{k}": v for k, v in metadata.items()})
+
+        blob = self.client.bucket(bucket).blob(object_name)
+        sign_kwargs: Dict[str, str] = {}
+
+        creds, _ = google.auth.default(
+            scopes=["https://www.googleapis.com/auth/cloud-platform"]
+        )
+        if service_account_email or not isinstance(creds, Signing):
+            # Sin clave privada (Cloud Run / ADC): firma vía IAM signBlob
+            creds.refresh(google.auth.transport.requests.Request())
+            email = service_account_email or getattr(creds, "service_account_email", "")
+            if not email or email == "default":
+                raise RuntimeError(
+                    "No se puede firmar la URL: define GCS_SIGNING_SERVICE_ACCOUNT."
+                )
+            sign_kwargs = {"service_account_email": email, "access_token": creds.token}
+
+        url = blob.generate_signed_url(
+            version="v4",
+            expiration=timedelta(seconds=int(expiration_s)),
+            method="POST",
+            headers=headers,
+            **sign_kwargs,
+        )
+        return ResumableUploadTarget(url=url, method="POST", headers=headers)
+
+    def get_object(self, bucket: str, object_name: str) -> Optional[storage.Blob]:
+        return self.client.bucket(bucket).get_blob(object_name)
+
+    def upload_stream_hashed(
+        self,
+        bucket: str,
+        object_name: str,
+        stream: BinaryIO,
+        *,
+        content_type: str,
+        chunk_size: int = 8 * 1024 * 1024,
+    ) -> Tuple[GCSObject, str, int]:
+        """
+        Sube un stream no seekable con una sesión resumable a la vez que
+        calcula su SHA-256. La memoria queda acotada por chunk_size.
+        Devuelve (objeto, sha256, tamaño).
+        """
+        chunk_size = max(
+            RESUMABLE_CHUNK_ALIGN,
+            chunk_size - chunk_size % RESUMABLE_CHUNK_ALIGN,
+        )
+        blob = self.client.bucket(bucket).blob(object_name, chunk_size=chunk_size)
+
+        h = hashlib.sha256()
+        size = 0
+        with blob.open("wb", content_type=content_type) as writer:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+                writer.write(chunk)
+                size += len(chunk)
+
+        return GCSObject(bucket=bucket, name=object_name), h.hexdigest(), size
+
+    def rewrite_object(
+        self, src: GCSObject, dst_bucket: str, dst_name: str
+    ) -> GCSObject:
+        """
+        Copia server-side (rewrite). Los objetos grandes o entre clases de
+        almacenamiento pueden necesitar varias llamadas con token.
+        """
+        src_blob = self.client.bucket(src.bucket).blob(src.name)
+        dst_blob = self.client.bucket(dst_bucket).blob(dst_name)
+
+        token, _, _ = dst_blob.rewrite(src_blob)
+        while token is not None:
+            token, _, _ = dst_blob.rewrite(src_blob, token=token)
+        return GCSObject(bucket=dst_bucket, name=dst_name)
+
+    def hash_object(
+        self, obj: GCSObject, chunk_size: int = 8 * 1024 * 1024
+    ) -> Tuple[str, int]:
+        """SHA-256 y tamaño leyendo el objeto en streaming, sin tocar disco."""
+        blob = self.client.bucket(obj.bucket).blob(obj.name)
+        h = hashlib.sha256()
+        size = 0
+        with blob.open("rb", chunk_size=chunk_size) as reader:
+            while True:
+                chunk = reader.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+                size += len(chunk)
+        return h.hexdigest(), size
+
+    def download_file_hashed(
+        self, obj: GCSObject, local_path: Path, chunk_size: int = 8 * 1024 * 1024
+    ) -> Tuple[str, int]:
+        """Descarga a disco calculando el SHA-256 sobre la marcha (una sola
+        pasada por los bytes). Devuelve (sha256, tamaño)."""
+        blob = self.client.bucket(obj.bucket).blob(obj.name)
+        h = hashlib.sha256()
+        size = 0
+        with blob.open("rb", chunk_size=chunk_size) as reader, local_path.open(
+            "wb"
+        ) as f:
+            while True:
+                chunk = reader.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        return h.hexdigest(), size
+
+    def media_read_target(self, obj: GCSObject) -> Tuple[str, Dict[str, str]]:
+        """
+        URL + cabeceras para leer el objeto por HTTP con peticiones Range
+        (ffprobe / ffmpeg lo leen sin descargarlo entero). Con
+        STORAGE_EMULATOR_HOST apunta al emulador, sin autenticación.
+        """
+        path = (
+            f"/storage/v1/b/{quote(obj.bucket, safe='')}"
+            f"/o/{quote(obj.name, safe='')}?alt=media"
+        )
+        emulator = _emulator_host()
+        if emulator:
+            return f"{emulator}{path}", {}
+
+        creds = self.client._credentials
+        if not creds.valid:
+            creds.refresh(google.auth.transport.requests.Request())
+        return (
+            f"https://storage.googleapis.com{path}",
+            {"Authorization": f"Bearer {creds.token}"},
+        )
+
+    def upload_bytes_if_absent(
+        self, bucket: str, object_name: str, data: bytes, content_type: str
+    ) -> bool:
+        """Crea el objeto solo si no existe (if_generation_match=0).
+        Devuelve False si ya existía: sirve como lock entre procesos."""
+        blob = self.client.bucket(bucket).blob(object_name)
+        try:
+            blob.upload_from_string(
+                data, content_type=content_type, if_generation_match=0
+            )
+        except api_exceptions.PreconditionFailed:
+            return False
+        return True
+
+    def claim_object(
+        self,
+        bucket: str,
+        object_name: str,
+        payload: Dict[str, str],
+        *,
+        ttl_s: float,
+    ) -> Tuple[bool, Dict[str, str]]:
+        """
+        Claim ligero entre procesos: crea el objeto solo si no existe. Un
+        claim más antiguo que ttl_s se da por abandonado y se reemplaza
+        (borrado condicionado a su generación). Devuelve (conseguido,
+        contenido del claim vigente).
+        """
+        data = json.dumps(payload).encode("utf-8")
+        for _ in range(3):
+            if self.upload_bytes_if_absent(
+                bucket, object_name, data, content_type="application/json"
+            ):
+                return True, payload
+
+            blob = self.client.bucket(bucket).get_blob(object_name)
+            if blob is None:
+                continue  # liberado entre medias
+
+            age_s = (datetime.now(timezone.utc) - blob.time_created).total_seconds()
+            if age_s <= ttl_s:
+                try:
+                    holder = json.loads(
+                        blob.download_as_bytes(if_generation_match=blob.generation)
+                    )
+                except (NotFound, api_exceptions.PreconditionFailed):
+                    continue
+                except ValueError:
+                    holder = {}
+                return False, holder
+
+            print(f"[WARN] Taking over stale claim gs://{bucket}/{object_name}")
+            try:
+                blob.delete(if_generation_match=blob.generation)
+            except (NotFound, api_exceptions.PreconditionFailed):
+                pass
+        return False, {}
+
+    def download_bytes(self, obj: GCSObject) -> bytes:
+        return self.client.bucket(obj.bucket).blob(obj.name).download_as_bytes()
+
+    def list_objects(self, bucket: str, prefix: str) -> List[GCSObject]:
+        return [
+            GCSObject(bucket=bucket, name=b.name)
+            for b in self.client.list_blobs(bucket, prefix=prefix)
+        ]
+
+    def delete_object(self, obj: GCSObject) -> None:
+        try:
+            self.client.bucket(obj.bucket).blob(obj.name).delete()
+        except NotFound:
+            pass
+
+
+class BulkUploader:
+    """
+    Sube muchos objetos pequeños en paralelo con un pool de hilos que
+    comparte el pool de conexiones (ampliado) del StorageClient.
+
+    submit() devuelve un Future[GCSObject] y bloquea mientras haya
+    max_pending subidas sin terminar (memoria acotada). Cada objeto se
+    reintenta ante 429/5xx/errores de red con backoff exponencial con jitter;
+    los nombres son por hash, así que reintentar es idempotente.
+    """
+
+    def __init__(
+        self,
+        storage_client: StorageClient,
+        *,
+        concurrency: int,
+        max_pending: Optional[int] = None,
+        max_retries: int = 5,
+        backoff_base_s: float = 0.25,
+        backoff_max_s: float = 10.0,
+    ) -> None:
+        self.storage = storage_client
+        self.concurrency = max(1, int(concurrency))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+
+        self.storage._reserve_connections(self.concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="gcs-upload"
+        )
+        self._slots = threading.BoundedSemaphore(
+            max(self.concurrency, int(max_pending or self.concurrency * 4))
+        )
+        self._lock = threading.Lock()
+        self._objects = 0
+        self._bytes = 0
+        self._retries = 0
+        self._failures = 0
+        self._t0: Optional[float] = None
+        self._closed = False
+
+    def submit(
+        self, bucket: str, object_name: str, data: bytes, content_type: str
+    ) -> Future:
+        self._slots.acquire()
+        with self._lock:
+            if self._t0 is None:
+                self._t0 = time.monotonic()
+        try:
+            fut = self._executor.submit(
+                self._upload, bucket, object_name, data, content_type
+            )
+        except Exception:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _: self._slots.release())
+        return fut
+
+    def _upload(
+        self, bucket: str, object_name: str, data: bytes, content_type: str
+    ) -> GCSObject:
+        blob = self.storage.client.bucket(bucket).blob(object_name)
+        attempt = 0
+        while True:
+            try:
+                blob.upload_from_string(data, content_type=content_type)
+                break
+            except RETRYABLE_UPLOAD_ERRORS as e:
+                if attempt >= self.max_retries:
+                    with self._lock:
+                        self._failures += 1
+                    raise
+                cap = min(self.backoff_max_s, self.backoff_base_s * (2**attempt))
+                delay = random.uniform(0, cap)
+                print(
+                    f"[WARN] GCS upload retry {attempt + 1} for {object_name} "
+                    f"in {delay:.2f}s: {e!r}"
+                )
+                with self._lock:
+                    self._retries += 1
+                time.sleep(delay)
+                attempt += 1
+            except Exception:
+                with self._lock:
+                    self._failures += 1
+                raise
+
+        with self._lock:
+            self._objects += 1
+            self._bytes += len(data)
+        return GCSObject(bucket=bucket, name=object_name)
+
+    def stats(self) -> BulkUploadStats:
+        with self._lock:
+            elapsed = time.monotonic() - self._t0 if self._t0 is not None else 0.0
+            return BulkUploadStats(
+                objects=self._objects,
+                bytes=self._bytes,
+                elapsed_s=elapsed,
+                retries=self._retries,
+                failures=self._failures,
+            )
+
+    def close(self, cancel_pending: bool = False) -> BulkUploadStats:
+        """Espera a las subidas en curso y devuelve las estadísticas."""
+        self._executor.shutdown(wait=True, cancel_futures=cancel_pending)
+        if not self._closed:
+            self._closed = True
+            self.storage._release_connections(self.concurrency)
+        return self.stats()
+
+
+@dataclass(frozen=True)
+class RangeReadStats:
+    requests: int
+    bytes: int
+    hits: int
+    misses: int
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        return (
+            f"{self.requests} range requests, {self.bytes / 1e6:.1f} MB fetched, "
+            f"{self.hits}/{total} block cache hits"
+        )
+
+
+class GCSRangeReader(io.RawIOBase):
+    """
+    Fichero de solo lectura y con seek sobre un objeto de GCS, leído por
+    rangos (zipfile.ZipFile lo abre directamente). El objeto se lee en
+    bloques de block_size que se guardan en una caché LRU de cache_blocks;
+    los bloques que faltan de una misma lectura se piden en una sola
+    petición. Con lectura secuencial se piden en segundo plano los
+    read_ahead bloques siguientes. hint() pide un tramo exacto para las
+    lecturas siguientes (acceso disperso sin traer bloques enteros). La
+    generación queda fijada al abrir: si el objeto se reemplaza, las
+    lecturas fallan en vez de mezclar datos.
+    """
+
+    def __init__(
+        self,
+        storage_client: StorageClient,
+        obj: GCSObject,
+        *,
+        block_size: int = 4 * 1024 * 1024,
+        cache_blocks: int = 16,
+        read_ahead: int = 2,
+    ) -> None:
+        super().__init__()
+        blob = storage_client.client.bucket(obj.bucket).get_blob(obj.name)
+        if blob is None:
+            raise NotFound(f"No existe {obj.uri}")
+        self.obj = obj
+        self.size = int(blob.size or 0)
+        self.block_size = max(64 * 1024, int(block_size))
+        self.cache_blocks = max(1, int(cache_blocks))
+        self.read_ahead = max(0, int(read_ahead))
+        self._blob = storage_client.client.bucket(obj.bucket).blob(
+            obj.name, generation=blob.generation
+        )
+
+        self._pos = 0
+        self._last_block = -2
+        # Tramo pedido con hint(): (inicio, bytes)
+        self._window: Optional[Tuple[int, bytes]] = None
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[int, bytes]" = OrderedDict()
+        self._inflight: Dict[int, Future] = {}
+        self._prefetcher = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="gcs-readahead")
+            if self.read_ahead
+            else None
+        )
+        self._requests = 0
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    # --- io.RawIOBase ---
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"whence inválido: {whence}")
+        if pos < 0:
+            raise ValueError("posición negativa")
+        self._pos = pos
+        return pos
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self.size - self._pos)
+        if n <= 0:
+            return 0
+        if self._window is not None:
+            start, data = self._window
+            offset = self._pos - start
+            if 0 <= offset and offset + n <= len(data):
+                memoryview(b)[:n] = data[offset : offset + n]
+                self._pos += n
+                return n
+
+        first = self._pos // self.block_size
+        last = (self._pos + n - 1) // self.block_size
+        blocks = self._blocks(first, last)
+
+        out = memoryview(b)
+        written = 0
+        pos = self._pos
+        for idx in range(first, last + 1):
+            data = blocks[idx]
+            start = pos - idx * self.block_size
+            chunk = data[start : start + n - written]
+            out[written : written + len(chunk)] = chunk
+            written += len(chunk)
+            pos += len(chunk)
+        self._pos = pos
+
+        sequential = first in (self._last_block, self._last_block + 1)
+        self._last_block = last
+        if sequential:
+            self._prefetch(last + 1, last + self.read_ahead)
+        return written
+
+    def hint(self, start: int, end: int) -> None:
+        """
+        Las próximas lecturas caen en [start, end): se pide ese tramo exacto
+        en una petición y se sirven de él, sin caché de bloques ni
+        read-ahead. Lo que quede fuera se lee como siempre.
+        """
+        start = max(0, int(start))
+        end = min(self.size, int(end))
+        self._window = (start, self._fetch_range(start, end)) if end > start else None
+
+    def close(self) -> None:
+        if not self.closed and self._prefetcher is not None:
+            self._prefetcher.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            self._cache.clear()
+            self._inflight.clear()
+        self._window = None
+        super().close()
+
+    # --- bloques ---
+
+    def stats(self) -> RangeReadStats:
+        with self._lock:
+            return RangeReadStats(
+                requests=self._requests,
+                bytes=self._bytes,
+                hits=self._hits,
+                misses=self._misses,
+            )
+
+    def _nb_blocks(self) -> int:
+        return (self.size + self.block_size - 1) // self.block_size
+
+    def _fetch_range(self, start: int, end: int) -> bytes:
+        data = self._blob.download_as_bytes(start=start, end=end - 1, checksum=None)
+        if len(data) != end - start:
+            raise IOError(
+                f"Lectura parcial de {self.obj.uri}: {len(data)} de {end - start} bytes"
+            )
+        with self._lock:
+            self._requests += 1
+            self._bytes += len(data)
+        return data
+
+    def _fetch(self, first: int, last: int) -> Dict[int, bytes]:
+        """Bloques [first, last] en una sola petición Range."""
+        start = first * self.block_size
+        end = min(self.size, (last + 1) * self.block_size)
+        data = self._fetch_range(start, end)
+        blocks = {
+            idx: data[
+                (idx - first) * self.block_size : (idx - first + 1) * self.block_size
+            ]
+            for idx in range(first, last + 1)
+        }
+        with self._lock:
+            for idx, block in blocks.items():
+                self._cache[idx] = block
+                self._cache.move_to_end(idx)
+            while len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+        return blocks
+
+    def _blocks(self, first: int, last: int) -> Dict[int, bytes]:
+        # Devuelve los bloques pedidos aunque no quepan todos en la caché
+        found: Dict[int, bytes] = {}
+        waiting: Dict[int, Future] = {}
+        missing: List[int] = []
+        with self._lock:
+            for idx in range(first, last + 1):
+                block = self._cache.get(idx)
+                if block is not None:
+                    self._cache.move_to_end(idx)
+                    self._hits += 1
+                    found[idx] = block
+                elif idx in self._inflight:
+                    self._hits += 1
+                    waiting[idx] = self._inflight[idx]
+                else:
+                    self._misses += 1
+                    missing.append(idx)
+
+        for idx, fut in waiting.items():
+            found.update(fut.result())
+
+        # Tramos contiguos de bloques que faltan: una petición por tramo
+        run: List[int] = []
+        for idx in missing + [-1]:
+            if run and idx != run[-1] + 1:
+                found.update(self._fetch(run[0], run[-1]))
+                run = []
+            if idx >= 0:
+                run.append(idx)
+        return found
+
+    def _prefetch(self, first: int, last: int) -> None:
+        if self._prefetcher is None:
+            return
+        last = min(last, self._nb_blocks() - 1)
+        submitted: Dict[int, Future] = {}
+        with self._lock:
+            for idx in range(first, last + 1):
+                if idx in self._cache or idx in self._inflight:
+                    continue
+                fut = self._prefetcher.submit(self._fetch, idx, idx)
+                self._inflight[idx] = submitted[idx] = fut
+        # Fuera del lock: si el future ya terminó, el callback corre aquí
+        # mismo y vuelve a tomar el lock
+        for idx, fut in submitted.items():
+            fut.add_done_callback(lambda _, i=idx: self._prefetched(i))
+
+    def _prefetched(self, idx: int) -> None:
+        with self._lock:
+            self._inflight.pop(idx, None)
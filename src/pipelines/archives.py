@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import importlib.util
+import tarfile
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import BinaryIO, Iterator, Optional
+
+ARCHIVE_ZIP = "zip"
+ARCHIVE_TAR = "tar"
+ARCHIVE_TAR_GZ = "tar.gz"
+ARCHIVE_TAR_ZST = "tar.zst"
+ARCHIVES = {ARCHIVE_ZIP, ARCHIVE_TAR, ARCHIVE_TAR_GZ, ARCHIVE_TAR_ZST}
+
+# Sufijo del nombre -> tipo (los compuestos antes que ".tar")
+ARCHIVE_SUFFIXES = (
+    (".tar.gz", ARCHIVE_TAR_GZ),
+    (".tgz", ARCHIVE_TAR_GZ),
+    (".tar.zst", ARCHIVE_TAR_ZST),
+    (".tar.zstd", ARCHIVE_TAR_ZST),
+    (".tzst", ARCHIVE_TAR_ZST),
+    (".tar", ARCHIVE_TAR),
+    (".zip", ARCHIVE_ZIP),
+)
+# Extensión canónica del objeto de staging
+ARCHIVE_EXT = {
+    ARCHIVE_ZIP: ".zip",
+    ARCHIVE_TAR: ".tar",
+    ARCHIVE_TAR_GZ: ".tar.gz",
+    ARCHIVE_TAR_ZST: ".tar.zst",
+}
+ARCHIVE_MIME = {
+    ARCHIVE_ZIP: "application/zip",
+    ARCHIVE_TAR: "application/x-tar",
+    ARCHIVE_TAR_GZ: "application/gzip",
+    ARCHIVE_TAR_ZST: "application/zstd",
+}
+
+
+def archive_kind(filename: str) -> Optional[str]:
+    """Tipo de archivo por la extensión del nombre; None si no se soporta."""
+    name = (filename or "").strip().lower()
+    for suffix, kind in ARCHIVE_SUFFIXES:
+        if name.endswith(suffix):
+            return kind
+    return None
+
+
+@lru_cache(maxsize=1)
+def zstd_available() -> bool:
+    """True si está instalado el paquete zstandard (necesario para .tar.zst)."""
+    return importlib.util.find_spec("zstandard") is not None
+
+
+def archive_supported(kind: str) -> bool:
+    """Si este despliegue puede leer el tipo (tar.zst necesita zstandard)."""
+    return kind in ARCHIVES and (kind != ARCHIVE_TAR_ZST or zstd_available())
+
+
+def readable_archive_kind(filename: str) -> Optional[str]:
+    """
+    archive_kind para validar subidas: None también si el tipo no se puede
+    leer aquí, para rechazarlo antes de aceptar la subida y no en el Job.
+    """
+    kind = archive_kind(filename)
+    return kind if kind is not None and archive_supported(kind) else None
+
+
+def is_streaming_archive(kind: str) -> bool:
+    """Los tar se leen de principio a fin (el ZIP necesita su directorio final)."""
+    return kind in {ARCHIVE_TAR, ARCHIVE_TAR_GZ, ARCHIVE_TAR_ZST}
+
+
+@contextmanager
+def open_tar_stream(fileobj: BinaryIO, kind: str) -> Iterator[tarfile.TarFile]:
+    """
+    TarFile en modo stream ("r|"): recorre las entradas según llegan los
+    bytes, sin seek. gzip lo descomprime tarfile; zstd necesita el paquete
+    opcional zstandard.
+    """
+    if kind == ARCHIVE_TAR:
+        with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+            yield tar
+        return
+    if kind == ARCHIVE_TAR_GZ:
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+            yield tar
+        return
+    if kind != ARCHIVE_TAR_ZST:
+        raise ValueError(f"Archivo tar no soportado: {kind}")
+
+    try:
+        import zstandard  # type: ignore
+    except ImportError as e:
+        raise RuntimeError(
+            "Los archivos .tar.zst necesitan el paquete zstandard "
+            "(pip install zstandard)."
+        ) from e
+    with zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False) as raw:
+        with tarfile.open(fileobj=raw, mode="r|") as tar:
+            yield tar
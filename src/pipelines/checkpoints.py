@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import json
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+from google.api_core.exceptions import NotFound
+
+from src.gcp.storage_client import GCSObject, StorageClient
+
+CHECKPOINT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class VideoCheckpoint:
+    """
+    Progreso de la extracción de un vídeo. Todo frame con timestamp <=
+    watermark_ms está subido a GCS y con sus filas en BigQuery (nb_frames
+    de ellos). De los posteriores, uploaded_uids ya están en GCS y
+    flushed_uids además en BigQuery.
+    job_ts / ingest_ts / sampling_mode fijan los nombres y filas de la
+    ejecución original para que un reintento continúe la misma.
+    """
+
+    video_uid: str
+    job_ts: str
+    ingest_ts: str
+    sampling_mode: str
+    watermark_ms: int = -1
+    nb_frames: int = 0
+    flushed_batches: int = 0
+    uploaded_uids: List[str] = field(default_factory=list)
+    flushed_uids: List[str] = field(default_factory=list)
+
+
+class CheckpointStore:
+    """Checkpoints en <prefix>/videos/<video_uid>.json."""
+
+    def __init__(self, storage: StorageClient, bucket: str, prefix: str) -> None:
+        self.storage = storage
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+
+    def _object(self, video_uid: str) -> GCSObject:
+        return GCSObject(
+            bucket=self.bucket, name=f"{self.prefix}/videos/{video_uid}.json"
+        )
+
+    def load(self, video_uid: str) -> Optional[VideoCheckpoint]:
+        try:
+            data = json.loads(self.storage.download_bytes(self._object(video_uid)))
+        except NotFound:
+            return None
+        except ValueError:
+            print(f"[WARN] Ignoring unreadable checkpoint for video {video_uid}")
+            return None
+        if data.pop("version", None) != CHECKPOINT_VERSION:
+            return None
+        return VideoCheckpoint(**data)
+
+    def save(self, cp: VideoCheckpoint) -> None:
+        obj = self._object(cp.video_uid)
+        self.storage.upload_bytes(
+            obj.bucket,
+            obj.name,
+            json.dumps({"version": CHECKPOINT_VERSION, **asdict(cp)}).encode("utf-8"),
+            content_type="application/json",
+        )
+
+    def delete(self, video_uid: str) -> None:
+        self.storage.delete_object(self._object(video_uid))
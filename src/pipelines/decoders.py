@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import queue
+import re
+import shutil
+import subprocess
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+DECODER_OPENCV = "opencv"
+DECODER_FFMPEG = "ffmpeg"
+DECODERS = {DECODER_OPENCV, DECODER_FFMPEG}
+
+FFMPEG_BIN = "ffmpeg"
+
+_SHOWINFO = "showinfo=checksum=0"
+_SHOWINFO_RE = re.compile(r"\bn:\s*(\d+)\s.*?\bpts_time:(\S+).*?\bs:(\d+)x(\d+)")
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG_BIN) is not None
+
+
+@dataclass
+class DecodedFrame:
+    """
+    Frame para el scoring de movimiento: timestamp + gris reducido. La
+    versión a resolución completa (BGR) se obtiene con load_full(), que en
+    el backend ffmpeg solo se convierte para los frames seleccionados.
+    """
+
+    frame_idx: int
+    timestamp_ms: int
+    gray_small: Any
+    _load_full: Callable[[], Any]
+
+    def load_full(self):
+        return self._load_full()
+
+
+def _shrink(frame, downscale_width: int):
+    import cv2  # type: ignore
+
+    h, w = frame.shape[:2]
+    if w <= downscale_width:
+        return frame
+    scale = downscale_width / float(w)
+    new_h = max(1, int(round(h * scale)))
+    return cv2.resize(frame, (downscale_width, new_h), interpolation=cv2.INTER_AREA)
+
+
+def downscale_gray(frame, downscale_width: int):
+    import cv2  # type: ignore
+
+    return cv2.cvtColor(_shrink(frame, downscale_width), cv2.COLOR_BGR2GRAY)
+
+
+class OpenCVDecoder:
+    """Decodifica todo a resolución completa con cv2.VideoCapture."""
+
+    name = DECODER_OPENCV
+
+    def __init__(
+        self, video_path: Path, downscale_width: int, start_ms: int = 0
+    ) -> None:
+        import cv2  # type: ignore
+
+        self.downscale_width = downscale_width
+        self.cap = cv2.VideoCapture(str(video_path))
+        self.start_ms = start_ms
+
+    def is_opened(self) -> bool:
+        return bool(self.cap.isOpened())
+
+    def frames(self) -> Iterator[DecodedFrame]:
+        import cv2  # type: ignore
+
+        frame_idx = 0
+        if self.start_ms > 0:
+            self.cap.set(cv2.CAP_PROP_POS_MSEC, float(self.start_ms))
+            frame_idx = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES) or 0)
+        while True:
+            ok, frame = self.cap.read()
+            if not ok or frame is None:
+                break
+            timestamp_ms = int(round(self.cap.get(cv2.CAP_PROP_POS_MSEC) or 0.0))
+            yield DecodedFrame(
+                frame_idx=frame_idx,
+                timestamp_ms=timestamp_ms,
+                gray_small=downscale_gray(frame, self.downscale_width),
+                _load_full=lambda frame=frame: frame,
+            )
+            frame_idx += 1
+
+    def close(self) -> None:
+        self.cap.release()
+
+
+class FFmpegDecoder:
+    """
+    Un solo subproceso ffmpeg decodifica el vídeo y entrega cada frame en
+    yuv420p (sin convertir a BGR) por un pipe rawvideo; timestamps y
+    tamaños salen de showinfo (stderr). El scoring usa la luma reducida y
+    la conversión a BGR a resolución completa solo se hace para los frames
+    seleccionados: ningún frame se decodifica dos veces.
+    """
+
+    name = DECODER_FFMPEG
+
+    # Dimensiones pares para que los planos de croma de yuv420p cuadren
+    VF = "crop=trunc(iw/2)*2:trunc(ih/2)*2,format=yuv420p"
+
+    def __init__(
+        self, video_path: Path, downscale_width: int, start_ms: int = 0
+    ) -> None:
+        import cv2  # type: ignore
+
+        self.video_path = video_path
+        self.downscale_width = downscale_width
+        self.start_ms = start_ms
+
+        probe = cv2.VideoCapture(str(video_path))
+        self._opened = probe.isOpened()
+        probe.release()
+
+    def is_opened(self) -> bool:
+        return self._opened and ffmpeg_available()
+
+    def frames(self) -> Iterator[DecodedFrame]:
+        # Con -ss de entrada los timestamps de salida empiezan en 0
+        input_args = ("-ss", f"{self.start_ms / 1000.0:.3f}") if self.start_ms else ()
+        for n, timestamp_ms, yuv in iter_ffmpeg_rawvideo(
+            self.video_path, vf=self.VF, pix_fmt="yuv420p", input_args=input_args
+        ):
+            luma = yuv[: yuv.shape[0] * 2 // 3]
+            yield DecodedFrame(
+                frame_idx=n,
+                timestamp_ms=timestamp_ms + self.start_ms,
+                gray_small=_luma_to_gray(_shrink(luma, self.downscale_width)),
+                _load_full=lambda yuv=yuv: _yuv420p_to_bgr(yuv),
+            )
+
+    def close(self) -> None:
+        pass
+
+
+def _luma_to_gray(luma):
+    """Luma de rango limitado (16-235) a gris de rango completo, en la
+    misma escala que el gris que sale del BGR en el backend OpenCV."""
+    import cv2  # type: ignore
+
+    return cv2.LUT(luma, _limited_to_full_lut())
+
+
+@lru_cache(maxsize=1)
+def _limited_to_full_lut():
+    import numpy as np
+
+    y = np.arange(256, dtype=np.float32)
+    return np.clip(np.round((y - 16.0) * 255.0 / 219.0), 0, 255).astype(np.uint8)
+
+
+def _yuv420p_to_bgr(yuv):
+    import cv2  # type: ignore
+
+    return cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
+
+
+# Forma del ndarray de cada frame según pix_fmt: (w, h) -> shape
+_SHAPE_BY_PIX_FMT: Dict[str, Callable[[int, int], Tuple[int, ...]]] = {
+    "gray": lambda w, h: (h, w),
+    "bgr24": lambda w, h: (h, w, 3),
+    # Planos Y, U, V seguidos, como espera cv2.COLOR_YUV2BGR_I420
+    "yuv420p": lambda w, h: (h * 3 // 2, w),
+}
+
+
+def iter_ffmpeg_rawvideo(
+    video_path: Path,
+    *,
+    vf: str,
+    pix_fmt: str,
+    input_args: Sequence[str] = (),
+) -> Iterator[Tuple[int, int, Any]]:
+    """
+    Lanza ffmpeg con salida rawvideo por stdout y emite
+    (n, timestamp_ms, ndarray). Timestamps y tamaños salen de un filtro
+    showinfo añadido al final de vf (stderr). Mata el proceso al cerrar.
+    """
+    import numpy as np
+
+    frame_shape = _SHAPE_BY_PIX_FMT[pix_fmt]
+    cmd = [
+        FFMPEG_BIN,
+        "-hide_banner",
+        "-nostats",
+        "-loglevel",
+        "info",
+        *input_args,
+        "-i",
+        str(video_path),
+        "-an",
+        "-sn",
+        "-vf",
+        # Sin checksum: a resolución completa cuesta más que el propio filtro
+        f"{vf},{_SHOWINFO}" if vf else _SHOWINFO,
+        "-fps_mode",
+        "passthrough",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        pix_fmt,
+        "pipe:1",
+    ]
+    # stdout con buffer: read(n) devuelve n bytes salvo en EOF
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    infos: "queue.Queue" = queue.Queue()
+    stderr_tail: List[str] = []
+
+    def _read_stderr() -> None:
+        assert proc.stderr is not None
+        for raw in proc.stderr:
+            line = raw.decode("utf-8", errors="replace")
+            m = _SHOWINFO_RE.search(line)
+            if m:
+                infos.put(m.groups())
+            else:
+                stderr_tail[:] = (stderr_tail + [line.strip()])[-20:]
+        infos.put(None)
+
+    reader = threading.Thread(target=_read_stderr, name="ffmpeg-log", daemon=True)
+    reader.start()
+
+    assert proc.stdout is not None
+    try:
+        while True:
+            info = infos.get()
+            if info is None:
+                break
+            n, pts_time, w, h = info
+            shape = frame_shape(int(w), int(h))
+            size = int(np.prod(shape))
+            buf = proc.stdout.read(size)
+            if len(buf) < size:
+                break
+            try:
+                timestamp_ms = int(round(float(pts_time) * 1000.0))
+            except ValueError:
+                timestamp_ms = 0
+
+            yield int(n), timestamp_ms, np.frombuffer(buf, dtype=np.uint8).reshape(
+                shape
+            )
+
+        rc = proc.wait()
+        reader.join()
+        if rc != 0:
+            raise RuntimeError(
+                f"ffmpeg decoder failed ({rc}): " + " | ".join(stderr_tail[-5:])
+            )
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def open_decoder(name: str, video_path: Path, downscale_width: int, start_ms: int = 0):
+    """
+    Abre el backend pedido; si ffmpeg no está disponible usa OpenCV.
+    start_ms debe ser un keyframe (el frame_idx del backend ffmpeg cuenta
+    desde ahí). Devuelve None si el vídeo no se puede abrir.
+    """
+    name = (name or DECODER_OPENCV).strip().lower()
+    if name not in DECODERS:
+        raise ValueError(f"FRAME_DECODER inválido: {name}")
+
+    if name == DECODER_FFMPEG:
+        dec = FFmpegDecoder(video_path, downscale_width, start_ms)
+        if dec.is_opened():
+            return dec
+        dec.close()
+        print("[WARN] ffmpeg decoder unavailable; falling back to OpenCV")
+
+    dec = OpenCVDecoder(video_path, downscale_width, start_ms)
+    if dec.is_opened():
+        return dec
+    dec.close()
+    return None
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from src.gcp.storage_client import GCSObject
+from src.pipelines.encoders import FORMAT_EXT, FORMAT_MIME, FrameEncoder
+
+RAW_IMAGES_PREFIX = "raw/images/"
+DERIVED_IMAGES_PREFIX = "derived/images"
+
+
+@dataclass(frozen=True)
+class DerivativeSpec:
+    """Versión reducida: lado mayor como mucho max_side píxeles."""
+
+    name: str
+    max_side: int
+
+
+@dataclass(frozen=True)
+class Derivative:
+    name: str
+    image_bytes: bytes
+    width: int
+    height: int
+    image_format: str
+
+    @property
+    def ext(self) -> str:
+        return FORMAT_EXT[self.image_format]
+
+    @property
+    def content_type(self) -> str:
+        return FORMAT_MIME[self.image_format]
+
+
+def parse_derivative_specs(spec: str) -> Tuple[DerivativeSpec, ...]:
+    """'thumb:320,train:1280' -> specs. Vacío = sin derivados."""
+    specs: List[DerivativeSpec] = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, size = part.partition(":")
+        name = name.strip().lower()
+        try:
+            max_side = int(size)
+        except ValueError:
+            max_side = 0
+        if not name or not name.isidentifier() or max_side <= 0:
+            raise ValueError(f"IMAGE_DERIVATIVES inválido: {part!r}")
+        specs.append(DerivativeSpec(name=name, max_side=max_side))
+    if len({s.name for s in specs}) != len(specs):
+        raise ValueError("IMAGE_DERIVATIVES: nombres repetidos")
+    return tuple(specs)
+
+
+def _target_size(width: int, height: int, max_side: int) -> Tuple[int, int]:
+    scale = max_side / float(max(width, height))
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def derivatives_from_bgr(
+    frame, specs: Tuple[DerivativeSpec, ...], encoder: FrameEncoder
+) -> Tuple[Derivative, ...]:
+    """
+    Derivados de un frame BGR ya decodificado (cv2). Solo los que reducen
+    la imagen: si el original ya cabe, los consumidores usan raw/images.
+    """
+    import cv2  # type: ignore
+
+    height, width = frame.shape[:2]
+    out: List[Derivative] = []
+    for spec in specs:
+        if max(width, height) <= spec.max_side:
+            continue
+        w, h = _target_size(width, height, spec.max_side)
+        small = cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+        data = encoder.encode(small)
+        if data:
+            out.append(Derivative(spec.name, data, w, h, encoder.image_format))
+    return tuple(out)
+
+
+def derivatives_from_pil(
+    img, specs: Tuple[DerivativeSpec, ...], encoder: FrameEncoder
+) -> Tuple[Derivative, ...]:
+    """Igual que derivatives_from_bgr para una imagen PIL ya cargada."""
+    import numpy as np
+    from PIL import Image  # type: ignore
+
+    width, height = img.size
+    out: List[Derivative] = []
+    rgb = None
+    for spec in specs:
+        if max(width, height) <= spec.max_side:
+            continue
+        if rgb is None:
+            rgb = img.convert("RGB")
+        w, h = _target_size(width, height, spec.max_side)
+        small = rgb.resize((w, h), Image.Resampling.LANCZOS)
+        # RGB -> BGR contiguo, que es lo que esperan los encoders
+        data = encoder.encode(np.ascontiguousarray(np.asarray(small)[:, :, ::-1]))
+        if data:
+            out.append(Derivative(spec.name, data, w, h, encoder.image_format))
+    return tuple(out)
+
+
+def derivative_object_name(raw_object_name: str, d: Derivative) -> str:
+    """raw/images/<...>/<uid>.<ext> -> derived/images/<nombre>/<...>/<uid>.<ext>"""
+    rel = raw_object_name
+    if rel.startswith(RAW_IMAGES_PREFIX):
+        rel = rel[len(RAW_IMAGES_PREFIX) :]
+    stem, _, _ = rel.rpartition(".")
+    return f"{DERIVED_IMAGES_PREFIX}/{d.name}/{stem or rel}{d.ext}"
+
+
+def derivative_row(
+    image_uid: str, d: Derivative, gcs_obj: GCSObject, ingest_ts: str
+) -> Dict:
+    """Fila de image__derivatives."""
+    return {
+        "image_uid": image_uid,
+        "derivative": d.name,
+        "gcs_uri": gcs_obj.uri,
+        "width": int(d.width),
+        "height": int(d.height),
+        "format": d.image_format,
+        "file_size_bytes": len(d.image_bytes),
+        "ingest_ts": ingest_ts,
+    }
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import io
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from src.config import Settings
+
+ENCODER_OPENCV = "opencv"
+ENCODER_PILLOW = "pillow"
+ENCODER_TURBOJPEG = "turbojpeg"
+ENCODERS = {ENCODER_OPENCV, ENCODER_PILLOW, ENCODER_TURBOJPEG}
+
+FORMAT_JPEG = "jpg"
+FORMAT_WEBP = "webp"
+FORMAT_EXT = {FORMAT_JPEG: ".jpg", FORMAT_WEBP: ".webp"}
+FORMAT_MIME = {FORMAT_JPEG: "image/jpeg", FORMAT_WEBP: "image/webp"}
+
+# Submuestreo de croma JPEG; "" = el valor por defecto de cada backend
+SUBSAMPLINGS = {"", "444", "422", "420"}
+
+# Avisos de backend ya mostrados (el encoder se abre por vídeo / worker)
+_warned = set()
+_warned_lock = threading.Lock()
+
+
+def _warn_once(message: str) -> None:
+    with _warned_lock:
+        if message in _warned:
+            return
+        _warned.add(message)
+    print(f"[WARN] {message}")
+
+
+@dataclass(frozen=True)
+class EncoderOptions:
+    """Formato y calidad de salida (la calidad aplica también a WebP)."""
+
+    image_format: str = FORMAT_JPEG
+    quality: int = 92
+    subsampling: str = ""
+    optimize: bool = False
+
+    @property
+    def ext(self) -> str:
+        return FORMAT_EXT[self.image_format]
+
+    @property
+    def content_type(self) -> str:
+        return FORMAT_MIME[self.image_format]
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "EncoderOptions":
+        opts = cls(
+            image_format=settings.frame_image_format,
+            quality=settings.frame_jpeg_quality,
+            subsampling=settings.frame_jpeg_subsampling,
+            optimize=settings.frame_jpeg_optimize,
+        )
+        if opts.image_format not in FORMAT_EXT:
+            raise ValueError(f"FRAME_IMAGE_FORMAT inválido: {opts.image_format}")
+        if opts.subsampling not in SUBSAMPLINGS:
+            raise ValueError(f"FRAME_JPEG_SUBSAMPLING inválido: {opts.subsampling}")
+        return opts
+
+
+class FrameEncoder:
+    """Codifica frames BGR uint8 (los de OpenCV) a bytes de imagen."""
+
+    name = ""
+
+    def __init__(self, options: EncoderOptions) -> None:
+        self.options = options
+
+    @property
+    def image_format(self) -> str:
+        return self.options.image_format
+
+    @property
+    def ext(self) -> str:
+        return self.options.ext
+
+    @property
+    def content_type(self) -> str:
+        return self.options.content_type
+
+    def encode(self, frame) -> Optional[bytes]:
+        raise NotImplementedError
+
+
+class OpenCVEncoder(FrameEncoder):
+    """cv2.imencode (libera el GIL)."""
+
+    name = ENCODER_OPENCV
+
+    def __init__(self, options: EncoderOptions) -> None:
+        super().__init__(options)
+        import cv2  # type: ignore
+
+        if options.image_format == FORMAT_WEBP:
+            self._params = [int(cv2.IMWRITE_WEBP_QUALITY), int(options.quality)]
+            return
+
+        self._params = [int(cv2.IMWRITE_JPEG_QUALITY), int(options.quality)]
+        if options.optimize:
+            self._params += [int(cv2.IMWRITE_JPEG_OPTIMIZE), 1]
+        sampling = {
+            "444": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_444", None),
+            "422": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_422", None),
+            "420": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_420", None),
+        }.get(options.subsampling)
+        if sampling is not None:
+            self._params += [int(cv2.IMWRITE_JPEG_SAMPLING_FACTOR), int(sampling)]
+
+    def encode(self, frame) -> Optional[bytes]:
+        import cv2  # type: ignore
+
+        ok, buf = cv2.imencode(self.ext, frame, self._params)
+        return buf.tobytes() if ok else None
+
+
+class PillowEncoder(FrameEncoder):
+    """Pillow (libjpeg / libwebp); convierte BGR -> RGB antes de codificar."""
+
+    name = ENCODER_PILLOW
+
+    def encode(self, frame) -> Optional[bytes]:
+        import cv2  # type: ignore
+        from PIL import Image  # type: ignore
+
+        img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        buf = io.BytesIO()
+        if self.options.image_format == FORMAT_WEBP:
+            img.save(buf, format="WEBP", quality=int(self.options.quality))
+            return buf.getvalue()
+
+        kwargs: Dict = {
+            "quality": int(self.options.quality),
+            "optimize": self.options.optimize,
+        }
+        if self.options.subsampling:
+            kwargs["subsampling"] = {"444": 0, "422": 1, "420": 2}[
+                self.options.subsampling
+            ]
+        img.save(buf, format="JPEG", **kwargs)
+        return buf.getvalue()
+
+
+class TurboJPEGEncoder(FrameEncoder):
+    """
+    libjpeg-turbo vía PyTurboJPEG (opcional: paquete y librería del sistema).
+    Solo JPEG; optimize reescribe las tablas Huffman sin pérdida.
+    """
+
+    name = ENCODER_TURBOJPEG
+
+    def __init__(self, options: EncoderOptions) -> None:
+        super().__init__(options)
+        import turbojpeg  # type: ignore
+
+        self._tj = turbojpeg
+        self._local = threading.local()
+        self._subsample = {
+            "": turbojpeg.TJSAMP_420,
+            "444": turbojpeg.TJSAMP_444,
+            "422": turbojpeg.TJSAMP_422,
+            "420": turbojpeg.TJSAMP_420,
+        }[options.subsampling]
+        # Carga la librería ya: si falta, falla al abrir y no en cada frame
+        handle = self._handle()
+        self._optimize = options.optimize and hasattr(handle, "optimize")
+        if options.optimize and not self._optimize:
+            _warn_once(
+                "FRAME_JPEG_OPTIMIZE needs PyTurboJPEG with optimize(); "
+                "turbojpeg frames are written without Huffman optimization"
+            )
+
+    def _handle(self):
+        # Una instancia por hilo de encode
+        handle = getattr(self._local, "handle", None)
+        if handle is None:
+            handle = self._tj.TurboJPEG()
+            self._local.handle = handle
+        return handle
+
+    def encode(self, frame) -> Optional[bytes]:
+        handle = self._handle()
+        data = handle.encode(
+            frame,
+            quality=int(self.options.quality),
+            pixel_format=self._tj.TJPF_BGR,
+            jpeg_subsample=self._subsample,
+        )
+        if self._optimize:
+            data = handle.optimize(data)
+        return bytes(data)
+
+
+_BACKENDS = {
+    ENCODER_OPENCV: OpenCVEncoder,
+    ENCODER_PILLOW: PillowEncoder,
+    ENCODER_TURBOJPEG: TurboJPEGEncoder,
+}
+
+
+def open_encoder(name: str, options: EncoderOptions) -> FrameEncoder:
+    """
+    Abre el backend pedido; si turbojpeg no está disponible (o se pide WebP,
+    que no soporta) usa OpenCV y lo avisa una vez por proceso.
+    """
+    name = (name or ENCODER_OPENCV).strip().lower()
+    if name not in ENCODERS:
+        raise ValueError(f"FRAME_ENCODER inválido: {name}")
+
+    if name == ENCODER_TURBOJPEG:
+        if options.image_format != FORMAT_JPEG:
+            _warn_once("turbojpeg encoder only writes JPEG; falling back to OpenCV")
+            return OpenCVEncoder(options)
+        try:
+            return TurboJPEGEncoder(options)
+        except (ImportError, OSError, RuntimeError) as e:
+            _warn_once(
+                f"FRAME_ENCODER=turbojpeg unavailable ({e}); "
+                "falling back to OpenCV for this job"
+            )
+            return OpenCVEncoder(options)
+
+    return _BACKENDS[name](options)
+
+
+def encoder_from_settings(settings: Settings) -> FrameEncoder:
+    """FRAME_ENCODER con FRAME_IMAGE_FORMAT / calidad / submuestreo / optimize."""
+    return open_encoder(settings.frame_encoder, EncoderOptions.from_settings(settings))
+
+
+def check_encoder(settings: Settings) -> str:
+    """
+    Abre FRAME_ENCODER al arrancar el worker para que un backend no
+    disponible se avise antes de procesar nada. Devuelve el backend efectivo.
+    """
+    encoder = encoder_from_settings(settings)
+    if encoder.name != settings.frame_encoder:
+        print(
+            f"[INFO] Frame encoder: {encoder.name} (requested {settings.frame_encoder})"
+        )
+    return encoder.name
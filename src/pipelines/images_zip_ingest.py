@@ -2,22 +2,53 @@ from __future__ import annotations
 
 import io
 import os
+import tarfile
 import zipfile
 import hashlib
+import multiprocessing
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Union
 
 from PIL import Image  # type: ignore
 
 from src.config import Settings
-from src.gcp.storage_client import StorageClient
+from src.gcp.storage_client import GCSObject, GCSRangeReader, StorageClient
 from src.gcp.bigquery_client import BigQueryClient
+from src.pipelines.archives import open_tar_stream
+from src.pipelines.derivatives import (
+    Derivative,
+    DerivativeSpec,
+    derivative_object_name,
+    derivative_row,
+    derivatives_from_pil,
+    parse_derivative_specs,
+)
+from src.pipelines.encoders import encoder_from_settings
 
 JOB_TS_FMT = "%Y%m%dT%H%M%SZ"
 
 ALLOWED_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+# Lectura por bloques al hashear entradas del ZIP
+HASH_CHUNK_SIZE = 1024 * 1024
+# Entradas por tarea de hash en el pool (amortiza el coste de IPC)
+HASH_BATCH_SIZE = 64
+# Cabecera local fija de una entrada ZIP y margen para su nombre/extra
+ZIP_LOCAL_HEADER_SIZE = 30
+ZIP_LOCAL_HEADER_SLACK = 1024
+# Tope de bytes de un micro-lote de tar (además de TAR_BATCH_SIZE imágenes)
+TAR_BATCH_MAX_BYTES = 64 * 1024 * 1024
+
 MIME_BY_EXT = {
     ".jpg": "image/jpeg",
     ".jpeg": "image/jpeg",
@@ -66,138 +97,656 @@ class ZipIngestResult:
     nb_images_inserted: int
     nb_images_skipped_duplicates: int
     nb_images_invalid: int
+    # Rendimiento del job completo (hash + dedupe + validación + subida)
+    elapsed_s: float = 0.0
+    images_per_s: float = 0.0
+    mb_per_s: float = 0.0
+    # Insertadas tras decodificarlas enteras (muestreo estricto o derivados)
+    nb_images_decoded: int = 0
+
+
+@dataclass(frozen=True)
+class ZipEntry:
+    image_uid: str
+    index: int  # posición en ZipFile.infolist()
+    ext: str
+
+
+@dataclass(frozen=True)
+class ValidatedImage:
+    image_uid: str
+    data: bytes
+    width: int
+    height: int
+    out_ext: str
+    derivatives: Tuple[Derivative, ...]
+    # True si se decodificó entera (muestreo estricto o derivados)
+    decoded: bool = False
+
+
+def sha256_zip_entry(z: zipfile.ZipFile, info: zipfile.ZipInfo) -> str:
+    """sha256 de una entrada, descomprimiendo por bloques."""
+    h = hashlib.sha256()
+    with z.open(info) as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def strict_sampled(image_uid: str, rate: float) -> bool:
+    """Muestreo determinista por hash: la misma imagen siempre cae igual."""
+    if rate <= 0:
+        return False
+    if rate >= 1:
+        return True
+    return int(image_uid[:8], 16) < rate * 0x100000000
+
+
+def validate_image(
+    data: bytes,
+    in_ext: str,
+    specs: Tuple[DerivativeSpec, ...] = (),
+    encoder=None,
+    strict: bool = True,
+) -> Optional[Tuple[int, int, str, Tuple[Derivative, ...]]]:
+    """
+    (width, height, ext de salida, derivados) o None si no es válida.
+    Sin strict solo lee la cabecera (Image.open es perezoso: formato y
+    dimensiones sin descomprimir píxeles); con derivados siempre decodifica.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            if strict or specs:
+                im.load()
+            width, height = im.size
+            if width <= 0 or height <= 0:
+                return None
+            out_ext = pick_output_ext(im, in_ext)
+            derivatives = (
+                derivatives_from_pil(im, specs, encoder)
+                if specs and encoder is not None
+                else ()
+            )
+    except Exception:
+        return None
+    return int(width), int(height), out_ext, derivatives
+
+
+def validated_image(
+    image_uid: str,
+    data: bytes,
+    ext: str,
+    specs: Tuple[DerivativeSpec, ...],
+    encoder,
+    strict_rate: float,
+) -> Optional[ValidatedImage]:
+    """validate_image con el muestreo estricto; None si no es válida."""
+    strict = strict_sampled(image_uid, strict_rate)
+    meta = validate_image(data, ext, specs, encoder, strict=strict)
+    if meta is None:
+        return None
+    width, height, out_ext, derivatives = meta
+    return ValidatedImage(
+        image_uid=image_uid,
+        data=data,
+        width=width,
+        height=height,
+        out_ext=out_ext,
+        derivatives=derivatives,
+        decoded=strict or bool(specs),
+    )
+
+
+# Origen del ZIP: fichero local u objeto de GCS leído por rangos
+ZipSource = Union[Path, GCSObject]
+
+
+@contextmanager
+def open_zip_source(
+    source: ZipSource, settings: Settings, storage: Optional[StorageClient] = None
+) -> Iterator[zipfile.ZipFile]:
+    """
+    ZipFile sobre un fichero local o, sin descargarlo, sobre un objeto de
+    GCS (GCSRangeReader): al abrir solo se lee el directorio central del
+    final del archivo y luego cada entrada por rangos.
+    """
+    if not isinstance(source, GCSObject):
+        with zipfile.ZipFile(source, "r") as z:
+            yield z
+        return
+
+    storage = storage or StorageClient(project_id=settings.gcp_project)
+    with storage.open_ranged(
+        source,
+        block_size=settings.zip_range_block_size,
+        cache_blocks=settings.zip_range_cache_blocks,
+        read_ahead=settings.zip_range_read_ahead,
+    ) as reader:
+        with zipfile.ZipFile(reader, "r") as z:
+            yield z
+        print(f"[INFO] ZIP range reads ({source.uri}): {reader.stats().summary()}")
+
+
+@contextmanager
+def open_tar_source(
+    source: ZipSource,
+    kind: str,
+    settings: Settings,
+    storage: Optional[StorageClient] = None,
+) -> Iterator[tarfile.TarFile]:
+    """
+    Tar en streaming sobre un fichero local o un objeto de GCS leído en
+    secuencia: el read-ahead de GCSRangeReader trae los bloques siguientes
+    mientras se procesan las entradas que ya han llegado.
+    """
+    if not isinstance(source, GCSObject):
+        with open(source, "rb") as f, open_tar_stream(f, kind) as tar:
+            yield tar
+        return
+
+    storage = storage or StorageClient(project_id=settings.gcp_project)
+    with storage.open_ranged(
+        source,
+        block_size=settings.zip_range_block_size,
+        cache_blocks=settings.zip_range_cache_blocks,
+        read_ahead=settings.zip_range_read_ahead,
+    ) as reader:
+        with open_tar_stream(reader, kind) as tar:
+            yield tar
+        print(f"[INFO] Tar range reads ({source.uri}): {reader.stats().summary()}")
+
+
+# Estado de cada worker del pool: su propio ZipFile de solo lectura y el
+# encoder de derivados (se crean una vez por proceso en el initializer)
+_worker: Dict[str, Any] = {}
+
+
+def _init_zip_worker(source: ZipSource, settings: Settings) -> None:
+    _close_zip_worker()
+    specs = parse_derivative_specs(settings.image_derivatives)
+    stack = ExitStack()
+    _worker["stack"] = stack
+    _worker["zip"] = stack.enter_context(open_zip_source(source, settings))
+    _worker["specs"] = specs
+    _worker["encoder"] = encoder_from_settings(settings) if specs else None
+    _worker["strict_rate"] = settings.zip_strict_sample_rate
+
+
+def _close_zip_worker() -> None:
+    stack = _worker.pop("stack", None)
+    if stack is not None:
+        stack.close()
+    _worker.clear()
+
+
+def _hash_entries(indexes: List[int]) -> List[Optional[str]]:
+    """sha256 de un lote de entradas; None si no se pueden leer."""
+    z: zipfile.ZipFile = _worker["zip"]
+    infos = z.infolist()
+    out: List[Optional[str]] = []
+    for i in indexes:
+        try:
+            out.append(sha256_zip_entry(z, infos[i]))
+        except Exception:
+            out.append(None)
+    return out
+
+
+def _validate_entry(entry: ZipEntry) -> Optional[ValidatedImage]:
+    """Relee y valida una entrada nueva; None si no es una imagen válida."""
+    z: zipfile.ZipFile = _worker["zip"]
+    info = z.infolist()[entry.index]
+    try:
+        if isinstance(z.fp, GCSRangeReader):
+            # Entrada suelta: una sola petición por cabecera local + datos
+            z.fp.hint(
+                info.header_offset,
+                info.header_offset
+                + ZIP_LOCAL_HEADER_SIZE
+                + len(info.filename.encode("utf-8"))
+                + len(info.extra)
+                + info.compress_size
+                + ZIP_LOCAL_HEADER_SLACK,
+            )
+        data = z.read(info)
+    except Exception:
+        return None
+    return validated_image(
+        entry.image_uid,
+        data,
+        entry.ext,
+        _worker["specs"],
+        _worker["encoder"],
+        _worker["strict_rate"],
+    )
+
+
+def zip_worker_pool(source: ZipSource, settings: Settings) -> Executor:
+    """
+    Pool de hash/validación (ZIP_PROCESS_WORKERS; 0 = uno por CPU). Cada
+    proceso abre el ZIP por su cuenta. Con 1 worker usa un hilo (sin coste
+    de arrancar procesos); hay que llamar a _close_zip_worker al acabar.
+    """
+    workers = settings.zip_process_workers or (os.cpu_count() or 1)
+    initargs = (source, settings)
+    if workers <= 1:
+        return ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="zip-worker",
+            initializer=_init_zip_worker,
+            initargs=initargs,
+        )
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_zip_worker,
+        initargs=initargs,
+    )
+
+
+def scan_zip_entries(
+    z: zipfile.ZipFile, pool: Executor
+) -> Tuple[List[ZipEntry], int, int]:
+    """
+    Primera pasada: (entradas con imagen, inválidas, duplicadas dentro del
+    ZIP). Los hashes se calculan en el pool por lotes; las entradas
+    repetidas (mismo contenido) solo se procesan una vez.
+    """
+    candidates: List[Tuple[int, str]] = []
+    invalid = 0
+    for i, info in enumerate(z.infolist()):
+        if info.is_dir():
+            continue
+        ext = normalize_ext(info.filename)
+        if ext not in ALLOWED_EXTS:
+            continue
+        if info.file_size == 0:
+            invalid += 1
+            continue
+        candidates.append((i, ext))
+
+    batches = [
+        candidates[i : i + HASH_BATCH_SIZE]
+        for i in range(0, len(candidates), HASH_BATCH_SIZE)
+    ]
+    entries: List[ZipEntry] = []
+    seen: set[str] = set()
+    duplicates = 0
+    hashed = pool.map(_hash_entries, [[i for i, _ in b] for b in batches])
+    for batch, uids in zip(batches, hashed):
+        for (index, ext), image_uid in zip(batch, uids):
+            if image_uid is None:
+                invalid += 1
+            elif image_uid in seen:
+                duplicates += 1
+            else:
+                seen.add(image_uid)
+                entries.append(ZipEntry(image_uid=image_uid, index=index, ext=ext))
+    return entries, invalid, duplicates
 
 
 def _chunk_list(items: List[str], size: int) -> List[List[str]]:
     return [items[i : i + size] for i in range(0, len(items), size)]
 
 
+def _check_ingest_args(source_type: str, dataset_name: str) -> str:
+    if source_type not in {"public", "captured", "simulated"}:
+        raise ValueError("source_type inválido. Usa public/captured/simulated.")
+    dataset_name = (dataset_name or "").strip()
+    if not dataset_name:
+        raise ValueError("dataset_name es obligatorio.")
+    return dataset_name
+
+
+class _RawImageWriter:
+    """
+    Parte común de la ingesta de ZIP y tar: recibe validaciones en curso
+    (Future de ValidatedImage o None), sube las imágenes válidas y sus
+    derivados y va insertando raw__images / image__derivatives por lotes
+    según terminan las subidas. Como mucho ZIP_MAX_IN_FLIGHT validaciones
+    y otras tantas subidas pendientes a la vez.
+    """
+
+    def __init__(
+        self,
+        *,
+        settings: Settings,
+        storage: StorageClient,
+        bq: BigQueryClient,
+        source_type: str,
+        dataset_name: str,
+        ingest_ts: str,
+        job_ts: str,
+    ) -> None:
+        self.settings = settings
+        self.bq = bq
+        self.source_type = source_type
+        self.dataset_name = dataset_name
+        self.ingest_ts = ingest_ts
+        self.job_ts = job_ts
+        self.window = max(1, settings.zip_max_in_flight)
+        self.uploader = storage.bulk_uploader(
+            concurrency=settings.zip_upload_workers,
+            max_pending=self.window,
+            max_retries=settings.gcs_upload_max_retries,
+        )
+        self.validating: Deque[Future] = deque()
+        # (subida original, fila, [(subida derivado, derivado)])
+        self.pending: List[Tuple[Future, Dict, List[Tuple[Future, Derivative]]]] = []
+        self.rows: List[Dict] = []
+        self.derivative_rows: List[Dict] = []
+        self.inserted = 0
+        self.decoded = 0
+        self.invalid = 0
+        self.uploaded_bytes = 0
+
+    def add(self, fut: Future) -> None:
+        """Encola una validación; sube las que ya hayan terminado."""
+        self.validating.append(fut)
+        self._drain(block=False)
+
+    def flush(self) -> None:
+        """Espera a todas las validaciones y subidas e inserta lo que quede."""
+        self._drain(block=True)
+        self._collect(block=True)
+
+    def close(self) -> None:
+        for fut in self.validating:
+            fut.cancel()
+        stats = self.uploader.close(cancel_pending=True)
+        print(f"[INFO] Image upload: {stats.summary()}")
+
+    def result(
+        self, t0: float, message: str, skipped: int, invalid: int
+    ) -> ZipIngestResult:
+        elapsed = time.monotonic() - t0
+        return ZipIngestResult(
+            status="ok",
+            message=message,
+            nb_images_inserted=self.inserted,
+            nb_images_skipped_duplicates=skipped,
+            nb_images_invalid=invalid + self.invalid,
+            elapsed_s=elapsed,
+            images_per_s=self.inserted / elapsed if elapsed > 0 else 0.0,
+            mb_per_s=self.uploaded_bytes / 1e6 / elapsed if elapsed > 0 else 0.0,
+            nb_images_decoded=self.decoded,
+        )
+
+    def _collect(self, block: bool) -> None:
+        # Pasa a rows las subidas terminadas; result() propaga el error
+        still: List[Tuple[Future, Dict, List[Tuple[Future, Derivative]]]] = []
+        for fut, row, derived in self.pending:
+            if block or (fut.done() and all(f.done() for f, _ in derived)):
+                row["gcs_uri"] = fut.result().uri
+                self.rows.append(row)
+                self.derivative_rows.extend(
+                    derivative_row(row["image_uid"], d, f.result(), self.ingest_ts)
+                    for f, d in derived
+                )
+            else:
+                still.append((fut, row, derived))
+        self.pending[:] = still
+
+        # Insert en chunks para no acumular demasiado; derivados después de
+        # su imagen
+        if self.rows and (block or len(self.rows) >= self.settings.images_chunk_size):
+            self.bq.insert_raw_images_chunked(self.rows)
+            self.rows.clear()
+            if self.derivative_rows:
+                self.bq.insert_image_derivatives_chunked(self.derivative_rows)
+                self.derivative_rows.clear()
+
+    def _submit(self, img: ValidatedImage) -> None:
+        bucket = self.settings.gcs_bucket
+        filename = f"{img.image_uid}{img.out_ext}"
+        obj = gcs_image_object(
+            self.source_type, self.dataset_name, self.job_ts, filename
+        )
+
+        derived = [
+            (
+                self.uploader.submit(
+                    bucket,
+                    derivative_object_name(obj, d),
+                    d.image_bytes,
+                    content_type=d.content_type,
+                ),
+                d,
+            )
+            for d in img.derivatives
+        ]
+        fut = self.uploader.submit(
+            bucket,
+            obj,
+            img.data,
+            content_type=MIME_BY_EXT.get(img.out_ext, "application/octet-stream"),
+        )
+        self.pending.append(
+            (
+                fut,
+                {
+                    "image_uid": img.image_uid,
+                    "source_type": self.source_type,
+                    "source_name": self.dataset_name,  # dataset como source_name
+                    "gcs_uri": None,  # se rellena al terminar la subida
+                    "ingest_ts": self.ingest_ts,
+                    "width": img.width,
+                    "height": img.height,
+                    "format": img.out_ext.lstrip("."),
+                    "sha256": img.image_uid,  # hash del contenido
+                    "file_size_bytes": int(len(img.data)),
+                },
+                derived,
+            )
+        )
+        self.inserted += 1
+        self.decoded += int(img.decoded)
+        self.uploaded_bytes += len(img.data)
+
+    def _drain(self, block: bool) -> None:
+        # Sube las validaciones terminadas (en orden; espera a la más
+        # antigua si la ventana está llena)
+        while self.validating and (
+            block or self.validating[0].done() or len(self.validating) >= self.window
+        ):
+            img = self.validating.popleft().result()
+            if img is None:
+                self.invalid += 1
+                continue
+            self._submit(img)
+            self._collect(block=False)
+
+
 def process_images_zip(
     *,
     settings: Settings,
-    local_zip_path: Path,
     source_type: str,
     dataset_name: str,
+    local_zip_path: Optional[Path] = None,
+    gcs_zip: Optional[GCSObject] = None,
 ) -> ZipIngestResult:
     """
-    - Descomprime ZIP
-    - Para cada imagen válida:
-        - image_uid = sha256(bytes)
-        - dedupe en BQ
+    Dos pasadas sobre el ZIP (local_zip_path, o gcs_zip leído por rangos
+    sin descargarlo), con memoria acotada (no depende del tamaño del
+    archivo):
+    - Primera: image_uid = sha256(bytes) de cada entrada, leída en streaming
+      en un pool de procesos (ZIP_PROCESS_WORKERS)
+    - Dedupe en BQ (y dentro del propio ZIP)
+    - Segunda, solo para las entradas nuevas:
+        - relee y valida la imagen en el mismo pool: solo cabecera, salvo
+          la fracción ZIP_STRICT_SAMPLE_RATE que se decodifica entera
         - sube a raw/images/<source_type>/<dataset_name>/<job_ts>/<image_uid>.<ext>
-        - inserta raw__images
+          en el pool de I/O (ZIP_UPLOAD_WORKERS)
+        - inserta raw__images por lotes según terminan las subidas
+        - con IMAGE_DERIVATIVES, sube las versiones reducidas (desde la misma
+          imagen ya decodificada) a derived/images/<nombre>/... e inserta
+          image__derivatives
     """
-    if source_type not in {"public", "captured", "simulated"}:
-        raise ValueError("source_type inválido. Usa public/captured/simulated.")
-    dataset_name = (dataset_name or "").strip()
-    if not dataset_name:
-        raise ValueError("dataset_name es obligatorio.")
+    dataset_name = _check_ingest_args(source_type, dataset_name)
+    source: Optional[ZipSource] = gcs_zip or local_zip_path
+    if source is None:
+        raise ValueError("Falta el ZIP (local_zip_path o gcs_zip).")
 
+    t0 = time.monotonic()
     storage = StorageClient(project_id=settings.gcp_project)
     bq = BigQueryClient(project_id=settings.gcp_project, settings=settings)
 
     ingest_ts = utc_now_iso()
     job_ts = utc_now_job_ts()
 
-    # 1) Leer ZIP y recolectar imágenes (en memoria, una a una)
-    #    Primero recolectamos (uid, bytes, meta preliminar) para dedupe por lotes
-    candidates: List[Tuple[str, bytes, str]] = []  # (image_uid, bytes, ext)
-    invalid = 0
-
-    with zipfile.ZipFile(local_zip_path, "r") as z:
-        for info in z.infolist():
-            if info.is_dir():
-                continue
-            name = info.filename
-            ext = normalize_ext(name)
-            if ext not in ALLOWED_EXTS:
-                continue
-
-            try:
-                data = z.read(info)
-                if not data:
-                    invalid += 1
-                    continue
-
-                image_uid = sha256_bytes(data)
-                candidates.append((image_uid, data, ext))
-            except Exception:
-                invalid += 1
-
-    if not candidates:
-        return ZipIngestResult(
-            status="ok",
-            message="ZIP sin imágenes válidas.",
-            nb_images_inserted=0,
-            nb_images_skipped_duplicates=0,
-            nb_images_invalid=invalid,
+    pool = zip_worker_pool(source, settings)
+    try:
+        with open_zip_source(source, settings, storage) as z:
+            # 1) Primera pasada: hash en streaming de cada entrada; solo se
+            #    guardan (uid, índice, ext), nunca los bytes
+            entries, invalid, in_zip_dups = scan_zip_entries(z, pool)
+        if not entries:
+            return ZipIngestResult(
+                status="ok",
+                message="ZIP sin imágenes válidas.",
+                nb_images_inserted=0,
+                nb_images_skipped_duplicates=in_zip_dups,
+                nb_images_invalid=invalid,
+                elapsed_s=time.monotonic() - t0,
+            )
+
+        # 2) Dedupe por lotes (BQ)
+        uids = [e.image_uid for e in entries]
+        existing: set[str] = set()
+        for chunk in _chunk_list(
+            uids, min(2000, max(1, settings.images_chunk_size * 4))
+        ):
+            existing |= bq.images_exist(chunk)
+        new_entries = [e for e in entries if e.image_uid not in existing]
+        skipped = in_zip_dups + len(entries) - len(new_entries)
+
+        # 3) Segunda pasada: el pool relee y valida como mucho
+        #    ZIP_MAX_IN_FLIGHT entradas a la vez, y el writer bloquea con
+        #    otras tantas subidas pendientes: la memoria no depende del
+        #    tamaño del ZIP
+        writer = _RawImageWriter(
+            settings=settings,
+            storage=storage,
+            bq=bq,
+            source_type=source_type,
+            dataset_name=dataset_name,
+            ingest_ts=ingest_ts,
+            job_ts=job_ts,
         )
+        try:
+            for entry in new_entries:
+                writer.add(pool.submit(_validate_entry, entry))
+            writer.flush()
+        finally:
+            writer.close()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if isinstance(pool, ThreadPoolExecutor):
+            _close_zip_worker()
 
-    # 2) Dedupe por lotes (BQ)
-    uids = [c[0] for c in candidates]
-    existing: set[str] = set()
-    for chunk in _chunk_list(uids, min(2000, max(1, settings.images_chunk_size * 4))):
-        existing |= bq.images_exist(chunk)
+    return writer.result(t0, "ZIP procesado correctamente.", skipped, invalid)
 
-    # 3) Subida + filas BQ
-    rows: List[Dict] = []
-    inserted = 0
-    skipped = 0
 
-    for image_uid, data, in_ext in candidates:
-        if image_uid in existing:
-            skipped += 1
-            continue
-
-        # Validación dims/formato
-        try:
-            with Image.open(io.BytesIO(data)) as im:
-                im.load()
-                width, height = im.size
-                out_ext = pick_output_ext(im, in_ext)
-                fmt = out_ext.lstrip(".")
-        except Exception:
-            invalid += 1
-            continue
-
-        filename = f"{image_uid}{out_ext}"
-        obj = gcs_image_object(source_type, dataset_name, job_ts, filename)
+def process_images_tar(
+    *,
+    settings: Settings,
+    source_type: str,
+    dataset_name: str,
+    kind: str,
+    local_tar_path: Optional[Path] = None,
+    gcs_tar: Optional[GCSObject] = None,
+) -> ZipIngestResult:
+    """
+    Una sola pasada en streaming sobre un tar / tar.gz / tar.zst (kind de
+    archives; local_tar_path, o gcs_tar leído en secuencia): cada entrada se
+    procesa según llega, sin esperar al final del archivo.
+    - image_uid = sha256(bytes) al leer la entrada
+    - Micro-lotes de TAR_BATCH_SIZE imágenes: dedupe en BQ (y dentro del tar)
+    - Validación de las nuevas en un pool de hilos (ZIP_PROCESS_WORKERS; solo
+      cabecera salvo ZIP_STRICT_SAMPLE_RATE), subida e inserción en
+      raw__images / image__derivatives igual que process_images_zip
+    La memoria la acotan el micro-lote y ZIP_MAX_IN_FLIGHT.
+    """
+    dataset_name = _check_ingest_args(source_type, dataset_name)
+    source: Optional[ZipSource] = gcs_tar or local_tar_path
+    if source is None:
+        raise ValueError("Falta el tar (local_tar_path o gcs_tar).")
 
-        gcs_obj = storage.upload_bytes(
-            settings.gcs_bucket,
-            obj,
-            data,
-            content_type=MIME_BY_EXT.get(out_ext, "application/octet-stream"),
-        )
+    t0 = time.monotonic()
+    storage = StorageClient(project_id=settings.gcp_project)
+    bq = BigQueryClient(project_id=settings.gcp_project, settings=settings)
 
-        rows.append(
-            {
-                "image_uid": image_uid,
-                "source_type": source_type,
-                "source_name": dataset_name,  # dataset como source_name
-                "gcs_uri": gcs_obj.uri,
-                "ingest_ts": ingest_ts,
-                "width": int(width),
-                "height": int(height),
-                "format": fmt,
-                "sha256": image_uid,  # hash del contenido
-                "file_size_bytes": int(len(data)),
-            }
-        )
-        inserted += 1
-
-        # Insert en chunks para no acumular demasiado
-        if len(rows) >= settings.images_chunk_size:
-            bq.insert_raw_images_chunked(rows)
-            rows.clear()
-
-    if rows:
-        bq.insert_raw_images_chunked(rows)
-
-    return ZipIngestResult(
-        status="ok",
-        message="ZIP procesado correctamente.",
-        nb_images_inserted=inserted,
-        nb_images_skipped_duplicates=skipped,
-        nb_images_invalid=invalid,
+    specs = parse_derivative_specs(settings.image_derivatives)
+    encoder = encoder_from_settings(settings) if specs else None
+    strict_rate = settings.zip_strict_sample_rate
+    batch_size = max(1, settings.tar_batch_size)
+
+    writer = _RawImageWriter(
+        settings=settings,
+        storage=storage,
+        bq=bq,
+        source_type=source_type,
+        dataset_name=dataset_name,
+        ingest_ts=utc_now_iso(),
+        job_ts=utc_now_job_ts(),
     )
+    pool = ThreadPoolExecutor(
+        max_workers=settings.zip_process_workers or (os.cpu_count() or 1),
+        thread_name_prefix="tar-validate",
+    )
+    # (uid, ext, bytes) leídos y pendientes de dedupe
+    batch: List[Tuple[str, str, bytes]] = []
+    batch_bytes = 0
+    seen: set[str] = set()
+    found = 0
+    invalid = 0
+    skipped = 0
+
+    def _flush_batch() -> None:
+        nonlocal batch_bytes, skipped
+        if not batch:
+            return
+        existing = bq.images_exist([uid for uid, _, _ in batch])
+        for uid, ext, data in batch:
+            if uid in existing:
+                skipped += 1
+                continue
+            writer.add(
+                pool.submit(
+                    validated_image, uid, data, ext, specs, encoder, strict_rate
+                )
+            )
+        batch.clear()
+        batch_bytes = 0
+
+    try:
+        with open_tar_source(source, kind, settings, storage) as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                ext = normalize_ext(member.name)
+                if ext not in ALLOWED_EXTS:
+                    continue
+                found += 1
+                f = tar.extractfile(member)
+                data = f.read() if f is not None else b""
+                if not data:
+                    invalid += 1
+                    continue
+                image_uid = sha256_bytes(data)
+                if image_uid in seen:
+                    skipped += 1
+                    continue
+                seen.add(image_uid)
+                batch.append((image_uid, ext, data))
+                batch_bytes += len(data)
+                if len(batch) >= batch_size or batch_bytes >= TAR_BATCH_MAX_BYTES:
+                    _flush_batch()
+        _flush_batch()
+        writer.flush()
+    finally:
+        writer.close()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    message = "Tar procesado correctamente." if found else "Tar sin imágenes válidas."
+    return writer.result(t0, message, skipped, invalid)
@@ -7,7 +7,16 @@ from google.cloud import storage
 from google.api_core.exceptions import NotFound
 
 from src.config import get_settings
-from src.pipelines.images_zip_ingest import process_images_zip
+from src.gcp.storage_client import GCSObject
+from src.pipelines.archives import (
+    ARCHIVE_EXT,
+    ARCHIVE_ZIP,
+    archive_kind,
+    archive_supported,
+)
+from src.pipelines.derivatives import parse_derivative_specs
+from src.pipelines.encoders import check_encoder
+from src.pipelines.images_zip_ingest import process_images_tar, process_images_zip
 
 
 def parse_gcs_uri(gcs_uri: str) -> tuple[str, str]:
@@ -34,26 +43,60 @@ def main() -> None:
     if not dataset_name:
         raise RuntimeError("Falta INPUT_DATASET_NAME")
 
-    local_zip = Path("/tmp/input_images.zip")
+    # Solo los derivados se codifican: avisa antes de empezar si el backend falta
+    if parse_derivative_specs(settings.image_derivatives):
+        check_encoder(settings)
 
     client = storage.Client(project=settings.gcp_project)
     bucket_name, object_name = parse_gcs_uri(gcs_uri)
     blob = client.bucket(bucket_name).blob(object_name)
 
-    # Descarga staging zip
-    local_zip.parent.mkdir(parents=True, exist_ok=True)
-    blob.download_to_filename(str(local_zip))
+    # Staging antiguo o sin extensión conocida: ZIP
+    kind = archive_kind(object_name) or ARCHIVE_ZIP
+    if not archive_supported(kind):
+        # Antes del try: el staging se conserva para reintentar con una
+        # imagen que tenga zstandard
+        raise RuntimeError(f"{object_name}: .tar.zst necesita el paquete zstandard")
+    local_zip = Path(f"/tmp/input_images{ARCHIVE_EXT[kind]}")
+    gcs_object = GCSObject(bucket=bucket_name, name=object_name)
 
     try:
-        res = process_images_zip(
-            settings=settings,
-            local_zip_path=local_zip,
-            source_type=source_type,
-            dataset_name=dataset_name,
-        )
+        if kind != ARCHIVE_ZIP:
+            # tar / tar.gz / tar.zst: una pasada, ingiriendo según se leen
+            # los bloques de GCS (no durante la subida)
+            res = process_images_tar(
+                settings=settings,
+                kind=kind,
+                gcs_tar=gcs_object,
+                source_type=source_type,
+                dataset_name=dataset_name,
+            )
+        elif settings.zip_range_reads:
+            # Lee el staging zip por rangos: sin descarga ni disco
+            res = process_images_zip(
+                settings=settings,
+                gcs_zip=gcs_object,
+                source_type=source_type,
+                dataset_name=dataset_name,
+            )
+        else:
+            # Descarga staging zip
+            local_zip.parent.mkdir(parents=True, exist_ok=True)
+            blob.download_to_filename(str(local_zip))
+            res = process_images_zip(
+                settings=settings,
+                local_zip_path=local_zip,
+                source_type=source_type,
+                dataset_name=dataset_name,
+            )
         print(
             f"[OK] {res.message} inserted={res.nb_images_inserted} dup={res.nb_images_skipped_duplicates} invalid={res.nb_images_invalid}"
         )
+        print(
+            f"[INFO] {kind.upper()} ingest: {res.elapsed_s:.1f}s, "
+            f"{res.images_per_s:.1f} images/s, {res.mb_per_s:.1f} MB/s, "
+            f"{res.nb_images_decoded} fully decoded"
+        )
     finally:
         # Borra staging tmp/zips
         try:
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import bisect
+import shutil
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Tuple
+
+from src.pipelines.decoders import ffmpeg_available, iter_ffmpeg_rawvideo
+
+SAMPLING_ADAPTIVE = "adaptive"
+SAMPLING_KEYFRAMES = "keyframes"
+SAMPLING_MODES = {SAMPLING_ADAPTIVE, SAMPLING_KEYFRAMES}
+
+FFPROBE_BIN = "ffprobe"
+
+# Margen para casar timestamps de ffprobe (paquetes) y ffmpeg (frames)
+MATCH_TOLERANCE_MS = 100
+
+
+@dataclass(frozen=True)
+class KeyframeIndex:
+    """Timestamps (ms, relativos al primer paquete) de todos los frames y
+    de los keyframes, en orden de presentación."""
+
+    frame_ts: List[int]
+    keyframe_ts: List[int]
+
+    def frame_idx(self, timestamp_ms: int) -> int:
+        return bisect.bisect_left(self.frame_ts, timestamp_ms)
+
+
+def keyframes_available() -> bool:
+    return ffmpeg_available() and shutil.which(FFPROBE_BIN) is not None
+
+
+def probe_keyframes(video_path: Path) -> Optional[KeyframeIndex]:
+    """
+    Lista los paquetes de vídeo con ffprobe (sin decodificar) y separa los
+    keyframes por el flag K. None si ffprobe falla.
+    """
+    cmd = [
+        FFPROBE_BIN,
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "csv=p=0",
+        str(video_path),
+    ]
+    try:
+        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+    except Exception:
+        return None
+
+    frames: List[float] = []
+    keys: List[float] = []
+    for line in out.decode("utf-8", errors="replace").splitlines():
+        pts_time, _, flags = line.strip().partition(",")
+        try:
+            t = float(pts_time)
+        except ValueError:
+            continue  # N/A
+        frames.append(t)
+        if "K" in flags:
+            keys.append(t)
+
+    if not frames:
+        return None
+
+    t0 = min(frames)
+    return KeyframeIndex(
+        frame_ts=sorted(int(round((t - t0) * 1000.0)) for t in frames),
+        keyframe_ts=sorted(int(round((t - t0) * 1000.0)) for t in keys),
+    )
+
+
+def thin_keyframes(
+    keyframe_ts: List[int], *, min_interval_ms: int, max_interval_ms: int
+) -> List[int]:
+    """
+    Se queda con un keyframe cada min_interval_ms como mucho, salvo que
+    saltarlo deje un hueco mayor que max_interval_ms hasta el siguiente.
+    """
+    kept: List[int] = []
+    for i, ts in enumerate(keyframe_ts):
+        if not kept or ts - kept[-1] >= min_interval_ms:
+            kept.append(ts)
+            continue
+        nxt = keyframe_ts[i + 1] if i + 1 < len(keyframe_ts) else None
+        if nxt is not None and nxt - kept[-1] > max_interval_ms:
+            kept.append(ts)
+    return kept
+
+
+def iter_keyframes(
+    video_path: Path, wanted_ts: List[int], start_ms: int = 0
+) -> Iterator[Tuple[int, Any]]:
+    """
+    Decodifica solo keyframes (ffmpeg -skip_frame nokey) y emite
+    (timestamp_ms, frame BGR) de los que están en wanted_ts. Con start_ms
+    empieza con un seek de entrada (p.ej. al reanudar).
+    """
+    input_args: Tuple[str, ...] = ("-skip_frame", "nokey")
+    if start_ms > 0:
+        input_args = ("-ss", f"{start_ms / 1000.0:.3f}") + input_args
+
+    j = 0
+    for _, timestamp_ms, frame in iter_ffmpeg_rawvideo(
+        video_path, vf="", pix_fmt="bgr24", input_args=input_args
+    ):
+        # Con -ss de entrada los timestamps de salida empiezan en 0
+        timestamp_ms += start_ms
+        while j < len(wanted_ts) and wanted_ts[j] < timestamp_ms - MATCH_TOLERANCE_MS:
+            j += 1
+        if j >= len(wanted_ts):
+            break
+        if abs(wanted_ts[j] - timestamp_ms) <= MATCH_TOLERANCE_MS:
+            j += 1
+            yield timestamp_ms, frame
+
+
+@dataclass(frozen=True)
+class Segment:
+    """
+    Tramo [start_ms, end_ms) de un vídeo, alineado a keyframes. Se decodifica
+    desde decode_from_ms (keyframe de warm-up) para que el muestreo adaptativo
+    llegue a start_ms con un estado aproximado al de una pasada completa.
+    """
+
+    index: int
+    start_ms: int
+    end_ms: Optional[int]  # None = hasta el final
+    decode_from_ms: int
+
+    def contains(self, timestamp_ms: int) -> bool:
+        return timestamp_ms >= self.start_ms and not self.is_after(timestamp_ms)
+
+    def is_after(self, timestamp_ms: int) -> bool:
+        return self.end_ms is not None and timestamp_ms >= self.end_ms
+
+
+def plan_segments(index: KeyframeIndex, shards: int, warmup_ms: int) -> List[Segment]:
+    """
+    Parte el vídeo en hasta `shards` tramos de duración parecida, con los
+    cortes en el keyframe más cercano a cada fracción.
+    """
+    keys = index.keyframe_ts
+    if not keys or shards <= 1:
+        return [Segment(index=0, start_ms=0, end_ms=None, decode_from_ms=0)]
+
+    duration_ms = index.frame_ts[-1]
+    bounds = [0]
+    for k in range(1, shards):
+        target = duration_ms * k / shards
+        i = bisect.bisect_left(keys, target)
+        near = [keys[j] for j in (i - 1, i) if 0 <= j < len(keys)]
+        cut = min(near, key=lambda ts: abs(ts - target))
+        if cut > bounds[-1]:
+            bounds.append(cut)
+
+    segments: List[Segment] = []
+    for i, start in enumerate(bounds):
+        end = bounds[i + 1] if i + 1 < len(bounds) else None
+        # Último keyframe <= start - warmup
+        j = bisect.bisect_right(keys, start - warmup_ms) - 1
+        decode_from = keys[j] if j >= 0 and start > 0 else 0
+        segments.append(
+            Segment(index=i, start_ms=start, end_ms=end, decode_from_ms=decode_from)
+        )
+    return segments
+
+
+def resume_segment(
+    index: Optional[KeyframeIndex], resume_after_ms: int, warmup_ms: int
+) -> Segment:
+    """
+    Tramo desde resume_after_ms (exclusivo) hasta el final, para reanudar
+    una extracción. Sin índice de keyframes se decodifica desde el inicio
+    (solo se ahorra la subida de lo ya hecho).
+    """
+    start = resume_after_ms + 1
+    decode_from = 0
+    if index is not None and index.keyframe_ts:
+        j = bisect.bisect_right(index.keyframe_ts, start - warmup_ms) - 1
+        decode_from = index.keyframe_ts[j] if j >= 0 else 0
+    return Segment(index=0, start_ms=start, end_ms=None, decode_from_ms=decode_from)
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from src.config import Settings
+
+HASH_BITS = 64
+
+
+def dhash(gray) -> int:
+    """
+    dHash de 64 bits: gris reducido a 9x8 y un bit por par de píxeles
+    vecinos en horizontal (izquierdo más claro que el derecho).
+    """
+    import cv2  # type: ignore
+    import numpy as np
+
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, :-1] > small[:, 1:]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class HashIndex:
+    """
+    Índice de hashes de 64 bits para búsquedas por distancia de Hamming <=
+    max_distance (multi-index hashing): el hash se parte en max_distance+1
+    bandas y, por el principio del palomar, un vecino coincide exactamente
+    en al menos una. Solo se comparan los candidatos de esas bandas.
+    Acotado a capacity hashes (los más antiguos salen primero).
+    """
+
+    def __init__(self, max_distance: int, capacity: int) -> None:
+        self.max_distance = max(0, int(max_distance))
+        self.capacity = max(1, int(capacity))
+        nbands = min(HASH_BITS, self.max_distance + 1)
+        width = HASH_BITS // nbands
+        # (desplazamiento, máscara) de cada banda; la última se queda el resto
+        self._bands: List[Tuple[int, int]] = []
+        for i in range(nbands):
+            bits = width if i < nbands - 1 else HASH_BITS - width * (nbands - 1)
+            self._bands.append((width * i, (1 << bits) - 1))
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in self._bands]
+        self._order: Deque[int] = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def _keys(self, h: int) -> List[int]:
+        return [(h >> shift) & mask for shift, mask in self._bands]
+
+    def contains_near(self, h: int) -> bool:
+        with self._lock:
+            for table, key in zip(self._tables, self._keys(h)):
+                for other in table.get(key, ()):
+                    if hamming(h, other) <= self.max_distance:
+                        return True
+        return False
+
+    def add(self, h: int) -> None:
+        with self._lock:
+            for table, key in zip(self._tables, self._keys(h)):
+                table.setdefault(key, []).append(h)
+            self._order.append(h)
+            while len(self._order) > self.capacity:
+                self._evict_locked(self._order.popleft())
+
+    def _evict_locked(self, h: int) -> None:
+        for table, key in zip(self._tables, self._keys(h)):
+            bucket = table.get(key)
+            if not bucket:
+                continue
+            bucket.remove(h)
+            if not bucket:
+                del table[key]
+
+
+# Índices por proveedor, compartidos entre los vídeos de este proceso
+_provider_indexes: Dict[str, HashIndex] = {}
+_provider_lock = threading.Lock()
+
+
+def provider_index(provider: str, max_distance: int, capacity: int) -> HashIndex:
+    with _provider_lock:
+        index = _provider_indexes.get(provider)
+        if index is None or index.max_distance != max_distance:
+            index = HashIndex(max_distance, capacity)
+            _provider_indexes[provider] = index
+        return index
+
+
+class NearDuplicateGate:
+    """
+    Descarta frames casi idénticos (dHash del gris reducido) a alguno de
+    los últimos `window` guardados del vídeo o, con índice de proveedor, a
+    cualquier frame reciente de otros vídeos del mismo proveedor.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_distance: int,
+        window: int,
+        index: Optional[HashIndex] = None,
+    ) -> None:
+        self.max_distance = max(0, int(max_distance))
+        self.recent: Deque[int] = deque(maxlen=max(1, int(window)))
+        self.index = index
+        self.skipped_recent = 0
+        self.skipped_index = 0
+
+    @classmethod
+    def from_settings(
+        cls, settings: Settings, provider: Optional[str] = None
+    ) -> Optional["NearDuplicateGate"]:
+        """None si FRAME_PHASH_ENABLED está desactivado."""
+        if not settings.frame_phash_enabled:
+            return None
+        index = None
+        if provider and settings.frame_phash_provider_index:
+            index = provider_index(
+                provider,
+                settings.frame_phash_max_distance,
+                settings.frame_phash_index_capacity,
+            )
+        return cls(
+            max_distance=settings.frame_phash_max_distance,
+            window=settings.frame_phash_window,
+            index=index,
+        )
+
+    @property
+    def skipped(self) -> int:
+        return self.skipped_recent + self.skipped_index
+
+    def admit(self, gray_small) -> bool:
+        """True si el frame es nuevo (y lo registra); False si es casi
+        duplicado."""
+        h = dhash(gray_small)
+        if any(hamming(h, other) <= self.max_distance for other in self.recent):
+            self.skipped_recent += 1
+            return False
+        if self.index is not None and self.index.contains_near(h):
+            self.skipped_index += 1
+            return False
+        self.recent.append(h)
+        if self.index is not None:
+            self.index.add(h)
+        return True
+
+    def summary(self) -> str:
+        return (
+            f"{self.skipped} near-duplicate frames skipped "
+            f"({self.skipped_recent} within video, {self.skipped_index} by provider index)"
+        )
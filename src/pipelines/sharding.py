@@ -0,0 +1,466 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import datetime
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from google.api_core.exceptions import NotFound
+
+from src.config import Settings
+from src.gcp.bigquery_client import BigQueryClient
+from src.gcp.storage_client import GCSObject, StorageClient
+from src.pipelines.keyframes import (
+    SAMPLING_ADAPTIVE,
+    KeyframeIndex,
+    Segment,
+    keyframes_available,
+    plan_segments,
+    probe_keyframes,
+)
+from src.pipelines.video_ingest import (
+    JOB_TS_FMT,
+    VIDEO_EXTS,
+    FrameContext,
+    PipelineResult,
+    _encode_in_order,
+    _select_adaptive,
+    insert_video_row,
+    process_video_upload,
+    promote_video,
+    sha256_file,
+    upload_frames,
+)
+from src.pipelines.phash import NearDuplicateGate
+
+# (raw__images, frame__lineage, image__derivatives)
+ShardRows = Tuple[List[Dict], List[Dict], List[Dict]]
+
+MERGE_LOCK_NAME = "merge.lock"
+# Existe si ya se empezó un merge: el siguiente omite las filas ya insertadas
+MERGE_STARTED_NAME = "merge.started"
+# uids por consulta de existencia al reanudar un merge
+MERGE_EXISTS_CHUNK = 2000
+
+
+def cloud_run_task() -> Tuple[int, int]:
+    """(índice, número de tasks) de la ejecución actual de Cloud Run Jobs."""
+    index = int(os.environ.get("CLOUD_RUN_TASK_INDEX", "0") or 0)
+    count = int(os.environ.get("CLOUD_RUN_TASK_COUNT", "1") or 1)
+    return index, max(1, count)
+
+
+def cloud_run_task_attempt() -> int:
+    """Intento del task actual (0 = el primero; cada reintento suma uno)."""
+    return int(os.environ.get("CLOUD_RUN_TASK_ATTEMPT", "0") or 0)
+
+
+def cloud_run_execution() -> str:
+    """Nombre de la ejecución de Cloud Run Jobs (común a sus tasks) o ""."""
+    return os.environ.get("CLOUD_RUN_EXECUTION", "").strip()
+
+
+def shard_plan(
+    video_path: Path, settings: Settings, shards: int
+) -> Optional[Tuple[KeyframeIndex, List[Segment]]]:
+    """
+    Tramos alineados a keyframes, o None si no compensa / no se puede
+    (un solo tramo, vídeo corto, modo keyframes o sin ffprobe).
+    """
+    if shards <= 1 or settings.frame_sampling_mode != SAMPLING_ADAPTIVE:
+        return None
+    if not keyframes_available():
+        print("[WARN] Sharded extraction needs ffprobe/ffmpeg; running unsharded")
+        return None
+
+    index = probe_keyframes(video_path)
+    if index is None or not index.keyframe_ts:
+        return None
+    if index.frame_ts[-1] < settings.video_shard_min_duration_s * 1000.0:
+        return None
+
+    segments = plan_segments(
+        index, shards, warmup_ms=int(round(settings.video_shard_warmup_s * 1000.0))
+    )
+    if len(segments) < 2:
+        return None
+    return index, segments
+
+
+def extract_segment(
+    settings: Settings,
+    video_path: Path,
+    ctx: FrameContext,
+    segment: Segment,
+    index: KeyframeIndex,
+    storage: Optional[StorageClient] = None,
+) -> ShardRows:
+    """
+    Extrae y sube los frames de un tramo; devuelve sus filas sin insertar.
+    El filtro de casi-duplicados es por tramo (sin índice de proveedor: cada
+    tramo corre en su proceso).
+    """
+    storage = storage or StorageClient(project_id=settings.gcp_project)
+    gate = NearDuplicateGate.from_settings(settings)
+    frames = _encode_in_order(
+        _select_adaptive(video_path, settings, segment, index, gate),
+        ctx.video_uid,
+        settings,
+    )
+    pipeline = upload_frames(
+        frames, ctx=ctx, storage=storage, bq=None, settings=settings
+    )
+    images_rows, lineage_rows, derivative_rows = pipeline.rows()
+    print(
+        f"[INFO] Segment {segment.index} [{segment.start_ms}, {segment.end_ms}) ms: "
+        f"{len(lineage_rows)} frames"
+        + (f", {gate.summary()}" if gate is not None else "")
+    )
+    return images_rows, lineage_rows, derivative_rows
+
+
+def merge_shard_rows(
+    bq: BigQueryClient,
+    parts: Sequence[ShardRows],
+    resume_video_uid: Optional[str] = None,
+) -> int:
+    """Inserta las filas de todos los tramos, con lineage ordenado por
+    timestamp. Devuelve el número de frames. Con resume_video_uid (un merge
+    anterior falló a medias) omite las filas que ya están en BigQuery."""
+    images: Dict[str, Dict] = {}
+    lineage: Dict[str, Dict] = {}
+    derivatives: Dict[Tuple[str, str], Dict] = {}
+    for images_rows, lineage_rows, derivative_rows in parts:
+        images.update((r["image_uid"], r) for r in images_rows)
+        lineage.update((r["image_uid"], r) for r in lineage_rows)
+        derivatives.update(
+            ((r["image_uid"], r["derivative"]), r) for r in derivative_rows
+        )
+
+    lineage_rows = sorted(
+        lineage.values(), key=lambda r: (r["timestamp_ms"], r["frame_idx"])
+    )
+    images_rows = [images[r["image_uid"]] for r in lineage_rows]
+    nb_frames = len(lineage_rows)
+
+    if resume_video_uid is not None:
+        uids = [r["image_uid"] for r in lineage_rows]
+        done_images: set[str] = set()
+        done_derivatives: set[Tuple[str, str]] = set()
+        for i in range(0, len(uids), MERGE_EXISTS_CHUNK):
+            chunk = uids[i : i + MERGE_EXISTS_CHUNK]
+            done_images |= bq.images_exist(chunk)
+            done_derivatives |= bq.derivatives_exist(chunk)
+        done_lineage = bq.frame_lineage_uids(resume_video_uid)
+        images_rows = [r for r in images_rows if r["image_uid"] not in done_images]
+        lineage_rows = [r for r in lineage_rows if r["image_uid"] not in done_lineage]
+        for key in done_derivatives:
+            derivatives.pop(key, None)
+        print(
+            f"[INFO] Resuming merge: {len(done_images)} images, "
+            f"{len(done_lineage)} lineage rows already inserted"
+        )
+
+    # lineage después de images: nunca apunta a una imagen sin fila
+    if images_rows:
+        bq.insert_raw_images_chunked(images_rows)
+    if derivatives:
+        bq.insert_image_derivatives_chunked(list(derivatives.values()))
+    if lineage_rows:
+        bq.insert_frame_lineage_chunked(lineage_rows)
+    return nb_frames
+
+
+def extract_local_shards(
+    video_path: Path,
+    *,
+    ctx: FrameContext,
+    bq: BigQueryClient,
+    settings: Settings,
+) -> Optional[int]:
+    """
+    Extracción por tramos en un pool de procesos (VIDEO_SHARDS). Devuelve
+    el número de frames insertados, o None si no aplica.
+    """
+    plan = shard_plan(video_path, settings, settings.video_shards)
+    if plan is None:
+        return None
+    index, segments = plan
+
+    # Reparte las CPUs entre procesos para no sobresuscribir los encoders
+    shard_settings = replace(
+        settings,
+        frame_encode_workers=max(1, (os.cpu_count() or 1) // len(segments)),
+    )
+    print(f"[INFO] Extracting {len(segments)} segments in parallel processes")
+    with ProcessPoolExecutor(
+        max_workers=len(segments),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as ex:
+        parts = list(
+            ex.map(
+                extract_segment,
+                repeat(shard_settings),
+                repeat(video_path),
+                repeat(ctx),
+                segments,
+                repeat(index),
+            )
+        )
+    return merge_shard_rows(bq, parts)
+
+
+def take_merge_lock(
+    storage: StorageClient, lock: GCSObject, execution: str, task_index: int
+) -> bool:
+    """
+    Lock de merge: objeto creado solo si no existe, con el task que lo
+    tiene. Si ya existe y es de este mismo task y ejecución, el task murió
+    a mitad de merge (sin pasar por el except) y este es su reintento: lo
+    recupera.
+    """
+    holder = {"execution": execution, "task_index": task_index}
+    if storage.upload_bytes_if_absent(
+        lock.bucket,
+        lock.name,
+        json.dumps(holder).encode("utf-8"),
+        content_type="application/json",
+    ):
+        return True
+    if not execution:
+        return False
+    try:
+        current = json.loads(storage.download_bytes(lock))
+    except (NotFound, ValueError):
+        return False
+    if current != holder:
+        return False
+    print(f"[INFO] Task {task_index} taking back its merge lock")
+    return True
+
+
+@dataclass(frozen=True)
+class TaskShardResult:
+    result: PipelineResult
+    # True si este task ha cerrado el vídeo (merge, duplicado o sin tramos)
+    # y por tanto puede borrar el staging
+    finished: bool
+
+
+def process_video_task_shard(
+    *,
+    settings: Settings,
+    storage: StorageClient,
+    bq: BigQueryClient,
+    local_video_path: Path,
+    original_filename: str,
+    source_type: str,
+    provider: str,
+    started_at: datetime,
+    task_index: int,
+    task_count: int,
+    staging: Optional[GCSObject] = None,
+    video_uid: Optional[str] = None,
+    execution: str = "",
+) -> TaskShardResult:
+    """
+    Un task de una ejecución con CLOUD_RUN_TASK_COUNT > 1: procesa su tramo,
+    deja sus filas en un JSON parcial en GCS y, si es el último en terminar
+    (gana el lock de merge), inserta todo y escribe raw__videos una vez.
+
+    started_at (creación del objeto de staging) es común a todos los tasks y
+    fija job_ts / ingest_ts. Con staging, el vídeo se copia server-side
+    (rewrite) en vez de subir la copia local. video_uid evita volver a
+    leer el fichero si el hash ya se calculó al descargar.
+
+    Los parciales van bajo la ejecución (CLOUD_RUN_EXECUTION): una
+    ejecución relanzada sobre el mismo staging tiene el mismo job_ts y no
+    debe contar ni fusionar parciales (ni el lock) de la anterior. Los
+    reintentos de un task dentro de la ejecución sobrescriben su parcial.
+
+    Si el merge falla se suelta el lock, y si el task muere sin soltarlo su
+    reintento lo recupera (take_merge_lock). Un merge repetido no duplica
+    filas: omite las que ya están en BigQuery.
+    """
+    provider = (provider or "").strip() or "unknown"
+    ext = Path(original_filename).suffix.lower()
+    if ext not in VIDEO_EXTS:
+        raise ValueError(f"Extensión no soportada: {ext}")
+
+    video_uid = video_uid or sha256_file(local_video_path)
+    if bq.video_exists(video_uid):
+        return TaskShardResult(
+            PipelineResult(
+                status="duplicate",
+                message="Este vídeo ya estaba cargado. No se ha duplicado.",
+            ),
+            finished=task_index == 0,
+        )
+
+    plan = shard_plan(local_video_path, settings, task_count)
+    if plan is None or not settings.extract_frames:
+        # Sin tramos: el task 0 procesa el vídeo entero, el resto no hace nada
+        if task_index != 0:
+            return TaskShardResult(
+                PipelineResult(status="skipped", message="Vídeo sin tramos."),
+                finished=False,
+            )
+        res = process_video_upload(
+            settings=settings,
+            local_video_path=local_video_path,
+            original_filename=original_filename,
+            source_type=source_type,
+            provider=provider,
+            storage=storage,
+            bq=bq,
+            staging=staging,
+            video_uid=video_uid,
+        )
+        return TaskShardResult(res, finished=True)
+
+    index, segments = plan
+    ctx = FrameContext(
+        video_uid=video_uid,
+        source_type=source_type,
+        provider=provider,
+        source_name=Path(original_filename).stem,
+        job_ts=started_at.strftime(JOB_TS_FMT),
+        ingest_ts=started_at.isoformat(),
+        sampling_mode=SAMPLING_ADAPTIVE,
+    )
+
+    # 1) Tramo propio (puede haber más tasks que tramos)
+    rows: ShardRows = ([], [], [])
+    if task_index < len(segments):
+        rows = extract_segment(
+            settings, local_video_path, ctx, segments[task_index], index, storage
+        )
+
+    # 2) Parcial en GCS
+    bucket = settings.gcs_bucket
+    prefix = f"{settings.gcs_tmp_shards_prefix}/{video_uid}/{ctx.job_ts}"
+    if execution:
+        prefix = f"{prefix}/{execution}"
+    storage.upload_bytes(
+        bucket,
+        f"{prefix}/shard-{task_index:04d}.json",
+        json.dumps(
+            {
+                "images_rows": rows[0],
+                "lineage_rows": rows[1],
+                "derivative_rows": rows[2],
+            }
+        ).encode("utf-8"),
+        content_type="application/json",
+    )
+
+    # 3) Merge: solo cuando están todos los parciales y gana el lock
+    partials = storage.list_objects(bucket, f"{prefix}/shard-")
+    lock = GCSObject(bucket=bucket, name=f"{prefix}/{MERGE_LOCK_NAME}")
+    if len(partials) < task_count or not take_merge_lock(
+        storage, lock, execution, task_index
+    ):
+        return TaskShardResult(
+            PipelineResult(
+                status="ok",
+                message="Tramo procesado; el merge lo hará otro task.",
+                nb_frames=len(rows[1]),
+            ),
+            finished=False,
+        )
+
+    try:
+        nb_frames = _merge_partials(
+            storage,
+            bq,
+            partials,
+            ctx=ctx,
+            bucket=bucket,
+            prefix=prefix,
+            ext=ext,
+            local_video_path=local_video_path,
+            staging=staging,
+            task_index=task_index,
+        )
+    except Exception:
+        # Sin lock, el reintento de este task (u otro) vuelve a fusionar
+        storage.delete_object(lock)
+        raise
+
+    for obj in partials + [
+        GCSObject(bucket=bucket, name=f"{prefix}/{MERGE_STARTED_NAME}"),
+        lock,
+    ]:
+        storage.delete_object(obj)
+
+    return TaskShardResult(
+        PipelineResult(
+            status="ok",
+            message="Vídeo subido y procesado correctamente.",
+            nb_frames=nb_frames,
+        ),
+        finished=True,
+    )
+
+
+def _merge_partials(
+    storage: StorageClient,
+    bq: BigQueryClient,
+    partials: List[GCSObject],
+    *,
+    ctx: FrameContext,
+    bucket: str,
+    prefix: str,
+    ext: str,
+    local_video_path: Path,
+    staging: Optional[GCSObject],
+    task_index: int,
+) -> int:
+    """Inserta las filas de los parciales y raw__videos; devuelve los frames."""
+    # Si el marcador ya existe, un merge anterior falló a medias
+    resume = not storage.upload_bytes_if_absent(
+        bucket, f"{prefix}/{MERGE_STARTED_NAME}", b"", content_type="text/plain"
+    )
+    print(
+        f"[INFO] Task {task_index} merging {len(partials)} partials"
+        + (" (resuming)" if resume else "")
+    )
+    # La copia del vídeo corre en paralelo con el merge de filas
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="promote") as ex:
+        promotion = ex.submit(
+            promote_video,
+            storage,
+            ctx=ctx,
+            bucket=bucket,
+            ext=ext,
+            local_video_path=local_video_path,
+            staging=staging,
+        )
+        parts: List[ShardRows] = []
+        for obj in partials:
+            data = json.loads(storage.download_bytes(obj))
+            parts.append(
+                (
+                    data["images_rows"],
+                    data["lineage_rows"],
+                    data.get("derivative_rows", []),
+                )
+            )
+        nb_frames = merge_shard_rows(
+            bq, parts, resume_video_uid=ctx.video_uid if resume else None
+        )
+        gcs_video = promotion.result()
+
+    insert_video_row(
+        bq,
+        ctx=ctx,
+        gcs_video=gcs_video,
+        local_video_path=local_video_path,
+        nb_frames=nb_frames,
+    )
+    return nb_frames
@@ -2,26 +2,87 @@ from __future__ import annotations
 
 import hashlib
 import json
+import os
+import queue
 import subprocess
-from dataclasses import dataclass
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from src.config import Settings
-from src.gcp.storage_client import StorageClient
+from src.gcp.storage_client import BulkUploader, GCSObject, StorageClient
 from src.gcp.bigquery_client import BigQueryClient
+from src.pipelines.checkpoints import CheckpointStore, VideoCheckpoint
+from src.pipelines.decoders import downscale_gray, open_decoder
+from src.pipelines.derivatives import (
+    Derivative,
+    DerivativeSpec,
+    derivative_object_name,
+    derivative_row,
+    derivatives_from_bgr,
+    parse_derivative_specs,
+)
+from src.pipelines.keyframes import (
+    MATCH_TOLERANCE_MS,
+    SAMPLING_ADAPTIVE,
+    SAMPLING_KEYFRAMES,
+    KeyframeIndex,
+    Segment,
+    iter_keyframes,
+    keyframes_available,
+    probe_keyframes,
+    resume_segment,
+    thin_keyframes,
+)
+from src.pipelines.encoders import (
+    FORMAT_EXT,
+    FORMAT_JPEG,
+    FORMAT_MIME,
+    FrameEncoder,
+    encoder_from_settings,
+)
+from src.pipelines.phash import NearDuplicateGate
 
 VIDEO_EXTS = {".mp4", ".mov", ".mkv", ".avi", ".m4v", ".webm"}
 JOB_TS_FMT = "%Y%m%dT%H%M%SZ"
-FRAME_EXT = ".jpg"
+
+# Frames decodificados (resolución completa) esperando al scoring
+DECODE_QUEUE_SIZE = 8
+_DECODE_DONE = object()
+
+# (frame_idx, timestamp_ms, frame BGR a resolución completa)
+SelectedFrame = Tuple[int, int, Any]
+
+# (duration_ms, fps, codec)
+VideoMetadata = Tuple[int, float, str]
+
+# Ruta local o URL HTTP (objeto GCS leído por rangos)
+VideoSource = Union[Path, str]
 
 
 @dataclass(frozen=True)
 class PipelineResult:
-    status: str  # "ok" | "duplicate"
+    status: str  # "ok" | "duplicate" | "skipped"
     message: str
     nb_frames: int = 0
+    # Frames descartados por el filtro de casi-duplicados (FRAME_PHASH_*)
+    nb_near_duplicates: int = 0
 
 
 @dataclass(frozen=True)
@@ -29,11 +90,14 @@ class ExtractedFrame:
     image_uid: str
     timestamp_ms: int
     frame_idx: int
-    jpg_bytes: bytes
+    image_bytes: bytes
     width: int
     height: int
     sha256: str
     file_size_bytes: int
+    image_format: str = FORMAT_JPEG
+    # Versiones reducidas (IMAGE_DERIVATIVES) del mismo frame decodificado
+    derivatives: Tuple[Derivative, ...] = ()
 
 
 def utc_now() -> datetime:
@@ -63,7 +127,16 @@ def sha256_bytes(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
 
 
-def run_ffprobe(video_path: Path) -> Optional[Dict]:
+def run_ffprobe(
+    video_path: VideoSource, headers: Optional[Dict[str, str]] = None
+) -> Optional[Dict]:
+    # Para URLs: ffprobe solo lee las cabeceras del contenedor (Range)
+    header_args: List[str] = []
+    if headers:
+        header_args = [
+            "-headers",
+            "".join(f"{k}: {v}\r\n" for k, v in headers.items()),
+        ]
     cmd = [
         "ffprobe",
         "-v",
@@ -76,6 +149,7 @@ def run_ffprobe(video_path: Path) -> Optional[Dict]:
         "format=duration",
         "-of",
         "json",
+        *header_args,
         str(video_path),
     ]
     try:
@@ -97,8 +171,10 @@ def parse_fps(rate: str) -> float:
         return 0.0
 
 
-def get_video_metadata(video_path: Path) -> Tuple[int, float, str]:
-    data = run_ffprobe(video_path)
+def get_video_metadata(
+    video_path: VideoSource, headers: Optional[Dict[str, str]] = None
+) -> VideoMetadata:
+    data = run_ffprobe(video_path, headers)
     if data:
         duration_s = 0.0
         try:
@@ -116,6 +192,10 @@ def get_video_metadata(video_path: Path) -> Tuple[int, float, str]:
 
         return int(round(duration_s * 1000.0)), fps, codec
 
+    if headers:
+        # OpenCV no puede mandar cabeceras de autenticación
+        return 0, 0.0, "unknown"
+
     # Fallback OpenCV
     import cv2  # type: ignore
 
@@ -141,112 +221,725 @@ def gcs_image_object(
     return f"raw/images/{source_type}/{provider}/{job_ts}/{filename}"
 
 
-def extract_frames_adaptive(
-    video_path: Path, video_uid: str, settings: Settings
-) -> List[ExtractedFrame]:
+class AdaptiveSampler:
     """
-    Extrae frames adaptativos devolviendo bytes JPEG + dims.
+    Decide qué frames guardar a partir del timestamp y del frame reducido en
+    gris. Mantiene el estado (último guardado / último gris) entre llamadas.
     """
-    import cv2  # type: ignore
 
-    cap = cv2.VideoCapture(str(video_path))
-    if not cap.isOpened():
-        return []
+    def __init__(self, settings: Settings) -> None:
+        self.min_interval_ms = int(round(1000.0 / settings.max_fps))
+        self.desired_interval_ms = int(round(1000.0 / settings.min_fps))
+        self.max_interval_ms = int(round(settings.max_interval_s * 1000.0))
+        self.motion_threshold = settings.motion_threshold
 
-    min_interval_ms = int(round(1000.0 / settings.max_fps))
-    desired_interval_ms = int(round(1000.0 / settings.min_fps))
-    max_interval_ms = int(round(settings.max_interval_s * 1000.0))
+        self.last_saved_ts: Optional[int] = None
+        self.last_gray_small = None
 
-    frames: List[ExtractedFrame] = []
-    last_saved_ts: Optional[int] = None
-    last_gray_small = None
-    frame_idx = 0
-
-    while True:
-        ok, frame = cap.read()
-        if not ok or frame is None:
-            break
-
-        timestamp_ms = int(round(cap.get(cv2.CAP_PROP_POS_MSEC) or 0.0))
+    def offer(self, timestamp_ms: int, gray_small) -> bool:
+        import cv2  # type: ignore
 
         # motion score
-        h, w = frame.shape[:2]
-        if w > settings.downscale_width:
-            scale = settings.downscale_width / float(w)
-            new_w = settings.downscale_width
-            new_h = max(1, int(round(h * scale)))
-            frame_small = cv2.resize(
-                frame, (new_w, new_h), interpolation=cv2.INTER_AREA
-            )
-        else:
-            frame_small = frame
-
-        gray_small = cv2.cvtColor(frame_small, cv2.COLOR_BGR2GRAY)
-
         motion_score = 0.0
-        if last_gray_small is not None:
-            diff = cv2.absdiff(gray_small, last_gray_small)
+        if self.last_gray_small is not None:
+            diff = cv2.absdiff(gray_small, self.last_gray_small)
             motion_score = float(diff.mean())
 
         save = False
-        if last_saved_ts is None:
+        if self.last_saved_ts is None:
             save = True
         else:
-            since_last = timestamp_ms - last_saved_ts
-            if since_last < min_interval_ms:
+            since_last = timestamp_ms - self.last_saved_ts
+            if since_last < self.min_interval_ms:
                 save = False
             else:
-                if since_last >= max_interval_ms:
+                if since_last >= self.max_interval_ms:
                     save = True
-                elif motion_score >= settings.motion_threshold:
+                elif motion_score >= self.motion_threshold:
                     save = True
-                elif since_last >= desired_interval_ms:
+                elif since_last >= self.desired_interval_ms:
                     save = True
 
-        last_gray_small = gray_small
+        self.last_gray_small = gray_small
+        if save:
+            self.last_saved_ts = timestamp_ms
+        return save
 
-        if not save:
-            frame_idx += 1
-            continue
 
-        # encode jpeg
-        encode_params = [
-            int(cv2.IMWRITE_JPEG_QUALITY),
-            int(settings.frame_jpeg_quality),
-        ]
-        ok2, buf = cv2.imencode(".jpg", frame, encode_params)
-        if not ok2:
-            frame_idx += 1
+def encode_frame(
+    frame,
+    *,
+    video_uid: str,
+    timestamp_ms: int,
+    frame_idx: int,
+    encoder: FrameEncoder,
+    derivative_specs: Tuple[DerivativeSpec, ...] = (),
+) -> Optional[ExtractedFrame]:
+    """Imagen a resolución completa (FRAME_ENCODER / FRAME_IMAGE_FORMAT) y
+    sus derivados, sin volver a decodificar."""
+    image_bytes = encoder.encode(frame)
+    if not image_bytes:
+        return None
+
+    seed = (video_uid + ":" + str(timestamp_ms)).encode("utf-8") + b":" + image_bytes
+    image_uid = sha256_bytes(seed)
+
+    # width/height del frame original
+    height, width = frame.shape[:2]
+
+    return ExtractedFrame(
+        image_uid=image_uid,
+        timestamp_ms=timestamp_ms,
+        frame_idx=frame_idx,
+        image_bytes=image_bytes,
+        width=int(width),
+        height=int(height),
+        sha256=sha256_bytes(image_bytes),
+        file_size_bytes=len(image_bytes),
+        image_format=encoder.image_format,
+        derivatives=derivatives_from_bgr(frame, derivative_specs, encoder),
+    )
+
+
+def _decode_loop(decoder, out: "queue.Queue", stop: threading.Event) -> None:
+    """Hilo decodificador: DecodedFrame a la cola."""
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for decoded in decoder.frames():
+            if not _put(decoded):
+                return
+        _put(_DECODE_DONE)
+    except BaseException as e:
+        _put(e)
+
+
+def _encode_in_order(
+    selected: Iterator[SelectedFrame], video_uid: str, settings: Settings
+) -> Iterator[ExtractedFrame]:
+    """
+    Codifica (FRAME_ENCODER) en un pool de FRAME_ENCODE_WORKERS hilos y emite los
+    frames en el orden de entrada, con un número acotado en vuelo.
+    """
+    workers = max(1, settings.frame_encode_workers or (os.cpu_count() or 1))
+    max_in_flight = 2 * workers
+    derivative_specs = parse_derivative_specs(settings.image_derivatives)
+    encoder = encoder_from_settings(settings)
+
+    encoders = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode")
+    encoding: Deque[Future] = deque()
+    try:
+        for frame_idx, timestamp_ms, frame in selected:
+            encoding.append(
+                encoders.submit(
+                    encode_frame,
+                    frame,
+                    video_uid=video_uid,
+                    timestamp_ms=timestamp_ms,
+                    frame_idx=frame_idx,
+                    encoder=encoder,
+                    derivative_specs=derivative_specs,
+                )
+            )
+
+            # Emite en orden los ya codificados (o espera si hay demasiados)
+            while encoding and (encoding[0].done() or len(encoding) >= max_in_flight):
+                fr = encoding.popleft().result()
+                if fr is not None:
+                    yield fr
+
+        while encoding:
+            fr = encoding.popleft().result()
+            if fr is not None:
+                yield fr
+    finally:
+        selected.close()
+        encoders.shutdown(wait=True, cancel_futures=True)
+
+
+def _select_adaptive(
+    video_path: Path,
+    settings: Settings,
+    segment: Optional[Segment] = None,
+    index: Optional[KeyframeIndex] = None,
+    gate: Optional[NearDuplicateGate] = None,
+) -> Generator[SelectedFrame, None, None]:
+    """
+    Hilo decodificador (FRAME_DECODER) -> scoring de movimiento -> filtro
+    de casi-duplicados (gate, opcional).
+
+    Con segment se decodifica desde su keyframe de warm-up (para que el
+    estado del muestreo llegue al inicio del tramo como en una pasada
+    completa) y solo se emiten los frames del tramo; frame_idx sale del
+    índice de paquetes para que sea global.
+    """
+    start_ms = segment.decode_from_ms if segment is not None else 0
+    decoder = open_decoder(
+        settings.frame_decoder, video_path, settings.downscale_width, start_ms
+    )
+    if decoder is None:
+        return
+
+    decoded: "queue.Queue" = queue.Queue(maxsize=DECODE_QUEUE_SIZE)
+    stop = threading.Event()
+    decode_thread = threading.Thread(
+        target=_decode_loop, args=(decoder, decoded, stop), name="decode", daemon=True
+    )
+    sampler = AdaptiveSampler(settings)
+
+    decode_thread.start()
+    try:
+        while True:
+            item = decoded.get()
+            if item is _DECODE_DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            if segment is not None and segment.is_after(item.timestamp_ms):
+                break
+
+            if not sampler.offer(item.timestamp_ms, item.gray_small):
+                continue
+            if segment is not None and not segment.contains(item.timestamp_ms):
+                continue  # warm-up
+            if gate is not None and not gate.admit(item.gray_small):
+                continue
+
+            # Resolución completa solo para los frames seleccionados
+            frame = item.load_full()
+            if frame is None:
+                continue
+            frame_idx = (
+                index.frame_idx(item.timestamp_ms)
+                if index is not None
+                else item.frame_idx
+            )
+            yield frame_idx, item.timestamp_ms, frame
+    finally:
+        stop.set()
+        decode_thread.join()
+        decoder.close()
+
+
+def iter_frames_adaptive(
+    video_path: Path,
+    video_uid: str,
+    settings: Settings,
+    resume_after_ms: Optional[int] = None,
+    gate: Optional[NearDuplicateGate] = None,
+) -> Iterator[ExtractedFrame]:
+    """
+    Extrae frames adaptativos, emitiéndolos (bytes JPEG + dims) según se
+    decodifican, en orden de frame_idx.
+
+    Etapas: hilo decodificador (FRAME_DECODER) -> scoring de movimiento
+    (este hilo) -> pool de FRAME_ENCODE_WORKERS hilos que codifican JPEG. La
+    memoria queda acotada por la cola de decodificación y los encodes en
+    vuelo.
+
+    Con resume_after_ms solo se emiten frames posteriores; se hace seek al
+    keyframe de warm-up anterior si hay índice de keyframes (ffprobe).
+    """
+    segment: Optional[Segment] = None
+    index: Optional[KeyframeIndex] = None
+    if resume_after_ms is not None:
+        index = probe_keyframes(video_path) if keyframes_available() else None
+        segment = resume_segment(
+            index,
+            resume_after_ms,
+            warmup_ms=int(round(settings.video_shard_warmup_s * 1000.0)),
+        )
+    return _encode_in_order(
+        _select_adaptive(video_path, settings, segment, index, gate),
+        video_uid,
+        settings,
+    )
+
+
+def _select_keyframes(
+    video_path: Path,
+    index: KeyframeIndex,
+    settings: Settings,
+    resume_after_ms: Optional[int] = None,
+    gate: Optional[NearDuplicateGate] = None,
+) -> Generator[SelectedFrame, None, None]:
+    wanted = index.keyframe_ts
+    if settings.frame_keyframe_thinning:
+        wanted = thin_keyframes(
+            wanted,
+            min_interval_ms=int(round(1000.0 / settings.min_fps)),
+            max_interval_ms=int(round(settings.max_interval_s * 1000.0)),
+        )
+    print(
+        f"[INFO] Keyframe sampling: {len(index.keyframe_ts)} keyframes, "
+        f"{len(wanted)} selected of {len(index.frame_ts)} frames"
+    )
+    start_ms = 0
+    if resume_after_ms is not None:
+        wanted = [ts for ts in wanted if ts > resume_after_ms]
+        if not wanted:
+            return
+        start_ms = max(0, wanted[0] - MATCH_TOLERANCE_MS)
+    for timestamp_ms, frame in iter_keyframes(video_path, wanted, start_ms):
+        if gate is not None and not gate.admit(
+            downscale_gray(frame, settings.downscale_width)
+        ):
             continue
+        yield index.frame_idx(timestamp_ms), timestamp_ms, frame
+
+
+def iter_frames_keyframes(
+    video_path: Path,
+    video_uid: str,
+    settings: Settings,
+    resume_after_ms: Optional[int] = None,
+    gate: Optional[NearDuplicateGate] = None,
+) -> Optional[Iterator[ExtractedFrame]]:
+    """
+    Modo rápido: lista los keyframes con ffprobe (flags de paquete) y solo
+    decodifica esos (opcionalmente aclarados por MIN_FPS / MAX_INTERVAL_S).
+    None si ffprobe/ffmpeg no están disponibles o fallan.
+    """
+    if not keyframes_available():
+        return None
+    index = probe_keyframes(video_path)
+    if index is None or not index.keyframe_ts:
+        return None
+    return _encode_in_order(
+        _select_keyframes(video_path, index, settings, resume_after_ms, gate),
+        video_uid,
+        settings,
+    )
+
+
+def iter_frames(
+    video_path: Path,
+    video_uid: str,
+    settings: Settings,
+    resume_after_ms: Optional[int] = None,
+    gate: Optional[NearDuplicateGate] = None,
+) -> Tuple[str, Iterator[ExtractedFrame]]:
+    """Frames según FRAME_SAMPLING_MODE. Devuelve (modo usado, frames)."""
+    if settings.frame_sampling_mode == SAMPLING_KEYFRAMES:
+        frames = iter_frames_keyframes(
+            video_path, video_uid, settings, resume_after_ms, gate
+        )
+        if frames is not None:
+            return SAMPLING_KEYFRAMES, frames
+        print("[WARN] Keyframe sampling unavailable; falling back to adaptive")
+    return SAMPLING_ADAPTIVE, iter_frames_adaptive(
+        video_path, video_uid, settings, resume_after_ms, gate
+    )
+
+
+def extract_frames_adaptive(
+    video_path: Path, video_uid: str, settings: Settings
+) -> List[ExtractedFrame]:
+    """
+    Extrae frames adaptativos devolviendo bytes JPEG + dims.
+    """
+    return list(iter_frames_adaptive(video_path, video_uid, settings))
+
+
+FrameRows = Tuple[Dict, Dict]
+
+
+@dataclass(frozen=True)
+class FrameContext:
+    """Datos del vídeo necesarios para nombrar y describir sus frames."""
+
+    video_uid: str
+    source_type: str
+    provider: str
+    source_name: str
+    job_ts: str
+    ingest_ts: str
+    sampling_mode: str
+
+    def object_name(self, fr: ExtractedFrame) -> str:
+        img_filename = f"{fr.image_uid}{FORMAT_EXT[fr.image_format]}"
+        return gcs_image_object(
+            self.source_type, self.provider, self.job_ts, img_filename
+        )
+
+    def rows(self, fr: ExtractedFrame, gcs_img: GCSObject) -> FrameRows:
+        # raw__images row
+        image_row = {
+            "image_uid": fr.image_uid,
+            "source_type": self.source_type,
+            "source_name": self.source_name,  # mismo “origen humano” que el vídeo
+            "gcs_uri": gcs_img.uri,
+            "ingest_ts": self.ingest_ts,
+            "width": fr.width,
+            "height": fr.height,
+            "format": fr.image_format,
+            "sha256": fr.sha256,
+            "file_size_bytes": fr.file_size_bytes,
+        }
+
+        # frame__lineage row
+        lineage_row = {
+            "image_uid": fr.image_uid,
+            "video_uid": self.video_uid,
+            "frame_idx": fr.frame_idx,
+            "timestamp_ms": fr.timestamp_ms,
+            "extract_job_id": self.ingest_ts,  # simple y consistente
+            "sampling_mode": self.sampling_mode,
+        }
+        return image_row, lineage_row
+
+    def derivative_row(self, fr: ExtractedFrame, d: Derivative, gcs: GCSObject) -> Dict:
+        return derivative_row(fr.image_uid, d, gcs, self.ingest_ts)
+
+
+def _when_all(futs: List[Future], fn: Callable[[], None]) -> None:
+    """Llama a fn una vez, cuando todos los futures hayan terminado."""
+    remaining = [len(futs)]
+    lock = threading.Lock()
+
+    def _done(_: Future) -> None:
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            fn()
+
+    for f in futs:
+        f.add_done_callback(_done)
 
-        jpg_bytes = buf.tobytes()
-        seed = (video_uid + ":" + str(timestamp_ms)).encode("utf-8") + b":" + jpg_bytes
-        image_uid = sha256_bytes(seed)
-
-        file_sha = sha256_bytes(jpg_bytes)
-        file_size = len(jpg_bytes)
-
-        # width/height del frame original
-        height, width = frame.shape[:2]
-
-        frames.append(
-            ExtractedFrame(
-                image_uid=image_uid,
-                timestamp_ms=timestamp_ms,
-                frame_idx=frame_idx,
-                jpg_bytes=jpg_bytes,
-                width=int(width),
-                height=int(height),
-                sha256=file_sha,
-                file_size_bytes=int(file_size),
+
+def _completed(obj: GCSObject) -> Future:
+    fut: Future = Future()
+    fut.set_result(obj)
+    return fut
+
+
+class FrameUploadPipeline:
+    """
+    Sube frames con un BulkUploader mientras se siguen extrayendo.
+
+    submit() bloquea mientras el uploader tenga su ventana de subidas
+    llena, así que la memoria queda acotada. Las filas raw__images /
+    frame__lineage se insertan en BigQuery por lotes según se completan;
+    sin bq se acumulan (rows()) para insertarlas en un merge posterior.
+    Los derivados de cada frame se suben a derived/images/<nombre>/ y sus
+    filas (image__derivatives) van en el mismo lote.
+
+    Con checkpoints, tras cada lote se guarda el watermark: el mayor
+    timestamp hasta el que todos los frames enviados tienen sus filas
+    insertadas (las subidas terminan en desorden), más los frames
+    posteriores ya subidos o ya insertados, que al reanudar no se repiten.
+    """
+
+    def __init__(
+        self,
+        *,
+        bq: Optional[BigQueryClient],
+        uploader: BulkUploader,
+        bucket: str,
+        object_name_fn: Callable[[ExtractedFrame], str],
+        rows_fn: Callable[[ExtractedFrame, GCSObject], FrameRows],
+        flush_rows: int,
+        derivative_row_fn: Optional[
+            Callable[[ExtractedFrame, Derivative, GCSObject], Dict]
+        ] = None,
+        checkpoint: Optional[VideoCheckpoint] = None,
+        checkpoints: Optional[CheckpointStore] = None,
+    ) -> None:
+        self.bq = bq
+        self.uploader = uploader
+        self.bucket = bucket
+        self.object_name_fn = object_name_fn
+        self.rows_fn = rows_fn
+        self.derivative_row_fn = derivative_row_fn
+        self.flush_rows = max(1, int(flush_rows))
+        self.checkpoint = checkpoint
+        self.checkpoints = checkpoints if bq is not None else None
+        self.nb_frames = checkpoint.nb_frames if checkpoint else 0
+
+        self._lock = threading.Lock()
+        self._images_rows: List[Dict] = []
+        self._lineage_rows: List[Dict] = []
+        self._derivative_rows: List[Dict] = []
+        self._error: Optional[BaseException] = None
+
+        # Watermark: frames enviados en orden y su estado (uid -> uploaded /
+        # flushed) mientras no queden por debajo del watermark
+        self._checkpoint_lock = threading.Lock()
+        self._prev_uploaded = set(checkpoint.uploaded_uids if checkpoint else ())
+        self._prev_flushed = set(checkpoint.flushed_uids if checkpoint else ())
+        self._submitted: Deque[Tuple[int, str]] = deque()
+        self._state: Dict[str, str] = {}
+        self._watermark_ms = checkpoint.watermark_ms if checkpoint else -1
+        self._nb_below_watermark = self.nb_frames
+        self._flushed_batches = checkpoint.flushed_batches if checkpoint else 0
+
+    def submit(self, frame: ExtractedFrame) -> None:
+        self._raise_if_failed()
+        with self._lock:
+            self._submitted.append((frame.timestamp_ms, frame.image_uid))
+            if frame.image_uid in self._prev_flushed:
+                # Ya en GCS y BigQuery en un intento anterior
+                self._state[frame.image_uid] = "flushed"
+                self.nb_frames += 1
+                return
+
+        name = self.object_name_fn(frame)
+        derivative_names = [derivative_object_name(name, d) for d in frame.derivatives]
+
+        if frame.image_uid in self._prev_uploaded:
+            with self._lock:
+                self._prev_uploaded.discard(frame.image_uid)
+            self._on_uploaded(
+                frame,
+                _completed(GCSObject(bucket=self.bucket, name=name)),
+                [
+                    _completed(GCSObject(bucket=self.bucket, name=n))
+                    for n in derivative_names
+                ],
+            )
+            return
+
+        # Derivados primero: el frame cuenta como subido cuando está todo
+        derivative_futs = [
+            self.uploader.submit(
+                self.bucket, n, d.image_bytes, content_type=d.content_type
             )
+            for n, d in zip(derivative_names, frame.derivatives)
+        ]
+        fut = self.uploader.submit(
+            self.bucket,
+            name,
+            frame.image_bytes,
+            content_type=FORMAT_MIME[frame.image_format],
+        )
+        _when_all(
+            [fut] + derivative_futs,
+            lambda: self._on_uploaded(frame, fut, derivative_futs),
         )
 
-        last_saved_ts = timestamp_ms
-        frame_idx += 1
+    def _raise_if_failed(self) -> None:
+        with self._lock:
+            err = self._error
+        if err is not None:
+            raise err
+
+    def _on_uploaded(
+        self,
+        frame: ExtractedFrame,
+        fut: Future,
+        derivative_futs: Sequence[Future] = (),
+    ) -> None:
+        try:
+            if fut.cancelled() or any(f.cancelled() for f in derivative_futs):
+                return
+            image_row, lineage_row = self.rows_fn(frame, fut.result())
+            derivative_rows = (
+                [
+                    self.derivative_row_fn(frame, d, f.result())
+                    for d, f in zip(frame.derivatives, derivative_futs)
+                ]
+                if self.derivative_row_fn is not None
+                else []
+            )
+            with self._lock:
+                self._images_rows.append(image_row)
+                self._lineage_rows.append(lineage_row)
+                self._derivative_rows.extend(derivative_rows)
+                self._state[frame.image_uid] = "uploaded"
+                self.nb_frames += 1
+                ready = (
+                    self.bq is not None and len(self._images_rows) >= self.flush_rows
+                )
+            if ready:
+                self._flush()
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+
+    def _flush(self) -> None:
+        if self.bq is None:
+            return
+        with self._lock:
+            images_rows, self._images_rows = self._images_rows, []
+            lineage_rows, self._lineage_rows = self._lineage_rows, []
+            derivative_rows, self._derivative_rows = self._derivative_rows, []
+        # lineage después de images: nunca apunta a una imagen sin fila
+        if images_rows:
+            self.bq.insert_raw_images_chunked(images_rows)
+        if derivative_rows:
+            self.bq.insert_image_derivatives_chunked(derivative_rows)
+        if lineage_rows:
+            self.bq.insert_frame_lineage_chunked(lineage_rows)
+            self._advance_watermark(lineage_rows)
+
+    def _advance_watermark(self, lineage_rows: List[Dict]) -> None:
+        with self._lock:
+            for r in lineage_rows:
+                self._state[r["image_uid"]] = "flushed"
+            while self._submitted:
+                ts, uid = self._submitted[0]
+                if self._state.get(uid) != "flushed":
+                    break
+                self._submitted.popleft()
+                self._state.pop(uid, None)
+                self._watermark_ms = max(self._watermark_ms, ts)
+                self._nb_below_watermark += 1
+            self._flushed_batches += 1
+        self._save_checkpoint()
+
+    def _save_checkpoint(self) -> None:
+        if self.checkpoints is None or self.checkpoint is None:
+            return
+        # Serializado: cada guardado lleva el estado más reciente
+        with self._checkpoint_lock:
+            with self._lock:
+                uploaded = {u for u, st in self._state.items() if st == "uploaded"}
+                cp = replace(
+                    self.checkpoint,
+                    watermark_ms=self._watermark_ms,
+                    nb_frames=self._nb_below_watermark,
+                    flushed_batches=self._flushed_batches,
+                    # Lo subido en intentos anteriores sigue en GCS
+                    uploaded_uids=sorted(uploaded | self._prev_uploaded),
+                    flushed_uids=sorted(
+                        u for u, st in self._state.items() if st == "flushed"
+                    ),
+                )
+            self.checkpoints.save(cp)
+
+    def close(self) -> int:
+        """Espera a las subidas pendientes, inserta el resto de filas y
+        devuelve el número de frames subidos."""
+        stats = self.uploader.close()
+        print(f"[INFO] Frame upload: {stats.summary()}")
+        self._raise_if_failed()
+        self._flush()
+        return self.nb_frames
+
+    def abort(self) -> None:
+        self.uploader.close(cancel_pending=True)
+
+    def rows(self) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        """(raw__images, frame__lineage, image__derivatives) sin insertar."""
+        with self._lock:
+            return (
+                list(self._images_rows),
+                list(self._lineage_rows),
+                list(self._derivative_rows),
+            )
 
-    cap.release()
-    return frames
+
+def upload_frames(
+    frames: Iterator[ExtractedFrame],
+    *,
+    ctx: FrameContext,
+    storage: StorageClient,
+    bq: Optional[BigQueryClient],
+    settings: Settings,
+    checkpoint: Optional[VideoCheckpoint] = None,
+    checkpoints: Optional[CheckpointStore] = None,
+) -> FrameUploadPipeline:
+    """Consume frames subiéndolos en paralelo; devuelve el pipeline cerrado."""
+    pipeline = FrameUploadPipeline(
+        bq=bq,
+        uploader=storage.bulk_uploader(
+            concurrency=settings.frame_upload_workers,
+            max_pending=settings.frame_queue_size,
+            max_retries=settings.gcs_upload_max_retries,
+        ),
+        bucket=settings.gcs_bucket,
+        object_name_fn=ctx.object_name,
+        rows_fn=ctx.rows,
+        flush_rows=settings.images_chunk_size,
+        derivative_row_fn=ctx.derivative_row,
+        checkpoint=checkpoint,
+        checkpoints=checkpoints,
+    )
+    try:
+        for fr in frames:
+            pipeline.submit(fr)
+    except BaseException:
+        pipeline.abort()
+        raise
+    pipeline.close()
+    return pipeline
+
+
+def insert_video_row(
+    bq: BigQueryClient,
+    *,
+    ctx: FrameContext,
+    gcs_video: GCSObject,
+    local_video_path: Optional[Path],
+    nb_frames: int,
+    metadata: Optional[VideoMetadata] = None,
+) -> None:
+    """raw__videos (1 row), al final: marca el vídeo como completo."""
+    if metadata is None:
+        if local_video_path is None:
+            raise ValueError("Hace falta local_video_path o metadata")
+        metadata = get_video_metadata(local_video_path)
+    duration_ms, fps, codec = metadata
+    bq.insert_raw_videos(
+        [
+            {
+                "video_uid": ctx.video_uid,
+                "gcs_uri": gcs_video.uri,
+                "duration_ms": int(duration_ms),
+                "fps": float(fps),
+                "codec": str(codec),
+                "source_type": ctx.source_type,
+                "source_name": ctx.source_name,
+                "ingest_ts": ctx.ingest_ts,
+                "nb_frames": int(nb_frames),
+            }
+        ]
+    )
+
+
+def _validate_upload(source_type: str, original_filename: str) -> str:
+    """Valida source_type y la extensión; devuelve la extensión."""
+    if source_type not in {"public", "captured", "simulated"}:
+        raise ValueError("source_type inválido. Usa public/captured/simulated.")
+
+    ext = Path(original_filename).suffix.lower()
+    if ext not in VIDEO_EXTS:
+        raise ValueError(f"Extensión no soportada: {ext}")
+    return ext
+
+
+def promote_video(
+    storage: StorageClient,
+    *,
+    ctx: FrameContext,
+    bucket: str,
+    ext: str,
+    local_video_path: Optional[Path] = None,
+    staging: Optional[GCSObject] = None,
+) -> GCSObject:
+    """
+    Copia el vídeo a su ruta definitiva (renombrado por hash). Con staging
+    es un rewrite server-side (sin volver a subir los bytes); si no, sube
+    la copia local.
+    """
+    video_obj = gcs_video_object(
+        ctx.source_type, ctx.provider, ctx.job_ts, f"{ctx.video_uid}{ext}"
+    )
+    if staging is not None:
+        return storage.rewrite_object(staging, bucket, video_obj)
+    if local_video_path is None:
+        raise ValueError("Hace falta local_video_path o staging")
+    return storage.upload_file(bucket, video_obj, local_video_path)
 
 
 def process_video_upload(
@@ -256,33 +949,40 @@ def process_video_upload(
     original_filename: str,
     source_type: str,
     provider: str,
+    storage: Optional[StorageClient] = None,
+    bq: Optional[BigQueryClient] = None,
+    staging: Optional[GCSObject] = None,
+    video_uid: Optional[str] = None,
 ) -> PipelineResult:
     """
     Flujo final:
         - Dedupe en BigQuery (video_uid)
-        - Subir video a GCS
-        - Extraer frames adaptativos
-        - Subir frames a GCS
+        - Copiar video a su ruta en GCS (rewrite desde staging en paralelo
+          con la extracción, o subida de la copia local)
+        - Extraer frames adaptativos (generador; por tramos en paralelo si
+          VIDEO_SHARDS > 1)
+        - Subir frames a GCS en paralelo con la extracción
         - Insert:
-            raw__videos (1)
-            raw__images (N)
-            frame__lineage (N)
+            raw__images (N) + frame__lineage (N), por lotes
+            raw__videos (1), al terminar
+
+    Con VIDEO_CHECKPOINTS_ENABLED el progreso se guarda en GCS tras cada
+    lote y un reintento continúa desde el último watermark; raw__videos
+    solo se escribe al completar, así que un intento parcial no es visible.
+
+    storage / bq permiten reutilizar los clientes entre vídeos (manifests).
+    staging es el objeto de tmp/videos del que se descargó local_video_path;
+    video_uid, su SHA-256 si ya se calculó durante la descarga.
     """
     provider = (provider or "").strip() or "unknown"
     source_type = (source_type or "").strip()
-
-    if source_type not in {"public", "captured", "simulated"}:
-        raise ValueError("source_type inválido. Usa public/captured/simulated.")
-
-    ext = Path(original_filename).suffix.lower()
-    if ext not in VIDEO_EXTS:
-        raise ValueError(f"Extensión no soportada: {ext}")
+    ext = _validate_upload(source_type, original_filename)
 
     # Clients (ADC en local / SA en Cloud Run)
-    storage = StorageClient(project_id=settings.gcp_project)
-    bq = BigQueryClient(project_id=settings.gcp_project, settings=settings)
+    storage = storage or StorageClient(project_id=settings.gcp_project)
+    bq = bq or BigQueryClient(project_id=settings.gcp_project, settings=settings)
 
-    video_uid = sha256_file(local_video_path)
+    video_uid = video_uid or sha256_file(local_video_path)
 
     # Dedup
     if bq.video_exists(video_uid):
@@ -291,95 +991,179 @@ def process_video_upload(
             message="Este vídeo ya estaba cargado. No se ha duplicado.",
         )
 
-    ingest_ts = utc_now_iso()
-    job_ts = utc_now_job_ts()
-    source_name = Path(original_filename).stem  # humano
+    # Checkpoint de un intento anterior: se continúa la misma ejecución
+    checkpoints: Optional[CheckpointStore] = None
+    checkpoint: Optional[VideoCheckpoint] = None
+    if settings.video_checkpoints_enabled and settings.extract_frames:
+        checkpoints = CheckpointStore(
+            storage, settings.gcs_bucket, settings.gcs_tmp_checkpoints_prefix
+        )
+        checkpoint = checkpoints.load(video_uid)
+    if checkpoint is not None:
+        print(
+            f"[INFO] Resuming video {video_uid} after {checkpoint.watermark_ms} ms "
+            f"({checkpoint.nb_frames} frames, {checkpoint.flushed_batches} batches)"
+        )
+        settings = replace(settings, frame_sampling_mode=checkpoint.sampling_mode)
+
+    ctx = FrameContext(
+        video_uid=video_uid,
+        source_type=source_type,
+        provider=provider,
+        source_name=Path(original_filename).stem,  # humano
+        job_ts=checkpoint.job_ts if checkpoint else utc_now_job_ts(),
+        ingest_ts=checkpoint.ingest_ts if checkpoint else utc_now_iso(),
+        sampling_mode=settings.frame_sampling_mode,
+    )
 
-    # Upload video (renombrado por hash en destino)
-    video_filename = f"{video_uid}{ext}"
-    video_obj = gcs_video_object(source_type, provider, job_ts, video_filename)
-    gcs_video = storage.upload_file(settings.gcs_bucket, video_obj, local_video_path)
+    # La copia del vídeo corre en un hilo aparte mientras se extraen frames;
+    # al salir del with se espera a que termine (también si algo falla)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="promote") as ex:
+        promotion = ex.submit(
+            promote_video,
+            storage,
+            ctx=ctx,
+            bucket=settings.gcs_bucket,
+            ext=ext,
+            local_video_path=local_video_path,
+            staging=staging,
+        )
 
-    # Video metadata
-    duration_ms, fps, codec = get_video_metadata(local_video_path)
+        # Frames: extracción en streaming -> subida concurrente -> BQ por lotes
+        nb_frames = 0
+        gate = NearDuplicateGate.from_settings(settings, provider)
+        if settings.extract_frames:
+            from src.pipelines.sharding import extract_local_shards
+
+            # Los checkpoints solo cubren la extracción sin tramos
+            sharded = (
+                extract_local_shards(
+                    local_video_path, ctx=ctx, bq=bq, settings=settings
+                )
+                if checkpoint is None
+                else None
+            )
+            if sharded is not None:
+                nb_frames = sharded
+            else:
+                resume_after_ms = (
+                    checkpoint.watermark_ms
+                    if checkpoint is not None and checkpoint.watermark_ms >= 0
+                    else None
+                )
+                sampling_mode, frames = iter_frames(
+                    local_video_path, video_uid, settings, resume_after_ms, gate
+                )
+                ctx = replace(ctx, sampling_mode=sampling_mode)
+                if checkpoints is not None and checkpoint is None:
+                    checkpoint = VideoCheckpoint(
+                        video_uid=video_uid,
+                        job_ts=ctx.job_ts,
+                        ingest_ts=ctx.ingest_ts,
+                        sampling_mode=sampling_mode,
+                    )
+                    checkpoints.save(checkpoint)
+                pipeline = upload_frames(
+                    frames,
+                    ctx=ctx,
+                    storage=storage,
+                    bq=bq,
+                    settings=settings,
+                    checkpoint=checkpoint,
+                    checkpoints=checkpoints,
+                )
+                nb_frames = pipeline.nb_frames
+                if gate is not None:
+                    print(f"[INFO] Video {video_uid}: {gate.summary()}")
+
+        gcs_video = promotion.result()
+
+    insert_video_row(
+        bq,
+        ctx=ctx,
+        gcs_video=gcs_video,
+        local_video_path=local_video_path,
+        nb_frames=nb_frames,
+    )
+    if checkpoint is not None and checkpoints is not None:
+        checkpoints.delete(video_uid)
 
-    # Frames
-    frames: List[ExtractedFrame] = []
-    if settings.extract_frames:
-        frames = extract_frames_adaptive(local_video_path, video_uid, settings)
+    return PipelineResult(
+        status="ok",
+        message="Vídeo subido y procesado correctamente.",
+        nb_frames=nb_frames,
+        nb_near_duplicates=gate.skipped if gate is not None else 0,
+    )
 
-    nb_frames = len(frames)
 
-    # Upload frames + prepare BQ rows
-    extract_job_id = ingest_ts  # simple y consistente
+def process_staged_video_streaming(
+    *,
+    settings: Settings,
+    staging: GCSObject,
+    original_filename: str,
+    source_type: str,
+    provider: str,
+    storage: Optional[StorageClient] = None,
+    bq: Optional[BigQueryClient] = None,
+    video_uid: Optional[str] = None,
+) -> PipelineResult:
+    """
+    Variante sin frames (EXTRACT_FRAMES=false): nada se escribe en disco.
+        - SHA-256 leyendo el staging en streaming (salvo que venga video_uid)
+        - Dedupe en BigQuery
+        - Rewrite server-side a la ruta definitiva, con ffprobe leyendo
+          los metadatos por rangos HTTP en paralelo
+        - raw__videos (1)
+    """
+    provider = (provider or "").strip() or "unknown"
+    source_type = (source_type or "").strip()
+    ext = _validate_upload(source_type, original_filename)
 
-    images_rows: List[Dict] = []
-    lineage_rows: List[Dict] = []
+    storage = storage or StorageClient(project_id=settings.gcp_project)
+    bq = bq or BigQueryClient(project_id=settings.gcp_project, settings=settings)
 
-    for fr in frames:
-        img_filename = f"{fr.image_uid}{FRAME_EXT}"
-        img_obj = gcs_image_object(source_type, provider, job_ts, img_filename)
-        gcs_img = storage.upload_bytes(
-            settings.gcs_bucket,
-            img_obj,
-            fr.jpg_bytes,
-            content_type="image/jpeg",
+    if not video_uid:
+        video_uid, _ = storage.hash_object(staging)
+    if bq.video_exists(video_uid):
+        return PipelineResult(
+            status="duplicate",
+            message="Este vídeo ya estaba cargado. No se ha duplicado.",
         )
 
-        # raw__images row
-        images_rows.append(
-            {
-                "image_uid": fr.image_uid,
-                "source_type": source_type,
-                "source_name": source_name,  # mismo “origen humano” que el vídeo
-                "gcs_uri": gcs_img.uri,
-                "ingest_ts": ingest_ts,
-                "width": fr.width,
-                "height": fr.height,
-                "format": "jpg",
-                "sha256": fr.sha256,
-                "file_size_bytes": fr.file_size_bytes,
-            }
-        )
+    ctx = FrameContext(
+        video_uid=video_uid,
+        source_type=source_type,
+        provider=provider,
+        source_name=Path(original_filename).stem,
+        job_ts=utc_now_job_ts(),
+        ingest_ts=utc_now_iso(),
+        sampling_mode=settings.frame_sampling_mode,
+    )
 
-        # frame__lineage row
-        lineage_rows.append(
-            {
-                "image_uid": fr.image_uid,
-                "video_uid": video_uid,
-                "frame_idx": fr.frame_idx,
-                "timestamp_ms": fr.timestamp_ms,
-                "extract_job_id": extract_job_id,
-            }
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="promote") as ex:
+        promotion = ex.submit(
+            promote_video,
+            storage,
+            ctx=ctx,
+            bucket=settings.gcs_bucket,
+            ext=ext,
+            staging=staging,
         )
-
-    # Insert raw__videos (1 row)
-    bq.insert_raw_videos(
-        [
-            {
-                "video_uid": video_uid,
-                "gcs_uri": gcs_video.uri,
-                "duration_ms": int(duration_ms),
-                "fps": float(fps),
-                "codec": str(codec),
-                "source_type": source_type,
-                "source_name": source_name,
-                "ingest_ts": ingest_ts,
-                "nb_frames": int(nb_frames),
-            }
-        ]
+        url, headers = storage.media_read_target(staging)
+        metadata = get_video_metadata(url, headers)
+        gcs_video = promotion.result()
+
+    insert_video_row(
+        bq,
+        ctx=ctx,
+        gcs_video=gcs_video,
+        local_video_path=None,
+        nb_frames=0,
+        metadata=metadata,
     )
 
-    # Insert raw__images (chunked)
-    if images_rows:
-        bq.insert_raw_images_chunked(images_rows)
-
-    # Insert frame__lineage (chunked)
-    if lineage_rows:
-        bq.insert_frame_lineage_chunked(lineage_rows)
-
     return PipelineResult(
         status="ok",
         message="Vídeo subido y procesado correctamente.",
-        nb_frames=nb_frames,
+        nb_frames=0,
     )
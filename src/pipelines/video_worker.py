@@ -1,13 +1,34 @@
 from __future__ import annotations
 
+import json
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
-from google.cloud import storage
 from google.api_core.exceptions import NotFound
 
-from ..config import get_settings
-from ..pipelines.video_ingest import process_video_upload
+from ..config import Settings, get_settings
+from ..gcp.bigquery_client import BigQueryClient
+from ..gcp.storage_client import GCSObject, StorageClient
+from ..pipelines.encoders import check_encoder
+from ..pipelines.keyframes import SAMPLING_MODES
+from ..pipelines.sharding import (
+    cloud_run_execution,
+    cloud_run_task,
+    cloud_run_task_attempt,
+    process_video_task_shard,
+)
+from ..pipelines.video_ingest import (
+    PipelineResult,
+    process_staged_video_streaming,
+    process_video_upload,
+)
+
+SOURCE_TYPES = {"public", "captured", "simulated"}
 
 
 def parse_gcs_uri(gcs_uri: str) -> tuple[str, str]:
@@ -20,57 +41,344 @@ def parse_gcs_uri(gcs_uri: str) -> tuple[str, str]:
     return bucket, obj
 
 
-def main() -> None:
-    settings = get_settings()
+def _delete_blob(blob, gcs_uri: str, what: str) -> None:
+    try:
+        blob.delete()
+        print(f"[OK] Deleted {what}: {gcs_uri}")
+    except NotFound:
+        print(f"[INFO] {what.capitalize()} already deleted: {gcs_uri}")
+    except Exception as e:
+        print(f"[WARN] Could not delete {what}: {gcs_uri} -> {e}")
 
-    gcs_uri = os.environ.get("INPUT_GCS_URI", "").strip()
-    source_type = os.environ.get("INPUT_SOURCE_TYPE", "").strip()
-    provider = os.environ.get("INPUT_PROVIDER", "").strip() or "unknown"
-    original_filename = (
-        os.environ.get("INPUT_ORIGINAL_FILENAME", "").strip() or "uploaded_video.mp4"
+
+@lru_cache(maxsize=1)
+def _execution_id() -> str:
+    """Ejecución de Cloud Run Jobs (común a sus tasks) o un id por proceso."""
+    return os.environ.get("CLOUD_RUN_EXECUTION", "").strip() or uuid.uuid4().hex
+
+
+def _claim_video(
+    settings: Settings, storage: StorageClient, video_uid: str, owner: str, gcs_uri: str
+) -> Tuple[GCSObject, Optional[Dict[str, str]]]:
+    """
+    Claim tmp/claims/videos/<video_uid>.json. Devuelve (objeto del claim,
+    None si el vídeo es nuestro o el claim de quien ya lo está procesando).
+    """
+    claim = GCSObject(
+        bucket=settings.gcs_bucket,
+        name=f"{settings.gcs_tmp_claims_prefix}/videos/{video_uid}.json",
+    )
+    ok, holder = storage.claim_object(
+        claim.bucket,
+        claim.name,
+        {"owner": owner, "gcs_uri": gcs_uri},
+        ttl_s=settings.video_claim_ttl_s,
     )
+    if ok or holder.get("owner") == owner:
+        return claim, None
+    return claim, holder
 
-    if not gcs_uri:
-        raise RuntimeError("Falta INPUT_GCS_URI")
-    if source_type not in {"public", "captured", "simulated"}:
-        raise RuntimeError("INPUT_SOURCE_TYPE inválido")
 
-    ext = Path(original_filename).suffix.lower() or ".mp4"
-    local_video = (Path("/tmp") / "input_video").with_suffix(ext)
+def retry_pending(settings: Settings) -> bool:
+    """
+    True si Cloud Run reintentará este task en caso de fallo: quedan
+    intentos según VIDEO_JOB_MAX_RETRIES (el --max-retries del Job).
+    """
+    return cloud_run_task_attempt() < max(0, settings.video_job_max_retries)
+
+
+def _item_result(gcs_uri: str, res: PipelineResult) -> Dict[str, Any]:
+    return {
+        "gcs_uri": gcs_uri,
+        "status": res.status,
+        "message": res.message,
+        "nb_frames": res.nb_frames,
+        "nb_near_duplicates": res.nb_near_duplicates,
+    }
+
 
-    client = storage.Client(project=settings.gcp_project)
+def process_staged_video(
+    *,
+    settings: Settings,
+    storage: StorageClient,
+    bq: BigQueryClient,
+    gcs_uri: str,
+    source_type: str,
+    provider: str,
+    original_filename: str,
+    video_uid: str = "",
+    slot: str = "",
+    task_shards: bool = False,
+    resumable: bool = False,
+) -> Dict[str, Any]:
+    """
+    Procesa un vídeo de staging y borra el staging (siempre, salvo en
+    ejecuciones con varios tasks: solo el task que cierra el vídeo). El vídeo
+    se promociona con un rewrite server-side; solo se descarga a disco si
+    hay que extraer frames. Devuelve el resultado del item (para el resumen
+    del manifest).
+
+    video_uid es el SHA-256 que calculó el servicio (INPUT_VIDEO_UID): con
+    él los duplicados se descartan antes de descargar, y el hash calculado
+    durante la descarga debe coincidir. Un claim en GCS por video_uid evita
+    que dos subidas concurrentes del mismo fichero se procesen dos veces.
+
+    Con resumable, si algo falla se conservan staging y claim para que el
+    reintento del task continúe desde el checkpoint. Solo debe pedirse si
+    queda un reintento (retry_pending): si no, nadie los liberaría y una
+    nueva subida del mismo vídeo se descartaría como "en proceso".
+    """
+    provider = provider or "unknown"
+    original_filename = original_filename or "uploaded_video.mp4"
+    expected_uid = (video_uid or "").strip().lower()
+
+    if source_type not in SOURCE_TYPES:
+        raise ValueError("INPUT_SOURCE_TYPE inválido")
+
+    ext = Path(original_filename).suffix.lower() or ".mp4"
+    local_video = (Path("/tmp") / f"input_video{slot}").with_suffix(ext)
 
     bucket_name, object_name = parse_gcs_uri(gcs_uri)
-    blob = client.bucket(bucket_name).blob(object_name)
+    blob = storage.client.bucket(bucket_name).blob(object_name)
+    staging = GCSObject(bucket=bucket_name, name=object_name)
 
-    # Descarga staging
-    local_video.parent.mkdir(parents=True, exist_ok=True)
-    blob.download_to_filename(str(local_video))
+    task_index, task_count = cloud_run_task() if task_shards else (0, 1)
+    delete_staging = task_count == 1
+    # Los tasks de una misma ejecución comparten el claim del vídeo
+    owner = f"{_execution_id()}:{gcs_uri}{slot}"
+    claim: Optional[GCSObject] = None
+    release_claim = task_count == 1
 
-    try:
-        process_video_upload(
-            settings=settings,
-            local_video_path=local_video,
-            original_filename=original_filename,
-            source_type=source_type,
-            provider=provider,
+    def _claimed_elsewhere(uid: str) -> Optional[Dict[str, Any]]:
+        nonlocal claim, delete_staging
+        claim, holder = _claim_video(settings, storage, uid, owner, gcs_uri)
+        if holder is None:
+            return None
+        claim = None
+        # El staging puede ser el mismo objeto (mismo hash): solo se borra
+        # si es otro
+        delete_staging = task_index == 0 and holder.get("gcs_uri") != gcs_uri
+        print(f"[INFO] Video {uid} already being processed by {holder.get('owner')}")
+        return _item_result(
+            gcs_uri,
+            PipelineResult(
+                status="duplicate",
+                message="Otra ejecución está procesando este vídeo.",
+            ),
         )
-    finally:
-        # 1) Borra staging tmp/videos (si existe)
+
+    try:
+        if expected_uid:
+            # Dedup antes de descargar
+            if bq.video_exists(expected_uid):
+                delete_staging = task_index == 0
+                return _item_result(
+                    gcs_uri,
+                    PipelineResult(
+                        status="duplicate",
+                        message="Este vídeo ya estaba cargado. No se ha duplicado.",
+                    ),
+                )
+            busy = _claimed_elsewhere(expected_uid)
+            if busy:
+                return busy
+
+        streaming = not settings.extract_frames and task_count == 1
         try:
-            blob.delete()
-            print(f"[OK] Deleted staging object: {gcs_uri}")
+            if streaming:
+                # Solo hash + metadatos: se leen en streaming, sin copia local
+                actual_uid, _ = storage.hash_object(staging)
+            else:
+                local_video.parent.mkdir(parents=True, exist_ok=True)
+                actual_uid, _ = storage.download_file_hashed(staging, local_video)
         except NotFound:
-            print(f"[INFO] Staging object already deleted: {gcs_uri}")
-        except Exception as e:
-            print(f"[WARN] Could not delete staging object: {gcs_uri} -> {e}")
+            if task_count == 1:
+                raise
+            # Otro task ya cerró el vídeo (duplicado) y borró el staging
+            return {"gcs_uri": gcs_uri, "status": "skipped", "message": "Sin staging"}
+
+        if expected_uid and actual_uid != expected_uid:
+            raise ValueError(
+                f"SHA-256 del staging ({actual_uid}) distinto de INPUT_VIDEO_UID"
+            )
+        if claim is None:
+            busy = _claimed_elsewhere(actual_uid)
+            if busy:
+                return busy
+
+        if streaming:
+            res = process_staged_video_streaming(
+                settings=settings,
+                staging=staging,
+                original_filename=original_filename,
+                source_type=source_type,
+                provider=provider,
+                storage=storage,
+                bq=bq,
+                video_uid=actual_uid,
+            )
+        elif task_count > 1:
+            blob.reload()
+            shard = process_video_task_shard(
+                settings=settings,
+                storage=storage,
+                bq=bq,
+                local_video_path=local_video,
+                original_filename=original_filename,
+                source_type=source_type,
+                provider=provider,
+                started_at=blob.time_created,
+                task_index=task_index,
+                task_count=task_count,
+                staging=staging,
+                video_uid=actual_uid,
+                execution=cloud_run_execution(),
+            )
+            delete_staging = release_claim = shard.finished
+            res = shard.result
+        else:
+            res = process_video_upload(
+                settings=settings,
+                local_video_path=local_video,
+                original_filename=original_filename,
+                source_type=source_type,
+                provider=provider,
+                storage=storage,
+                bq=bq,
+                staging=staging,
+                video_uid=actual_uid,
+            )
+        return _item_result(gcs_uri, res)
+    except BaseException:
+        if resumable:
+            delete_staging = release_claim = False
+        raise
+    finally:
+        # 1) Borra staging tmp/videos (si existe)
+        if delete_staging:
+            _delete_blob(blob, gcs_uri, "staging object")
 
-        # 2) Limpia disco
+        # 2) Libera el claim (en varios tasks, solo el que cierra el vídeo)
+        if claim is not None and release_claim:
+            storage.delete_object(claim)
+
+        # 3) Limpia disco
         try:
             local_video.unlink(missing_ok=True)
         except Exception:
             pass
 
 
+def run_manifest(
+    *,
+    settings: Settings,
+    storage: StorageClient,
+    bq: BigQueryClient,
+    manifest_uri: str,
+    concurrency: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Procesa todos los vídeos de un manifest con concurrencia limitada. Un
+    fallo en un item no afecta al resto. Escribe el resumen por item en
+    <manifest>.result.json y borra el manifest.
+    """
+    bucket_name, object_name = parse_gcs_uri(manifest_uri)
+    bucket = storage.client.bucket(bucket_name)
+    manifest_blob = bucket.blob(object_name)
+
+    manifest = json.loads(manifest_blob.download_as_bytes())
+    items: List[Dict[str, Any]] = manifest.get("items", [])
+    workers = max(1, int(concurrency or settings.video_worker_concurrency))
+    print(f"[INFO] Manifest {manifest_uri}: {len(items)} videos, {workers} workers")
+
+    def _one(i: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        gcs_uri = str(item.get("gcs_uri", ""))
+        try:
+            return process_staged_video(
+                settings=settings,
+                storage=storage,
+                bq=bq,
+                gcs_uri=gcs_uri,
+                source_type=str(item.get("source_type", "")),
+                provider=str(item.get("provider", "")),
+                original_filename=str(item.get("original_filename", "")),
+                video_uid=str(item.get("video_uid", "")),
+                slot=f"_{i}",
+            )
+        except Exception as e:
+            print(f"[ERROR] Manifest item failed: {gcs_uri} -> {e!r}")
+            return {"gcs_uri": gcs_uri, "status": "failed", "message": str(e)}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="video") as ex:
+        results = list(ex.map(_one, range(len(items)), items))
+
+    summary = {
+        "manifest_uri": manifest_uri,
+        "ok": sum(1 for r in results if r["status"] == "ok"),
+        "duplicate": sum(1 for r in results if r["status"] == "duplicate"),
+        "failed": sum(1 for r in results if r["status"] == "failed"),
+        "items": results,
+    }
+    result_obj = storage.upload_bytes(
+        bucket_name,
+        f"{object_name}.result.json",
+        json.dumps(summary).encode("utf-8"),
+        content_type="application/json",
+    )
+    print(
+        f"[INFO] Manifest done: ok={summary['ok']} duplicate={summary['duplicate']} "
+        f"failed={summary['failed']} -> {result_obj.uri}"
+    )
+
+    _delete_blob(manifest_blob, manifest_uri, "manifest")
+    return results
+
+
+def main() -> None:
+    settings = get_settings()
+
+    # Modo de muestreo por ejecución (p.ej. "keyframes" para datasets masivos)
+    sampling_mode = os.environ.get("INPUT_SAMPLING_MODE", "").strip().lower()
+    if sampling_mode:
+        if sampling_mode not in SAMPLING_MODES:
+            raise RuntimeError("INPUT_SAMPLING_MODE inválido")
+        settings = replace(settings, frame_sampling_mode=sampling_mode)
+
+    # Backend de encode no disponible: se avisa antes de empezar
+    if settings.extract_frames:
+        check_encoder(settings)
+
+    # Clients (ADC en local / SA en Cloud Run), compartidos entre vídeos
+    storage = StorageClient(project_id=settings.gcp_project)
+    bq = BigQueryClient(project_id=settings.gcp_project, settings=settings)
+
+    manifest_uri = os.environ.get("INPUT_MANIFEST_URI", "").strip()
+    if manifest_uri:
+        results = run_manifest(
+            settings=settings, storage=storage, bq=bq, manifest_uri=manifest_uri
+        )
+        failed = [r for r in results if r["status"] == "failed"]
+        if failed:
+            raise RuntimeError(f"{len(failed)}/{len(results)} vídeos fallidos")
+        return
+
+    gcs_uri = os.environ.get("INPUT_GCS_URI", "").strip()
+    if not gcs_uri:
+        raise RuntimeError("Falta INPUT_GCS_URI o INPUT_MANIFEST_URI")
+
+    process_staged_video(
+        settings=settings,
+        storage=storage,
+        bq=bq,
+        gcs_uri=gcs_uri,
+        source_type=os.environ.get("INPUT_SOURCE_TYPE", "").strip(),
+        provider=os.environ.get("INPUT_PROVIDER", "").strip(),
+        original_filename=os.environ.get("INPUT_ORIGINAL_FILENAME", "").strip(),
+        video_uid=os.environ.get("INPUT_VIDEO_UID", "").strip(),
+        task_shards=True,
+        resumable=settings.video_checkpoints_enabled and retry_pending(settings),
+    )
+
+
 if __name__ == "__main__":
     main()
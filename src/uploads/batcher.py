@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.gcp.run_jobs import RunJobResult
+
+ManifestItem = Dict[str, Any]
+FlushFn = Callable[[List[ManifestItem]], RunJobResult]
+
+
+class VideoJobBatcher:
+    """
+    Agrupa subidas pendientes en un manifest y lanza una única ejecución del
+    Job por lote. Un lote se cierra al llegar a max_items o al pasar window_s
+    desde su primer elemento. submit() devuelve un Future con el resultado
+    del lanzamiento del lote.
+    """
+
+    def __init__(self, window_s: float, max_items: int, flush_fn: FlushFn) -> None:
+        self.window_s = max(0.0, float(window_s))
+        self.max_items = max(1, int(max_items))
+        self.flush_fn = flush_fn
+
+        self._pending: List[Tuple[ManifestItem, Future]] = []
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: ManifestItem) -> Future:
+        fut: Future = Future()
+        with self._lock:
+            self._pending.append((item, fut))
+            if len(self._pending) >= self.max_items:
+                batch = self._take_locked()
+            else:
+                batch = []
+                if self._timer is None:
+                    self._timer = threading.Timer(self.window_s, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+        if batch:
+            self._flush_batch(batch)
+        return fut
+
+    def _take_locked(self) -> List[Tuple[ManifestItem, Future]]:
+        batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def flush(self) -> None:
+        with self._lock:
+            batch = self._take_locked()
+        if batch:
+            self._flush_batch(batch)
+
+    def _flush_batch(self, batch: List[Tuple[ManifestItem, Future]]) -> None:
+        try:
+            result = self.flush_fn([item for item, _ in batch])
+        except Exception as e:
+            print(f"[ERROR] Video batch flush failed ({len(batch)} items): {e!r}")
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        for _, fut in batch:
+            fut.set_result(result)
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+
+class UploadSessionError(ValueError):
+    pass
+
+
+@dataclass
+class ChunkedUploadSession:
+    """
+    Sesión de subida por chunks. Los chunks pueden llegar desordenados (el
+    cliente sube en paralelo) y se escriben en su offset del fichero spool;
+    el SHA-256 avanza sobre el prefijo contiguo recibido, así que al llegar
+    el último chunk el hash ya está calculado.
+    """
+
+    upload_id: str
+    kind: str  # "video" | "images_zip"
+    filename: str
+    total_size: int
+    chunk_size: int
+    fields: Dict[str, str]
+    spool_path: Path
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    received: Set[int] = field(default_factory=set)
+    hashed_chunks: int = 0
+    _hasher: "hashlib._Hash" = field(default_factory=hashlib.sha256, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def total_chunks(self) -> int:
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    @property
+    def complete(self) -> bool:
+        return self.hashed_chunks >= self.total_chunks
+
+    @property
+    def hashed_offset(self) -> int:
+        return min(self.total_size, self.hashed_chunks * self.chunk_size)
+
+    def chunk_length(self, index: int) -> int:
+        if index < 0 or index >= self.total_chunks:
+            raise UploadSessionError(f"Chunk fuera de rango: {index}")
+        start = index * self.chunk_size
+        return min(self.chunk_size, self.total_size - start)
+
+    def write_chunk(self, index: int, data: bytes) -> None:
+        expected = self.chunk_length(index)
+        if len(data) != expected:
+            raise UploadSessionError(
+                f"Tamaño de chunk inválido ({len(data)} != {expected})."
+            )
+
+        with self._lock:
+            if index in self.received:
+                # Reintento de un chunk ya confirmado: idempotente
+                return
+
+        # pwrite permite escrituras concurrentes en offsets distintos
+        fd = os.open(self.spool_path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, index * self.chunk_size)
+        finally:
+            os.close(fd)
+
+        with self._lock:
+            self.received.add(index)
+            self.updated_at = time.time()
+            self._advance_hash(index, data)
+
+    def _advance_hash(self, just_written: int, data: bytes) -> None:
+        # Solo se hashea el prefijo contiguo; los chunks adelantados se leen
+        # del spool cuando el hueco se rellena.
+        if self.hashed_chunks not in self.received:
+            return
+        with self.spool_path.open("rb") as f:
+            while self.hashed_chunks in self.received:
+                idx = self.hashed_chunks
+                if idx == just_written:
+                    self._hasher.update(data)
+                else:
+                    f.seek(idx * self.chunk_size)
+                    self._hasher.update(f.read(self.chunk_length(idx)))
+                self.hashed_chunks += 1
+
+    def digest(self) -> str:
+        with self._lock:
+            if not self.complete:
+                raise UploadSessionError("La subida no está completa.")
+            return self._hasher.hexdigest()
+
+    def missing_chunks(self) -> List[int]:
+        with self._lock:
+            return [i for i in range(self.total_chunks) if i not in self.received]
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "upload_id": self.upload_id,
+                "kind": self.kind,
+                "filename": self.filename,
+                "total_size": self.total_size,
+                "chunk_size": self.chunk_size,
+                "total_chunks": self.total_chunks,
+                "received": sorted(self.received),
+                "hashed_offset": self.hashed_offset,
+                "complete": self.complete,
+            }
+
+
+class UploadSessionStore:
+    """
+    Registro en memoria de sesiones de subida. El estado SHA-256 vive en el
+    proceso, así que con varias instancias hace falta afinidad de sesión;
+    si la instancia se pierde el cliente reinicia la subida. max_size y
+    max_sessions (0 = sin tope) acotan lo que se puede reservar en el spool.
+    """
+
+    def __init__(
+        self,
+        spool_dir: str,
+        chunk_size: int,
+        ttl_s: float,
+        max_size: int = 0,
+        max_sessions: int = 0,
+    ) -> None:
+        self.spool_dir = Path(spool_dir)
+        self.chunk_size = int(chunk_size)
+        self.ttl_s = float(ttl_s)
+        self.max_size = int(max_size)
+        self.max_sessions = int(max_sessions)
+        self._sessions: Dict[str, ChunkedUploadSession] = {}
+        self._lock = threading.Lock()
+
+    def create(
+        self, *, kind: str, filename: str, total_size: int, fields: Dict[str, str]
+    ) -> ChunkedUploadSession:
+        if total_size <= 0:
+            raise UploadSessionError("Tamaño de archivo inválido.")
+        if self.max_size and total_size > self.max_size:
+            raise UploadSessionError(
+                f"Archivo demasiado grande (máximo {self.max_size} bytes)."
+            )
+
+        self.purge_expired()
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+
+        upload_id = uuid.uuid4().hex
+        spool_path = self.spool_dir / f"{upload_id}.part"
+        session = ChunkedUploadSession(
+            upload_id=upload_id,
+            kind=kind,
+            filename=filename,
+            total_size=int(total_size),
+            chunk_size=self.chunk_size,
+            fields=dict(fields),
+            spool_path=spool_path,
+        )
+        # Se reserva el hueco antes de crear el spool
+        with self._lock:
+            if self.max_sessions and len(self._sessions) >= self.max_sessions:
+                raise UploadSessionError(
+                    "Demasiadas subidas en curso. Inténtalo más tarde."
+                )
+            self._sessions[upload_id] = session
+
+        try:
+            with spool_path.open("wb") as f:
+                f.truncate(total_size)
+        except Exception:
+            self.discard(upload_id)
+            raise
+        return session
+
+    def get(self, upload_id: str) -> Optional[ChunkedUploadSession]:
+        with self._lock:
+            return self._sessions.get(upload_id)
+
+    def take(self, upload_id: str) -> Optional[ChunkedUploadSession]:
+        """Saca la sesión del registro sin borrar su spool."""
+        with self._lock:
+            return self._sessions.pop(upload_id, None)
+
+    def discard(self, upload_id: str) -> None:
+        session = self.take(upload_id)
+        if session is not None:
+            session.spool_path.unlink(missing_ok=True)
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [
+                sid
+                for sid, s in self._sessions.items()
+                if now - s.updated_at > self.ttl_s
+            ]
+        for sid in expired:
+            self.discard(sid)
+        return len(expired)
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Etapas intermedias que reporta el trabajo en segundo plano
+STAGE_QUEUED = "queued"
+STAGE_CHECKING = "checking"
+STAGE_UPLOADING = "uploading"
+STAGE_DISPATCHING = "dispatching"
+
+# Etapas finales
+STAGE_DISPATCHED = "dispatched"
+STAGE_DUPLICATE = "duplicate"
+STAGE_FAILED = "failed"
+
+FINAL_STAGES = {STAGE_DISPATCHED, STAGE_DUPLICATE, STAGE_FAILED}
+
+StageCallback = Callable[[str], None]
+IngestWork = Callable[[StageCallback], Tuple[Dict[str, Any], int]]
+
+
+@dataclass
+class IngestTicket:
+    ticket_id: str
+    kind: str
+    stage: str = STAGE_QUEUED
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    result: Dict[str, Any] = field(default_factory=dict)
+    http_status: Optional[int] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ticket": self.ticket_id,
+            "kind": self.kind,
+            "stage": self.stage,
+            "done": self.stage in FINAL_STAGES,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "http_status": self.http_status,
+            **self.result,
+        }
+
+
+class IngestTicketRegistry:
+    """
+    Ejecuta el staging + lanzamiento del Job en un pool acotado y guarda el
+    progreso por ticket (en memoria, por instancia). Si el pool está lleno
+    submit() devuelve None y el llamante procesa de forma síncrona.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, ttl_s: float) -> None:
+        self.ttl_s = float(ttl_s)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, int(max_workers)), thread_name_prefix="ingest"
+        )
+        self._slots = threading.BoundedSemaphore(max(1, int(max_pending)))
+        self._tickets: Dict[str, IngestTicket] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, work: IngestWork) -> Optional[IngestTicket]:
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        self.purge_expired()
+        ticket = IngestTicket(ticket_id=uuid.uuid4().hex, kind=kind)
+        with self._lock:
+            self._tickets[ticket.ticket_id] = ticket
+
+        try:
+            self._executor.submit(self._run, ticket, work)
+        except Exception:
+            self._slots.release()
+            raise
+        return ticket
+
+    def _set_stage(self, ticket: IngestTicket, stage: str) -> None:
+        with self._lock:
+            ticket.stage = stage
+            ticket.updated_at = time.time()
+
+    def _run(self, ticket: IngestTicket, work: IngestWork) -> None:
+        try:
+            body, status = work(lambda stage: self._set_stage(ticket, stage))
+        except Exception as e:
+            print(f"[ERROR] ingest ticket {ticket.ticket_id} failed: {e!r}")
+            body, status = {
+                "ok": False,
+                "message": "Ha ocurrido un error durante el proceso.",
+            }, 500
+        finally:
+            self._slots.release()
+
+        if status < 400:
+            final = STAGE_DISPATCHED
+        elif body.get("duplicate"):
+            final = STAGE_DUPLICATE
+        else:
+            final = STAGE_FAILED
+
+        with self._lock:
+            ticket.result = dict(body)
+            ticket.http_status = status
+        self._set_stage(ticket, final)
+
+    def get(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            ticket = self._tickets.get(ticket_id)
+            return ticket.to_dict() if ticket is not None else None
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [
+                tid
+                for tid, t in self._tickets.items()
+                if t.stage in FINAL_STAGES and now - t.updated_at > self.ttl_s
+            ]
+            for tid in expired:
+                del self._tickets[tid]
+        return len(expired)
@@ -1,3 +1,8 @@
+// El worker de hash vive junto a este script
+const SHA256_WORKER_URL = new URL("sha256_worker.js", document.currentScript.src).href;
+// Archivos de imágenes admitidos (los tar se ingieren en streaming)
+const ARCHIVE_SUFFIXES = [".zip", ".tar", ".tar.gz", ".tgz", ".tar.zst", ".tar.zstd", ".tzst"];
+
 function setNotice(level, title, body) {
   const notice = document.getElementById("notice");
   const nt = document.getElementById("noticeTitle");
@@ -40,6 +45,322 @@ function activateTab(which) {
   notice.style.display = "none";
 }
 
+// Subida por chunks reanudable (init / PUT chunk / finalize)
+const CHUNK_PARALLELISM = 4;
+const CHUNK_MAX_RETRIES = 5;
+
+function sleep(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+function uploadResumeKey(kind, file) {
+  return `hud-upload:${kind}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function fetchJson(url, options) {
+  const res = await fetch(url, options);
+  const data = await res.json().catch(() => ({}));
+  return { res, data };
+}
+
+async function initOrResumeUpload(kind, file, fields) {
+  const key = uploadResumeKey(kind, file);
+  const previousId = localStorage.getItem(key);
+
+  if (previousId) {
+    const { res, data } = await fetchJson(`/api/uploads/${previousId}`);
+    if (res.ok && data.ok) {
+      return data;
+    }
+    localStorage.removeItem(key);
+  }
+
+  const { res, data } = await fetchJson("/api/uploads", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      kind,
+      filename: file.name,
+      size: file.size,
+      content_type: file.type || "",
+      ...fields,
+    }),
+  });
+
+  if (!res.ok || !data.ok) {
+    throw new Error(data?.message || "No se pudo iniciar la subida.");
+  }
+  localStorage.setItem(key, data.upload_id);
+  return data;
+}
+
+async function putChunk(uploadId, index, blob) {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const res = await fetch(`/api/uploads/${uploadId}/chunks/${index}`, {
+        method: "PUT",
+        headers: { "Content-Type": "application/octet-stream" },
+        body: blob,
+      });
+      if (res.ok) {
+        return;
+      }
+      // 4xx (salvo 408/429) no se arregla reintentando
+      if (res.status < 500 && res.status !== 408 && res.status !== 429) {
+        const data = await res.json().catch(() => ({}));
+        throw Object.assign(new Error(data?.message || "Chunk rechazado."), { fatal: true });
+      }
+    } catch (err) {
+      if (err?.fatal || attempt >= CHUNK_MAX_RETRIES) {
+        throw err;
+      }
+    }
+    await sleep(Math.min(30000, 500 * 2 ** attempt));
+  }
+}
+
+async function uploadChunked(kind, file, fields, onProgress) {
+  const session = await initOrResumeUpload(kind, file, fields);
+  const { upload_id: uploadId, chunk_size: chunkSize, total_chunks: totalChunks } = session;
+
+  const done = new Set(session.received || []);
+  const pending = [];
+  for (let i = 0; i < totalChunks; i++) {
+    if (!done.has(i)) pending.push(i);
+  }
+
+  const report = () => onProgress?.(Math.round((100 * done.size) / totalChunks));
+  report();
+
+  // Paralelismo acotado: N "carriles" consumiendo la cola de chunks
+  async function lane() {
+    while (pending.length) {
+      const index = pending.shift();
+      const start = index * chunkSize;
+      await putChunk(uploadId, index, file.slice(start, start + chunkSize));
+      done.add(index);
+      report();
+    }
+  }
+  await Promise.all(Array.from({ length: Math.min(CHUNK_PARALLELISM, pending.length) }, lane));
+
+  const { res, data } = await fetchJson(`/api/uploads/${uploadId}/finalize`, { method: "POST" });
+  if (res.status !== 409 || data?.duplicate) {
+    localStorage.removeItem(uploadResumeKey(kind, file));
+  }
+  return { res, data };
+}
+
+// Subida directa a GCS con URL firmada (el servicio no ve los bytes)
+const DIRECT_CHUNK_SIZE = 32 * 256 * 1024; // múltiplo de 256 KiB (requisito GCS)
+
+function uploadMode() {
+  return document.body.dataset.uploadMode || "multipart";
+}
+
+// Offset confirmado por la sesión resumable (308 + cabecera Range)
+async function directSessionOffset(sessionUrl, size) {
+  const res = await fetch(sessionUrl, {
+    method: "PUT",
+    headers: { "Content-Range": `bytes */${size}` },
+  });
+  if (res.status === 200 || res.status === 201) {
+    return size;
+  }
+  if (res.status !== 308) {
+    throw new Error("La sesión de subida ha caducado.");
+  }
+  const range = res.headers.get("Range");
+  return range ? Number(range.split("-")[1]) + 1 : 0;
+}
+
+async function uploadDirect(kind, file, fields, onProgress) {
+  const key = `${uploadResumeKey(kind, file)}:direct`;
+  let state = JSON.parse(localStorage.getItem(key) || "null");
+  let offset = 0;
+
+  if (state) {
+    try {
+      offset = await directSessionOffset(state.sessionUrl, file.size);
+    } catch (err) {
+      localStorage.removeItem(key);
+      state = null;
+      offset = 0;
+    }
+  }
+
+  if (!state) {
+    const { res, data } = await fetchJson("/api/direct-uploads", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ kind, filename: file.name, content_type: file.type || "", ...fields }),
+    });
+    if (!res.ok || !data.ok) {
+      throw new Error(data?.message || "No se pudo iniciar la subida.");
+    }
+
+    const start = await fetch(data.upload.url, {
+      method: data.upload.method,
+      headers: data.upload.headers,
+      body: data.upload.body ?? undefined,
+    });
+    const sessionUrl = start.headers.get("Location");
+    if (!start.ok || !sessionUrl) {
+      throw new Error("No se pudo abrir la sesión de subida en GCS.");
+    }
+    state = { sessionUrl, objectName: data.object_name };
+    localStorage.setItem(key, JSON.stringify(state));
+  }
+
+  // Las sesiones resumables de GCS son secuenciales
+  let retries = 0;
+  while (offset < file.size) {
+    onProgress?.(Math.round((100 * offset) / file.size));
+    const end = Math.min(offset + DIRECT_CHUNK_SIZE, file.size);
+    try {
+      const res = await fetch(state.sessionUrl, {
+        method: "PUT",
+        headers: { "Content-Range": `bytes ${offset}-${end - 1}/${file.size}` },
+        body: file.slice(offset, end),
+      });
+      if (res.status === 200 || res.status === 201) {
+        offset = file.size;
+      } else if (res.status === 308) {
+        const range = res.headers.get("Range");
+        offset = range ? Number(range.split("-")[1]) + 1 : 0;
+      } else {
+        throw new Error(`GCS respondió ${res.status}`);
+      }
+      retries = 0;
+    } catch (err) {
+      if (++retries > CHUNK_MAX_RETRIES) {
+        throw err;
+      }
+      await sleep(Math.min(30000, 500 * 2 ** retries));
+      offset = await directSessionOffset(state.sessionUrl, file.size);
+    }
+  }
+  onProgress?.(100);
+
+  const result = await fetchJson("/api/direct-uploads/finalize", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ object_name: state.objectName }),
+  });
+  if (result.res.ok) {
+    localStorage.removeItem(key);
+  }
+  return result;
+}
+
+// Modo streaming: el cuerpo es el archivo tal cual y el servicio lo
+// hashea y sube a GCS a la vez (sin spool en /tmp)
+async function uploadStream(kind, file, fields) {
+  const endpoint = kind === "video" ? "/api/upload-video" : "/api/upload-images-zip";
+  const params = new URLSearchParams({ filename: file.name, ...fields });
+  return fetchJson(`${endpoint}?${params}`, {
+    method: "POST",
+    headers: { "Content-Type": file.type || "application/octet-stream" },
+    body: file,
+  });
+}
+
+// Modo multipart (por defecto): un único POST con el formulario
+async function uploadMultipart(kind, file, fields) {
+  const endpoint = kind === "video" ? "/api/upload-video" : "/api/upload-images-zip";
+  const fd = new FormData();
+  fd.append(kind === "video" ? "video" : "zipfile", file);
+  for (const [key, value] of Object.entries(fields)) {
+    fd.append(key, value);
+  }
+  return fetchJson(endpoint, { method: "POST", body: fd });
+}
+
+function uploadFile(kind, file, fields, onProgress) {
+  if (uploadMode() === "stream") {
+    return uploadStream(kind, file, fields);
+  }
+  if (uploadMode() === "direct") {
+    return uploadDirect(kind, file, fields, onProgress);
+  }
+  if (uploadMode() === "chunked") {
+    return uploadChunked(kind, file, fields, onProgress);
+  }
+  return uploadMultipart(kind, file, fields);
+}
+
+// SHA-256 en el navegador (Web Worker, lectura por trozos)
+function hashFileInWorker(file, onProgress) {
+  return new Promise((resolve, reject) => {
+    const worker = new Worker(SHA256_WORKER_URL);
+    worker.onmessage = (event) => {
+      const msg = event.data || {};
+      if (msg.type === "progress") {
+        onProgress?.(Math.round((100 * msg.loaded) / Math.max(1, msg.total)));
+      } else if (msg.type === "done") {
+        worker.terminate();
+        resolve(msg.sha256);
+      } else if (msg.type === "error") {
+        worker.terminate();
+        reject(new Error(msg.message));
+      }
+    };
+    worker.onerror = (err) => {
+      worker.terminate();
+      reject(err);
+    };
+    worker.postMessage({ file });
+  });
+}
+
+// Pre-check: true si el vídeo ya existe. Ante cualquier fallo devuelve
+// false y se sube igualmente (el servidor vuelve a deduplicar).
+async function isKnownVideo(sha256) {
+  try {
+    const { res, data } = await fetchJson("/api/check-duplicate", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ kind: "video", sha256 }),
+    });
+    return res.ok && data?.ok && data.duplicate === true;
+  } catch (err) {
+    console.warn("check-duplicate failed", err);
+    return false;
+  }
+}
+
+// Ingesta asíncrona: el servicio responde 202 + ticket y se consulta
+// /api/ingest/<ticket> hasta llegar a una etapa final
+const INGEST_POLL_MS = 1500;
+const INGEST_STAGE_LABELS = {
+  queued: "En cola…",
+  checking: "Comprobando duplicados…",
+  uploading: "Preparando el archivo…",
+  dispatching: "Lanzando el procesamiento…",
+};
+
+async function followIngestTicket(result, onStage) {
+  let { res, data } = result;
+  if (res.status !== 202 || !data?.status_url) {
+    return result;
+  }
+
+  for (;;) {
+    onStage?.(INGEST_STAGE_LABELS[data.stage] || "Procesando…");
+    await sleep(INGEST_POLL_MS);
+
+    ({ res, data } = await fetchJson(data.status_url));
+    if (!res.ok) {
+      throw new Error(data?.message || "No se pudo consultar el estado de la ingesta.");
+    }
+    if (data.done) {
+      // Se normaliza al formato de la respuesta síncrona
+      const status = data.http_status || 500;
+      return { res: { status, ok: status < 400 }, data };
+    }
+  }
+}
+
 async function handleVideoUpload(e) {
   e.preventDefault();
 
@@ -53,16 +374,39 @@ async function handleVideoUpload(e) {
     return;
   }
 
-  const fd = new FormData();
-  fd.append("video", file);
-  fd.append("source_type", sourceType.value);
-  fd.append("provider", provider.value || "unknown");
-
   try {
+    setBusy("videoSubmitBtn", "videoStatusText", true, "Calculando hash…");
+
+    let sha256 = "";
+    try {
+      sha256 = await hashFileInWorker(file, (pct) =>
+        setBusy("videoSubmitBtn", "videoStatusText", true, `Calculando hash… ${pct}%`)
+      );
+    } catch (err) {
+      console.warn("client-side hashing failed", err);
+    }
+
+    if (sha256 && (await isKnownVideo(sha256))) {
+      setNotice("warn", "Duplicado", "Este vídeo ya existe. No se ha subido.");
+      return;
+    }
+
     setBusy("videoSubmitBtn", "videoStatusText", true, "Subiendo y verificando…");
 
-    const res = await fetch("/api/upload-video", { method: "POST", body: fd });
-    const data = await res.json().catch(() => ({}));
+    const fields = { source_type: sourceType.value, provider: provider.value || "unknown" };
+    if (sha256) {
+      fields.sha256 = sha256;
+    }
+
+    const { res, data } = await followIngestTicket(
+      await uploadFile(
+        "video",
+        file,
+        fields,
+        (pct) => setBusy("videoSubmitBtn", "videoStatusText", true, `Subiendo… ${pct}%`)
+      ),
+      (label) => setBusy("videoSubmitBtn", "videoStatusText", true, label)
+    );
 
     if (res.status === 409 && data?.duplicate) {
       setNotice("warn", "Duplicado", "Este vídeo ya existe. No se ha subido.");
@@ -99,8 +443,8 @@ async function handleZipUpload(e) {
 
   // Validación rápida de extensión
   const name = (file.name || "").toLowerCase();
-  if (!name.endsWith(".zip")) {
-    setNotice("err", "Error", "El archivo debe ser .zip");
+  if (!ARCHIVE_SUFFIXES.some((suffix) => name.endsWith(suffix))) {
+    setNotice("err", "Error", "El archivo debe ser .zip, .tar, .tar.gz o .tar.zst");
     return;
   }
 
@@ -110,16 +454,18 @@ async function handleZipUpload(e) {
     return;
   }
 
-  const fd = new FormData();
-  fd.append("zipfile", file);
-  fd.append("source_type", sourceType.value);
-  fd.append("dataset_name", dn);
-
   try {
     setBusy("zipSubmitBtn", "zipStatusText", true, "Subiendo ZIP…");
 
-    const res = await fetch("/api/upload-images-zip", { method: "POST", body: fd });
-    const data = await res.json().catch(() => ({}));
+    const { res, data } = await followIngestTicket(
+      await uploadFile(
+        "images_zip",
+        file,
+        { source_type: sourceType.value, dataset_name: dn },
+        (pct) => setBusy("zipSubmitBtn", "zipStatusText", true, `Subiendo ZIP… ${pct}%`)
+      ),
+      (label) => setBusy("zipSubmitBtn", "zipStatusText", true, label)
+    );
 
     if (!res.ok || !data.ok) {
       throw new Error(data?.message || "Ha ocurrido un error durante el proceso.");
@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Los tests importan src.* y app desde la raíz del repo
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from tests.fake_gcs import FakeGCS  # noqa: E402
+
+
+@pytest.fixture
+def fake_gcs(monkeypatch):
+    """GCS falso en memoria; los clientes de storage lo usan vía emulador."""
+    server = FakeGCS().start()
+    monkeypatch.setenv("STORAGE_EMULATOR_HOST", server.url)
+    monkeypatch.setenv("GCP_PROJECT", "test-project")
+    monkeypatch.setenv("GCS_BUCKET", "test-bucket")
+    yield server
+    server.stop()
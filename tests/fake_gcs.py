@@ -0,0 +1,342 @@
+"""
+Servidor HTTP mínimo que imita la API JSON de GCS para los tests (se usa
+con STORAGE_EMULATOR_HOST). Guarda los objetos en memoria y cubre lo que
+usa el repo: metadatos, listado por prefijo, descarga con Range, subida
+simple / multipart (con ifGenerationMatch) / resumable, PATCH de metadatos
+con ifMetagenerationMatch y DELETE.
+"""
+
+from __future__ import annotations
+
+import email.parser
+import email.policy
+import json
+import re
+import threading
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+_OBJECT_PATH = re.compile(r"^(?:/download)?/storage/v1/b/([^/]+)/o/(.+)$")
+_LIST_PATH = re.compile(r"^/storage/v1/b/([^/]+)/o$")
+_UPLOAD_PATH = re.compile(r"^/upload/storage/v1/b/([^/]+)/o$")
+
+
+@dataclass
+class FakeObject:
+    data: bytes
+    content_type: str = "application/octet-stream"
+    metadata: Dict[str, str] = field(default_factory=dict)
+    generation: int = 1
+    metageneration: int = 1
+
+
+@dataclass
+class _ResumableSession:
+    bucket: str
+    name: str
+    content_type: str
+    metadata: Dict[str, str]
+    data: bytearray = field(default_factory=bytearray)
+
+
+class FakeGCS:
+    """Arranca en un puerto libre; url para STORAGE_EMULATOR_HOST."""
+
+    def __init__(self) -> None:
+        self.objects: Dict[Tuple[str, str], FakeObject] = {}
+        self.sessions: Dict[str, _ResumableSession] = {}
+        self.media_requests = 0
+        self.media_bytes = 0
+        self._generation = 0
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeGCS":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def put(
+        self,
+        bucket: str,
+        name: str,
+        data: bytes,
+        *,
+        content_type: str = "application/octet-stream",
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> FakeObject:
+        with self.lock:
+            self._generation += 1
+            obj = FakeObject(
+                data=bytes(data),
+                content_type=content_type,
+                metadata=dict(metadata or {}),
+                generation=self._generation,
+            )
+            self.objects[(bucket, name)] = obj
+            return obj
+
+    def get(self, bucket: str, name: str) -> Optional[FakeObject]:
+        with self.lock:
+            return self.objects.get((bucket, name))
+
+    def resource(self, bucket: str, name: str, obj: FakeObject) -> Dict:
+        return {
+            "kind": "storage#object",
+            "id": f"{bucket}/{name}/{obj.generation}",
+            "bucket": bucket,
+            "name": name,
+            "size": str(len(obj.data)),
+            "contentType": obj.content_type,
+            "generation": str(obj.generation),
+            "metageneration": str(obj.metageneration),
+            "metadata": dict(obj.metadata),
+        }
+
+
+def _handler(gcs: FakeGCS):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        # --- respuestas ---
+
+        def _send(self, status: int, body: bytes = b"", headers=None) -> None:
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, status: int, payload: Dict, headers=None) -> None:
+            self._send(
+                status,
+                json.dumps(payload).encode(),
+                {"Content-Type": "application/json", **(headers or {})},
+            )
+
+        def _error(self, status: int) -> None:
+            self._json(status, {"error": {"code": status, "message": "fake"}})
+
+        def _body(self) -> bytes:
+            n = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(n) if n else b""
+
+        def _object(self):
+            u = urlparse(self.path)
+            m = _OBJECT_PATH.match(u.path)
+            if not m:
+                return None, None, None, parse_qs(u.query)
+            bucket, name = unquote(m.group(1)), unquote(m.group(2))
+            return bucket, name, gcs.get(bucket, name), parse_qs(u.query)
+
+        def _generation_matches(self, bucket, name, expected) -> bool:
+            # ifGenerationMatch (0 = solo si no existe); si no, responde 412
+            if expected is None:
+                return True
+            obj = gcs.get(bucket, name)
+            current = obj.generation if obj is not None else 0
+            if int(expected) == current:
+                return True
+            self._error(412)
+            return False
+
+        # --- verbos ---
+
+        def _list(self, bucket: str, q: Dict) -> None:
+            prefix = (q.get("prefix") or [""])[0]
+            start = (q.get("startOffset") or [""])[0]
+            with gcs.lock:
+                names = sorted(
+                    n
+                    for b, n in gcs.objects
+                    if b == bucket and n.startswith(prefix) and n >= start
+                )
+                items = [
+                    gcs.resource(bucket, n, gcs.objects[(bucket, n)]) for n in names
+                ]
+            self._json(200, {"kind": "storage#objects", "items": items})
+
+        def do_GET(self) -> None:
+            u = urlparse(self.path)
+            m = _LIST_PATH.match(u.path)
+            if m:
+                self._list(unquote(m.group(1)), parse_qs(u.query))
+                return
+            bucket, name, obj, q = self._object()
+            if obj is None:
+                self._error(404)
+                return
+            if q.get("generation") and int(q["generation"][0]) != obj.generation:
+                self._error(404)
+                return
+            if q.get("alt") != ["media"]:
+                self._json(200, gcs.resource(bucket, name, obj))
+                return
+
+            size = len(obj.data)
+            rng = self.headers.get("Range")
+            start, end = 0, size - 1
+            if rng:
+                a, b = rng.split("=", 1)[1].split("-")
+                start, end = int(a), min(int(b) if b else size - 1, size - 1)
+            data = obj.data[start : end + 1]
+            with gcs.lock:
+                gcs.media_requests += 1
+                gcs.media_bytes += len(data)
+            headers = {"Content-Type": obj.content_type}
+            if rng:
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            self._send(206 if rng else 200, data, headers)
+
+        def do_PATCH(self) -> None:
+            bucket, name, obj, q = self._object()
+            if obj is None:
+                self._error(404)
+                return
+            patch = json.loads(self._body() or b"{}")
+            with gcs.lock:
+                expected = q.get("ifMetagenerationMatch")
+                if expected and int(expected[0]) != obj.metageneration:
+                    self._error(412)
+                    return
+                if "metadata" in patch:
+                    merged = {**obj.metadata, **(patch["metadata"] or {})}
+                    obj.metadata = {k: v for k, v in merged.items() if v is not None}
+                obj.metageneration += 1
+            self._json(200, gcs.resource(bucket, name, obj))
+
+        def do_DELETE(self) -> None:
+            bucket, name, obj, _ = self._object()
+            if obj is None:
+                self._error(404)
+                return
+            with gcs.lock:
+                gcs.objects.pop((bucket, name), None)
+            self._send(204)
+
+        def do_POST(self) -> None:
+            u = urlparse(self.path)
+            q = parse_qs(u.query)
+            m = _UPLOAD_PATH.match(u.path)
+            if not m:
+                self._error(404)
+                return
+            bucket = unquote(m.group(1))
+            upload_type = (q.get("uploadType") or [""])[0]
+            body = self._body()
+            if_match = (q.get("ifGenerationMatch") or [None])[0]
+
+            if upload_type == "media":
+                name = q["name"][0]
+                if not self._generation_matches(bucket, name, if_match):
+                    return
+                ctype = self.headers.get("Content-Type") or "application/octet-stream"
+                obj = gcs.put(bucket, name, body, content_type=ctype)
+                self._json(200, gcs.resource(bucket, name, obj))
+                return
+
+            if upload_type == "multipart":
+                meta, data, ctype = _parse_multipart(
+                    self.headers.get("Content-Type", ""), body
+                )
+                name = meta.get("name") or q["name"][0]
+                if not self._generation_matches(bucket, name, if_match):
+                    return
+                obj = gcs.put(
+                    bucket,
+                    name,
+                    data,
+                    content_type=meta.get("contentType") or ctype,
+                    metadata=meta.get("metadata"),
+                )
+                self._json(200, gcs.resource(bucket, name, obj))
+                return
+
+            if upload_type == "resumable":
+                meta = json.loads(body or b"{}")
+                name = meta.get("name") or q["name"][0]
+                session_id = uuid.uuid4().hex
+                with gcs.lock:
+                    gcs.sessions[session_id] = _ResumableSession(
+                        bucket=bucket,
+                        name=name,
+                        content_type=meta.get("contentType")
+                        or self.headers.get("X-Upload-Content-Type")
+                        or "application/octet-stream",
+                        metadata=dict(meta.get("metadata") or {}),
+                    )
+                location = (
+                    f"{gcs.url}/upload/storage/v1/b/{quote(bucket, safe='')}/o"
+                    f"?uploadType=resumable&upload_id={session_id}"
+                )
+                self._send(200, b"", {"Location": location})
+                return
+
+            self._error(400)
+
+        def do_PUT(self) -> None:
+            q = parse_qs(urlparse(self.path).query)
+            session_id = (q.get("upload_id") or [""])[0]
+            with gcs.lock:
+                session = gcs.sessions.get(session_id)
+            if session is None:
+                self._error(404)
+                return
+
+            body = self._body()
+            total = None
+            crange = self.headers.get("Content-Range", "")
+            m = re.match(r"bytes (\*|(\d+)-(\d+))/(\*|\d+)", crange)
+            if m:
+                if m.group(2) is not None and int(m.group(2)) != len(session.data):
+                    self._error(400)
+                    return
+                total = None if m.group(4) == "*" else int(m.group(4))
+            session.data += body
+
+            if total is None or len(session.data) < total:
+                headers = {}
+                if session.data:
+                    headers["Range"] = f"bytes=0-{len(session.data) - 1}"
+                self._send(308, b"", headers)
+                return
+
+            with gcs.lock:
+                gcs.sessions.pop(session_id, None)
+            obj = gcs.put(
+                session.bucket,
+                session.name,
+                bytes(session.data),
+                content_type=session.content_type,
+                metadata=session.metadata,
+            )
+            self._json(200, gcs.resource(session.bucket, session.name, obj))
+
+    return Handler
+
+
+def _parse_multipart(content_type: str, body: bytes) -> Tuple[Dict, bytes, str]:
+    """(metadatos JSON, bytes, content-type) de una subida multipart/related."""
+    raw = b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(raw)
+    parts = list(msg.iter_parts())
+    meta = json.loads(parts[0].get_payload(decode=True) or b"{}")
+    data = parts[1].get_payload(decode=True) or b""
+    return meta, data, parts[1].get_content_type()
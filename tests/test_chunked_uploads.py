@@ -0,0 +1,45 @@
+import hashlib
+
+import pytest
+
+from src.uploads.chunked import UploadSessionError, UploadSessionStore
+
+
+def make_store(tmp_path, **kwargs) -> UploadSessionStore:
+    return UploadSessionStore(
+        spool_dir=str(tmp_path), chunk_size=4, ttl_s=3600, **kwargs
+    )
+
+
+def test_out_of_order_chunks_hash_whole_file(tmp_path):
+    data = b"0123456789"
+    store = make_store(tmp_path)
+    session = store.create(kind="video", filename="a.mp4", total_size=10, fields={})
+
+    for index in (2, 0, 1, 1):  # desordenado y con un reintento
+        start = index * session.chunk_size
+        session.write_chunk(index, data[start : start + session.chunk_size])
+
+    assert session.complete
+    assert session.digest() == hashlib.sha256(data).hexdigest()
+    assert session.spool_path.read_bytes() == data
+
+
+def test_rejects_uploads_over_max_size(tmp_path):
+    store = make_store(tmp_path, max_size=8)
+    with pytest.raises(UploadSessionError):
+        store.create(kind="video", filename="a.mp4", total_size=9, fields={})
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_caps_concurrent_sessions(tmp_path):
+    store = make_store(tmp_path, max_sessions=2)
+    first = store.create(kind="video", filename="a.mp4", total_size=4, fields={})
+    store.create(kind="video", filename="b.mp4", total_size=4, fields={})
+    with pytest.raises(UploadSessionError):
+        store.create(kind="video", filename="c.mp4", total_size=4, fields={})
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # Al terminar una sesión queda hueco para otra
+    store.discard(first.upload_id)
+    store.create(kind="video", filename="c.mp4", total_size=4, fields={})
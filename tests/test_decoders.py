@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from src.pipelines.decoders import ffmpeg_available, open_decoder
+
+cv2 = pytest.importorskip("cv2")
+
+pytestmark = pytest.mark.skipif(not ffmpeg_available(), reason="ffmpeg no está")
+
+
+@pytest.fixture
+def video(tmp_path):
+    """Vídeo sintético: un cuadrado de color que se mueve sobre gris."""
+    path = tmp_path / "v.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 10, (96, 64))
+    for i in range(12):
+        frame = np.full((64, 96, 3), 90, dtype=np.uint8)
+        frame[10:40, 5 + 6 * i : 35 + 6 * i] = (40, 160, 220)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def decode(name, path, **kwargs):
+    decoder = open_decoder(name, path, 48, **kwargs)
+    try:
+        return [(df, df.load_full()) for df in decoder.frames()]
+    finally:
+        decoder.close()
+
+
+def test_ffmpeg_frames_match_opencv(video):
+    ffmpeg, opencv = decode("ffmpeg", video), decode("opencv", video)
+
+    assert len(ffmpeg) == len(opencv) == 12
+    for (a, full_a), (b, full_b) in zip(ffmpeg, opencv):
+        assert a.timestamp_ms == b.timestamp_ms
+        assert a.gray_small.shape == b.gray_small.shape == (32, 48)
+        assert full_a.shape == full_b.shape == (64, 96, 3)
+        # Misma escala de gris y mismo color salvo redondeos de conversión
+        assert np.abs(a.gray_small.astype(int) - b.gray_small).mean() < 3
+        assert np.abs(full_a.astype(int) - full_b).mean() < 3
+
+
+def test_ffmpeg_start_ms_keeps_absolute_timestamps(video):
+    frames = decode("ffmpeg", video, start_ms=500)
+    assert [df.timestamp_ms for df, _ in frames] == list(range(500, 1200, 100))
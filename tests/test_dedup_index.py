@@ -0,0 +1,68 @@
+from google.cloud import storage
+
+from src.config import get_settings
+from src.gcp.dedup_index import DedupIndex, UidIndex, UidLog
+
+BUCKET = "test-bucket"
+
+
+def make_log() -> UidLog:
+    return UidLog(storage.Client(project="test-project"), BUCKET, "tmp/dedup-log")
+
+
+def test_uid_log_reads_each_published_batch_once(fake_gcs):
+    worker, service = make_log(), make_log()
+    worker.publish("videos", ["a", "b"])
+    worker.publish("images", ["x"])
+
+    assert sorted(service.read_since("videos", 0.0)) == ["a", "b"]
+    assert service.read_since("videos", 0.0) == []
+
+    worker.publish("videos", ["c"])
+    assert service.read_since("videos", 0.0) == ["c"]
+    assert service.read_since("images", 0.0) == ["x"]
+
+
+def test_index_sees_job_inserts_after_refresh(fake_gcs):
+    worker, service = make_log(), make_log()
+    index = UidIndex(
+        "videos",
+        lambda: ["old"],
+        capacity=1000,
+        fp_rate=0.001,
+        ttl_s=3600,
+        refresher=lambda since: service.read_since("videos", since),
+        refresh_s=3600,  # los tests refrescan a mano
+    )
+    index._load()
+    assert index.might_contain("old") is True
+    assert index.might_contain("new") is False
+
+    # Un Job inserta y publica; el servicio lo ve en su siguiente lectura
+    worker.publish("videos", ["new"])
+    index._refresh()
+    assert index.might_contain("new") is True
+
+
+def test_index_not_loaded_defers_to_bigquery(monkeypatch):
+    index = UidIndex(
+        "videos", lambda: [], capacity=10, fp_rate=0.01, ttl_s=3600, refresh_s=3600
+    )
+    monkeypatch.setattr(index, "ensure_fresh", lambda: None)
+    assert index.might_contain("anything") is None
+
+
+def test_dedup_index_wires_log_readers(fake_gcs, monkeypatch):
+    monkeypatch.setenv("DEDUP_INDEX_ENABLED", "true")
+    settings = get_settings()
+    log = make_log()
+    index = DedupIndex(client=None, settings=settings, uid_log=log)
+    assert index.videos.refresher is not None
+    assert index.images.refresher is not None
+    # Con el log al día, la carga completa es poco frecuente
+    assert index.videos.ttl_s == index.images.ttl_s == settings.dedup_index_log_ttl_s
+    assert settings.dedup_index_log_ttl_s > settings.dedup_index_ttl_s
+
+    no_log = DedupIndex(client=None, settings=settings)
+    assert no_log.videos.refresher is None
+    assert no_log.videos.ttl_s == settings.dedup_index_ttl_s
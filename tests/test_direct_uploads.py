@@ -0,0 +1,136 @@
+import pytest
+import requests
+
+from src.gcp.run_jobs import CloudRunJobsRunner, RunJobResult
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def launched(fake_gcs, monkeypatch):
+    """Ejecuciones de Job lanzadas (sin llamar a Cloud Run)."""
+    runs = []
+
+    def run_job(self, *, job_name, env_overrides):
+        runs.append((job_name, dict(env_overrides)))
+        return RunJobResult(execution_name=f"exec-{len(runs)}")
+
+    monkeypatch.setattr(CloudRunJobsRunner, "run_job", run_job)
+    return runs
+
+
+@pytest.fixture
+def client(fake_gcs, launched, monkeypatch):
+    from google.cloud import bigquery
+
+    # app.py crea la app al importarse; BigQuery no hace falta aquí
+    monkeypatch.setattr(bigquery, "Client", lambda project=None: None)
+    import app as app_module
+
+    return app_module.create_app().test_client()
+
+
+def direct_upload(client, data: bytes, **fields) -> str:
+    """Pide la URL, sube como el navegador (resumable) y devuelve el objeto."""
+    res = client.post("/api/direct-uploads", json=fields)
+    assert res.status_code == 200, res.get_json()
+    body = res.get_json()
+    target = body["upload"]
+
+    start = requests.request(
+        target["method"], target["url"], headers=target["headers"], data=target["body"]
+    )
+    assert start.status_code == 200
+    put = requests.put(
+        start.headers["Location"],
+        data=data,
+        headers={"Content-Range": f"bytes 0-{len(data) - 1}/{len(data)}"},
+    )
+    assert put.status_code == 200
+    return body["object_name"]
+
+
+def test_direct_upload_finalize_launches_job_once(client, fake_gcs, launched):
+    object_name = direct_upload(
+        client,
+        b"PK fake zip",
+        kind="images_zip",
+        filename="fotos.zip",
+        source_type="public",
+        dataset_name="mi dataset",
+    )
+    assert object_name.startswith("tmp/zips/direct/")
+    assert fake_gcs.get(BUCKET, object_name).metadata["kind"] == "images_zip"
+
+    first = client.post(
+        "/api/direct-uploads/finalize", json={"object_name": object_name}
+    )
+    again = client.post(
+        "/api/direct-uploads/finalize", json={"object_name": object_name}
+    )
+
+    assert first.status_code == 200
+    assert "ya iniciado" not in first.get_json()["message"]
+    assert again.status_code == 200
+    assert "ya iniciado" in again.get_json()["message"]
+    assert len(launched) == 1
+    env = launched[0][1]
+    assert env["INPUT_GCS_URI"] == f"gs://{BUCKET}/{object_name}"
+    assert env["INPUT_DATASET_NAME"] == "mi dataset"
+    assert env["INPUT_ORIGINAL_FILENAME"] == "fotos.zip"
+
+
+def test_finalize_incomplete_upload_is_retryable(client, launched):
+    res = client.post(
+        "/api/direct-uploads",
+        json={
+            "kind": "video",
+            "filename": "a.mp4",
+            "source_type": "public",
+        },
+    )
+    object_name = res.get_json()["object_name"]
+
+    res = client.post("/api/direct-uploads/finalize", json={"object_name": object_name})
+    assert res.status_code == 409
+    assert launched == []
+
+
+def test_finalize_rejects_bad_metadata_and_deletes_object(client, fake_gcs, launched):
+    object_name = "tmp/zips/direct/forged.zip"
+    fake_gcs.put(
+        BUCKET,
+        object_name,
+        b"data",
+        metadata={
+            "kind": "video",
+            "source_type": "public",
+        },
+    )
+
+    res = client.post("/api/direct-uploads/finalize", json={"object_name": object_name})
+    assert res.status_code == 400
+    assert fake_gcs.get(BUCKET, object_name) is None
+    assert launched == []
+
+    # Un reintento no responde "ya iniciado": el objeto ya no existe
+    res = client.post("/api/direct-uploads/finalize", json={"object_name": object_name})
+    assert res.status_code == 409
+
+
+def test_tar_zst_rejected_before_upload_without_zstandard(client, monkeypatch):
+    from src.pipelines import archives
+
+    # Sin zstandard el Job no podría leerlo: se rechaza antes de aceptar bytes
+    monkeypatch.setattr(archives, "zstd_available", lambda: False)
+    res = client.post(
+        "/api/direct-uploads",
+        json={
+            "kind": "images_zip",
+            "filename": "fotos.tar.zst",
+            "source_type": "public",
+            "dataset_name": "ds",
+        },
+    )
+    assert res.status_code == 400
+    assert "Formato no soportado" in res.get_json()["message"]
@@ -0,0 +1,45 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from src.pipelines import encoders
+from src.pipelines.encoders import EncoderOptions, open_encoder
+
+
+@pytest.fixture(autouse=True)
+def fresh_warnings(monkeypatch):
+    monkeypatch.setattr(encoders, "_warned", set())
+
+
+def test_missing_turbojpeg_falls_back_and_warns_once(monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, "turbojpeg", None)
+
+    first = open_encoder("turbojpeg", EncoderOptions())
+    second = open_encoder("turbojpeg", EncoderOptions())
+
+    assert first.name == second.name == "opencv"
+    out = capsys.readouterr().out
+    assert out.count("[WARN] FRAME_ENCODER=turbojpeg unavailable") == 1
+
+
+def test_turbojpeg_without_optimize_warns(monkeypatch, capsys):
+    class Handle:
+        def encode(self, frame, **kwargs):
+            return b"\xff\xd8jpeg"
+
+    fake = types.SimpleNamespace(
+        TurboJPEG=Handle,
+        TJSAMP_420=2,
+        TJSAMP_422=1,
+        TJSAMP_444=0,
+        TJPF_BGR=1,
+    )
+    monkeypatch.setitem(sys.modules, "turbojpeg", fake)
+
+    encoder = open_encoder("turbojpeg", EncoderOptions(optimize=True))
+
+    assert encoder.name == "turbojpeg"
+    assert encoder.encode(np.zeros((4, 4, 3), np.uint8)) == b"\xff\xd8jpeg"
+    assert "FRAME_JPEG_OPTIMIZE" in capsys.readouterr().out
@@ -0,0 +1,112 @@
+import io
+import random
+import threading
+import zipfile
+from concurrent.futures import Future
+
+import pytest
+
+from src.gcp.storage_client import GCSObject, StorageClient
+
+BUCKET = "test-bucket"
+BLOCK = 64 * 1024
+
+
+@pytest.fixture
+def storage(fake_gcs):
+    return StorageClient(project_id="test-project")
+
+
+def put_random(fake_gcs, name: str, size: int, seed: int = 0) -> bytes:
+    data = random.Random(seed).randbytes(size)
+    fake_gcs.put(BUCKET, name, data)
+    return data
+
+
+def test_random_seeks_are_byte_exact(fake_gcs, storage):
+    data = put_random(fake_gcs, "obj.bin", 5 * BLOCK + 123)
+    rnd = random.Random(1)
+
+    with storage.open_ranged(
+        GCSObject(BUCKET, "obj.bin"), block_size=BLOCK, cache_blocks=2
+    ) as reader:
+        assert reader.size == len(data)
+        for _ in range(300):
+            pos = rnd.randrange(0, len(data) + 10)
+            n = rnd.choice([1, 17, BLOCK - 1, BLOCK, 2 * BLOCK + 5, 4 * BLOCK])
+            whence = rnd.choice([io.SEEK_SET, io.SEEK_CUR, io.SEEK_END])
+            offset = {
+                io.SEEK_SET: pos,
+                io.SEEK_CUR: pos - reader.tell(),
+                io.SEEK_END: pos - len(data),
+            }[whence]
+            assert reader.seek(offset, whence) == pos
+            assert reader.read(n) == data[pos : pos + n]
+            assert reader.tell() == min(pos + n, max(pos, len(data)))
+
+        # Tramo exacto pedido con hint(): una petición, luego sin red
+        reader.hint(1000, 1000 + 3 * BLOCK)
+        requests = reader.stats().requests
+        reader.seek(1000)
+        assert reader.read(3 * BLOCK) == data[1000 : 1000 + 3 * BLOCK]
+        assert reader.stats().requests == requests
+
+
+def test_sequential_zip_read(fake_gcs, storage):
+    rnd = random.Random(2)
+    members = {
+        f"dir/f{i:02d}.bin": rnd.randbytes(rnd.randrange(1, 40_000)) for i in range(30)
+    }
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        for name, data in members.items():
+            z.writestr(name, data)
+    fake_gcs.put(BUCKET, "in.zip", buf.getvalue())
+
+    with storage.open_ranged(
+        GCSObject(BUCKET, "in.zip"), block_size=BLOCK, read_ahead=2
+    ) as reader:
+        with zipfile.ZipFile(reader) as z:
+            assert z.namelist() == list(members)
+            for info in z.infolist():
+                assert z.read(info) == members[info.filename]
+        stats = reader.stats()
+
+    # Cada bloque se pide una vez (lectura + read-ahead), nunca el objeto entero
+    assert stats.bytes <= len(buf.getvalue()) + BLOCK
+    assert fake_gcs.media_requests == stats.requests > 1
+
+
+def test_prefetch_of_finished_future_does_not_deadlock(fake_gcs, storage):
+    data = put_random(fake_gcs, "obj.bin", 4 * BLOCK)
+    reader = storage.open_ranged(
+        GCSObject(BUCKET, "obj.bin"), block_size=BLOCK, read_ahead=2
+    )
+
+    class DoneExecutor:
+        # El future ya ha terminado al volver de submit: el callback corre
+        # en el mismo hilo que lo registra
+        def submit(self, fn, *args):
+            fut = Future()
+            fut.set_result({})
+            return fut
+
+        def shutdown(self, **kwargs):
+            pass
+
+    reader._prefetcher = DoneExecutor()
+    out = []
+
+    def read_two_blocks():
+        # La segunda lectura es secuencial y lanza el read-ahead
+        out.append(reader.read(BLOCK))
+        out.append(reader.read(BLOCK))
+
+    t = threading.Thread(target=read_two_blocks, daemon=True)
+    t.start()
+    t.join(timeout=5)
+
+    assert not t.is_alive(), "readinto se bloqueó registrando el read-ahead"
+    assert out == [data[:BLOCK], data[BLOCK : 2 * BLOCK]]
+    assert reader._inflight == {}
+    reader.close()
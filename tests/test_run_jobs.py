@@ -0,0 +1,194 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.config import get_settings
+from src.gcp import run_jobs
+from src.gcp.run_jobs import CloudRunJobsRunner
+
+
+class FakeRunAPI:
+    """
+    Sustituto local de la API de Cloud Run: responde con los códigos de
+    `script` (200 cuando se agota) y cuenta peticiones y concurrencia.
+    """
+
+    def __init__(self, script=(), delay_s: float = 0.0) -> None:
+        self.script = list(script)
+        self.delay_s = delay_s
+        self.requests = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _handler(api: FakeRunAPI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def do_POST(self) -> None:
+            n = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(n) or b"{}")
+            with api.lock:
+                api.requests.append((self.path, dict(self.headers), body))
+                api.concurrent += 1
+                api.max_concurrent = max(api.max_concurrent, api.concurrent)
+                status, headers = api.script.pop(0) if api.script else (200, {})
+            time.sleep(api.delay_s)
+            with api.lock:
+                api.concurrent -= 1
+
+            payload = {"name": f"executions/exec-{len(api.requests)}"}
+            if status >= 400:
+                payload = {"error": {"code": status}}
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+@pytest.fixture
+def run_api(monkeypatch):
+    apis = []
+
+    def start(script=(), delay_s=0.0, anonymous=True):
+        api = FakeRunAPI(script, delay_s)
+        apis.append(api)
+        monkeypatch.setenv("GCP_PROJECT", "test-project")
+        monkeypatch.setenv("RUN_API_BASE_URL", api.url)
+        monkeypatch.setenv("RUN_API_ANONYMOUS", "true" if anonymous else "false")
+        return api
+
+    yield start
+    for api in apis:
+        api.stop()
+
+
+def runner_from_env(**kwargs) -> CloudRunJobsRunner:
+    # Igual que create_app, con esperas cortas
+    settings = get_settings()
+    return CloudRunJobsRunner(
+        project_id=settings.gcp_project,
+        region=settings.run_region,
+        api_base_url=settings.run_api_base_url,
+        anonymous=settings.run_api_anonymous,
+        max_concurrent_dispatch=kwargs.pop(
+            "max_concurrent_dispatch", settings.run_dispatch_max_concurrent
+        ),
+        max_retries=settings.run_dispatch_max_retries,
+        timeout_s=kwargs.pop("timeout_s", settings.run_dispatch_timeout_s),
+        backoff_base_s=0.01,
+        **kwargs,
+    )
+
+
+def test_run_job_retries_429_honouring_retry_after(run_api, monkeypatch):
+    api = run_api(script=[(429, {"Retry-After": "0.2"}), (503, {})])
+    runner = runner_from_env()
+    delays = []
+    backoff = runner._backoff_s
+    monkeypatch.setattr(
+        runner, "_backoff_s", lambda *a: delays.append(backoff(*a)) or delays[-1]
+    )
+
+    res = runner.run_job(job_name="ingest", env_overrides={"A": "1"})
+
+    assert res.execution_name == "executions/exec-3"
+    assert len(api.requests) == 3
+    assert delays[0] == pytest.approx(0.2)
+    assert runner.stats()["retries"] == 2
+    path, _, body = api.requests[0]
+    assert path == "/v2/projects/test-project/locations/us-central1/jobs/ingest:run"
+    env = body["overrides"]["containerOverrides"][0]["env"]
+    assert env == [{"name": "A", "value": "1"}]
+
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_run_job_does_not_retry_ambiguous_errors(run_api, status):
+    # La ejecución puede haberse creado: reintentar lanzaría otra
+    api = run_api(script=[(status, {})])
+    runner = runner_from_env()
+
+    with pytest.raises(RuntimeError, match=str(status)):
+        runner.run_job(job_name="ingest", env_overrides={})
+    assert len(api.requests) == 1
+    assert runner.stats()["failures"] == 1
+
+
+def test_run_job_does_not_retry_read_timeout(run_api):
+    api = run_api(delay_s=0.5)
+
+    with pytest.raises(RuntimeError):
+        runner_from_env(timeout_s=0.1).run_job(job_name="ingest", env_overrides={})
+    time.sleep(0.5)
+    assert len(api.requests) == 1
+
+
+def test_run_job_refreshes_token_once_on_401(run_api, monkeypatch):
+    api = run_api(script=[(401, {})], anonymous=False)
+
+    class Creds:
+        valid = True
+        expiry = None
+        token = "old"
+        refreshes = 0
+
+        def refresh(self, request):
+            self.refreshes += 1
+            self.token = f"new-{self.refreshes}"
+
+    creds = Creds()
+    monkeypatch.setattr(
+        run_jobs.google.auth, "default", lambda scopes=None: (creds, "test-project")
+    )
+
+    runner_from_env().run_job(job_name="ingest", env_overrides={})
+
+    auth = [headers["Authorization"] for _, headers, _ in api.requests]
+    assert auth == ["Bearer old", "Bearer new-1"]
+    assert creds.refreshes == 1
+
+
+def test_run_job_caps_concurrent_dispatches(run_api, monkeypatch):
+    monkeypatch.setenv("RUN_DISPATCH_MAX_CONCURRENT", "2")
+    api = run_api(delay_s=0.1)
+    runner = runner_from_env()
+
+    threads = [
+        threading.Thread(
+            target=runner.run_job, kwargs={"job_name": "ingest", "env_overrides": {}}
+        )
+        for _ in range(6)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(api.requests) == 6
+    assert api.max_concurrent == 2
+    assert runner.stats()["dispatched"] == 6
@@ -0,0 +1,185 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from src.config import get_settings
+from src.gcp.storage_client import GCSObject, StorageClient
+from src.pipelines import sharding
+from src.pipelines.keyframes import KeyframeIndex, Segment
+from src.pipelines.sharding import MERGE_LOCK_NAME, process_video_task_shard
+
+BUCKET = "test-bucket"
+VIDEO_UID = "v" * 64
+STARTED_AT = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+EXECUTION = "ingest-abc12"
+
+
+class FakeBigQuery:
+    """Tablas de vídeo en memoria, con las consultas que usa el merge."""
+
+    def __init__(self) -> None:
+        self.videos = []
+        self.images = []
+        self.lineage = []
+        self.derivatives = []
+
+    def video_exists(self, video_uid):
+        return any(r["video_uid"] == video_uid for r in self.videos)
+
+    def insert_raw_videos(self, rows) -> None:
+        self.videos.extend(rows)
+
+    def insert_raw_images_chunked(self, rows) -> None:
+        self.images.extend(rows)
+
+    def insert_frame_lineage_chunked(self, rows) -> None:
+        self.lineage.extend(rows)
+
+    def insert_image_derivatives_chunked(self, rows) -> None:
+        self.derivatives.extend(rows)
+
+    def images_exist(self, image_uids):
+        return {r["image_uid"] for r in self.images} & set(image_uids)
+
+    def frame_lineage_uids(self, video_uid):
+        return {r["image_uid"] for r in self.lineage if r["video_uid"] == video_uid}
+
+    def derivatives_exist(self, image_uids):
+        return {
+            (r["image_uid"], r["derivative"])
+            for r in self.derivatives
+            if r["image_uid"] in image_uids
+        }
+
+
+def segment_rows(index: int):
+    """Filas de un tramo: 2 frames con un derivado cada uno."""
+    images, lineage, derivatives = [], [], []
+    for k in range(2):
+        uid = f"img-{index}-{k}"
+        images.append({"image_uid": uid})
+        lineage.append(
+            {
+                "image_uid": uid,
+                "video_uid": VIDEO_UID,
+                "frame_idx": index * 10 + k,
+                "timestamp_ms": index * 1000 + k,
+            }
+        )
+        derivatives.append({"image_uid": uid, "derivative": "thumb"})
+    return images, lineage, derivatives
+
+
+@pytest.fixture
+def shard_env(fake_gcs, monkeypatch, tmp_path):
+    """Dos tramos sin ffprobe ni decodificación; raw__videos falla una vez."""
+    segments = [Segment(i, i * 1000, None, i * 1000) for i in range(2)]
+    monkeypatch.setattr(
+        sharding,
+        "shard_plan",
+        lambda path, settings, shards: (KeyframeIndex([0], [0]), segments),
+    )
+    monkeypatch.setattr(
+        sharding,
+        "extract_segment",
+        lambda settings, path, ctx, segment, index, storage: segment_rows(
+            segment.index
+        ),
+    )
+    monkeypatch.setattr(
+        sharding,
+        "promote_video",
+        lambda storage, *, ctx, bucket, **kw: GCSObject(bucket, "raw/videos/v.mp4"),
+    )
+    failures = {"insert_video_row": 0}
+
+    def insert_video_row(bq, *, ctx, gcs_video, local_video_path, nb_frames):
+        if failures["insert_video_row"] > 0:
+            failures["insert_video_row"] -= 1
+            raise RuntimeError("raw__videos caído")
+        bq.insert_raw_videos([{"video_uid": ctx.video_uid, "nb_frames": nb_frames}])
+
+    monkeypatch.setattr(sharding, "insert_video_row", insert_video_row)
+    video = tmp_path / "v.mp4"
+    video.write_bytes(b"video")
+    return failures, video
+
+
+def run_task(bq, video, task_index: int, execution: str = EXECUTION):
+    return process_video_task_shard(
+        settings=get_settings(),
+        storage=StorageClient(project_id="test-project"),
+        bq=bq,
+        local_video_path=video,
+        original_filename="v.mp4",
+        source_type="public",
+        provider="cam",
+        started_at=STARTED_AT,
+        task_index=task_index,
+        task_count=2,
+        video_uid=VIDEO_UID,
+        execution=execution,
+    )
+
+
+def shard_objects(fake_gcs):
+    return sorted(n for b, n in fake_gcs.objects if n.startswith("tmp/shards/"))
+
+
+def check_merged_once(bq, fake_gcs) -> None:
+    assert len(bq.videos) == 1 and bq.videos[0]["nb_frames"] == 4
+    for rows in (bq.images, bq.lineage, bq.derivatives):
+        assert len(rows) == 4
+    assert shard_objects(fake_gcs) == []
+
+
+def test_failed_merge_releases_lock_and_retry_completes(shard_env, fake_gcs):
+    failures, video = shard_env
+    failures["insert_video_row"] = 1
+    bq = FakeBigQuery()
+
+    assert run_task(bq, video, 1).finished is False
+    with pytest.raises(RuntimeError):
+        run_task(bq, video, 0)
+    # Filas ya insertadas, sin raw__videos y sin lock
+    assert len(bq.images) == 4 and bq.videos == []
+    assert not any(n.endswith(MERGE_LOCK_NAME) for n in shard_objects(fake_gcs))
+
+    # Reintento de Cloud Run del task 0: vuelve a fusionar sin duplicar
+    res = run_task(bq, video, 0)
+    assert res.finished is True
+    check_merged_once(bq, fake_gcs)
+
+
+def test_retry_takes_back_lock_left_by_killed_task(shard_env, fake_gcs):
+    _, video = shard_env
+    bq = FakeBigQuery()
+    prefix = f"tmp/shards/{VIDEO_UID}/20260102T030405Z/{EXECUTION}"
+
+    assert run_task(bq, video, 1).finished is False
+    # El task 0 murió a mitad de merge: lock y marcador quedan en GCS
+    fake_gcs.put(
+        BUCKET,
+        f"{prefix}/{MERGE_LOCK_NAME}",
+        json.dumps({"execution": EXECUTION, "task_index": 0}).encode(),
+    )
+    fake_gcs.put(BUCKET, f"{prefix}/merge.started", b"")
+    bq.insert_raw_images_chunked(segment_rows(0)[0])
+
+    # Otro task no lo toma; el reintento del dueño sí
+    assert run_task(bq, video, 1).finished is False
+    assert bq.videos == []
+    assert run_task(bq, video, 0).finished is True
+    check_merged_once(bq, fake_gcs)
+
+
+def test_new_execution_ignores_partials_of_previous_one(shard_env, fake_gcs):
+    _, video = shard_env
+    bq = FakeBigQuery()
+
+    assert run_task(bq, video, 1, execution="ingest-old").finished is False
+    # La ejecución nueva no cuenta el parcial de la anterior
+    assert run_task(bq, video, 0, execution="ingest-new").finished is False
+    assert run_task(bq, video, 1, execution="ingest-new").finished is True
+    assert len(bq.videos) == 1 and len(bq.lineage) == 4
@@ -0,0 +1,61 @@
+import hashlib
+
+import pytest
+
+from src.config import get_settings
+from src.gcp.storage_client import StorageClient
+from src.pipelines import video_worker
+from src.pipelines.video_worker import process_staged_video, retry_pending
+
+BUCKET = "test-bucket"
+STAGING = "tmp/videos/v.mp4"
+DATA = b"not really a video"
+VIDEO_UID = hashlib.sha256(DATA).hexdigest()
+CLAIM = f"tmp/claims/videos/{VIDEO_UID}.json"
+
+
+class FakeBigQuery:
+    def video_exists(self, video_uid):
+        return False
+
+
+@pytest.fixture
+def failing_upload(fake_gcs, monkeypatch):
+    """Staging en GCS y un procesado que siempre falla."""
+    fake_gcs.put(BUCKET, STAGING, DATA)
+
+    def process_video_upload(**kwargs):
+        raise RuntimeError("extracción caída")
+
+    monkeypatch.setattr(video_worker, "process_video_upload", process_video_upload)
+
+
+@pytest.mark.parametrize("attempt, pending", [("0", True), ("2", True), ("3", False)])
+def test_retry_pending_follows_task_attempt(monkeypatch, attempt, pending):
+    monkeypatch.setenv("VIDEO_JOB_MAX_RETRIES", "3")
+    monkeypatch.setenv("CLOUD_RUN_TASK_ATTEMPT", attempt)
+    assert retry_pending(get_settings()) is pending
+
+
+@pytest.mark.parametrize("resumable", [True, False])
+def test_failure_keeps_staging_and_claim_only_when_resumable(
+    failing_upload, fake_gcs, resumable
+):
+    with pytest.raises(RuntimeError):
+        process_staged_video(
+            settings=get_settings(),
+            storage=StorageClient(project_id="test-project"),
+            bq=FakeBigQuery(),
+            gcs_uri=f"gs://{BUCKET}/{STAGING}",
+            source_type="public",
+            provider="cam",
+            original_filename="v.mp4",
+            video_uid=VIDEO_UID,
+            slot="_test_worker",
+            task_shards=True,
+            resumable=resumable,
+        )
+
+    # Sin reintento pendiente no queda nada que bloquee una nueva subida
+    assert (fake_gcs.get(BUCKET, STAGING) is not None) is resumable
+    assert (fake_gcs.get(BUCKET, CLAIM) is not None) is resumable